@@ -0,0 +1,282 @@
+"""
+A local stand-in for Meta AI, used to benchmark the library offline.
+
+It serves the meta.ai landing page and replays GraphQL responses for useAbraAcceptTOSForTempUserMutation,
+useAbraSendMessageMutation (streamed, one snapshot of the whole message per line, like Meta AI does) and
+AbraSearchPluginDialogQuery, with configurable latency and chunk sizes.
+
+Run it standalone with `python benchmarks/fake_server.py --port 8000`.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Type
+
+# The package from the source tree, when run standalone rather than imported by run.py or the tests.
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+)
+
+from meta_ai_api import MetaAI  # noqa: E402
+
+WORDS = (
+    "The Golden State Warriors last game was against the Sacramento Kings at the Golden 1 "
+    "Center in Sacramento California and the Kings won the game with a score of 118 to 94"
+).split()
+
+
+def build_landing_page(size: int = 256 * 1024) -> bytes:
+    """
+    Builds a landing page carrying the tokens scraped by get_cookies, padded to the given size.
+
+    The tokens sit near the end of the document, as they do on https://www.meta.ai/.
+    """
+    tokens = (
+        '{"_js_datr":{"value":"fake_js_datr","expires":1},'
+        '"datr":{"value":"fake_datr","expires":1},'
+        '"abra_csrf":{"value":"fake_abra_csrf","expires":1}}'
+        '["LSD",[],{"token":"fake_lsd"},323]'
+        '["DTSGInitData",[],{"token":"fake_fb_dtsg","async_get_token":"x"},258]'
+    )
+    padding = "<script>" + "x" * max(size - len(tokens) - 64, 0) + "</script>"
+    return f"<html><head>{padding}</head><body>{tokens}</body></html>".encode()
+
+
+def build_message_stream(
+    conversation_id: str,
+    words: int = 200,
+    fetch_id: Optional[str] = "fake_fetch_id",
+) -> List[bytes]:
+    """
+    Builds the lines of a streamed useAbraSendMessageMutation response.
+
+    Every line holds a snapshot of the whole message so far, the last one is marked OVERALL_DONE.
+    """
+    offline_threading_id = str(int(time.time() * 1000) << 22)
+    lines = []
+    text = ""
+    for i in range(words):
+        text = f"{text} {WORDS[i % len(WORDS)]}" if text else WORDS[0]
+        done = i == words - 1
+        node = {
+            "bot_response_message": {
+                "id": f"{conversation_id}_{offline_threading_id}_0",
+                "streaming_state": "OVERALL_DONE" if done else "STREAMING",
+                "fetch_id": fetch_id if done else None,
+                "composed_text": {"content": [{"text": text}]},
+                "imagine_card": None,
+                "__typename": "XFBAbraMessage",
+            }
+        }
+        lines.append(json.dumps({"data": {"node": node}}).encode() + b"\n")
+    return lines
+
+
+def load_recording(path: str) -> List[bytes]:
+    """
+    Loads a recorded useAbraSendMessageMutation response body, one JSON document per line.
+    """
+    with open(path, "rb") as f:
+        return [
+            line if line.endswith(b"\n") else line + b"\n" for line in f if line.strip()
+        ]
+
+
+class FakeMetaAI:
+    """
+    Runs the stand-in server on a background thread.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        chunk_delay: float = 0.0,
+        chunk_size: Optional[int] = None,
+        answer_words: int = 200,
+        fetch_id: Optional[str] = "fake_fetch_id",
+        landing_page_size: int = 256 * 1024,
+        recording: Optional[str] = None,
+    ):
+        """
+        Args:
+            host (str): The interface to listen on. Defaults to 127.0.0.1.
+            port (int): The port to listen on, 0 for any free port. Defaults to 0.
+            latency (float): Seconds before the first byte of every response. Defaults to 0.
+            chunk_delay (float): Seconds between two chunks of a streamed message. Defaults to 0.
+            chunk_size (int): Bytes per chunk of a streamed message, None to send one line per chunk.
+            answer_words (int): The number of words, and snapshots, of a generated answer. Defaults to 200.
+            fetch_id (str): The fetch ID of generated answers, None for answers without sources.
+            landing_page_size (int): The size of the landing page in bytes. Defaults to 256 KiB.
+            recording (str): A recorded response body to replay instead of generated answers.
+        """
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+        self.answer_words = answer_words
+        self.fetch_id = fetch_id
+        self.landing_page = build_landing_page(landing_page_size)
+        self.recording = load_recording(recording) if recording else None
+        self.requests: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "FakeMetaAI":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def client_class(self, base: Type[MetaAI] = MetaAI) -> Type[MetaAI]:
+        """
+        Returns a subclass of the given client class sending every request to this server.
+        """
+        return type(
+            f"Local{base.__name__}",
+            (base,),
+            {
+                "meta_ai_url": f"{self.url}/",
+                "graphql_url": f"{self.url}/api/graphql/",
+                "graph_api_url": f"{self.url}/graphql?locale=user",
+            },
+        )
+
+    def message_lines(self, conversation_id: str) -> List[bytes]:
+        if self.recording is not None:
+            return self.recording
+        return build_message_stream(
+            conversation_id, words=self.answer_words, fetch_id=self.fetch_id
+        )
+
+    def _count(self, name: str):
+        with self._lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, body: bytes, content_type: str):
+                self.send_response(200)
+                self.send_header("content-type", content_type)
+                self.send_header("content-length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_chunk(self, data: bytes):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def _stream(self, lines: List[bytes]):
+                self.send_response(200)
+                self.send_header("content-type", "text/html; charset=utf-8")
+                self.send_header("transfer-encoding", "chunked")
+                self.end_headers()
+                if fake.chunk_size:
+                    body = b"".join(lines)
+                    chunks = [
+                        body[i : i + fake.chunk_size]
+                        for i in range(0, len(body), fake.chunk_size)
+                    ]
+                else:
+                    chunks = lines
+                for i, chunk in enumerate(chunks):
+                    if i and fake.chunk_delay:
+                        time.sleep(fake.chunk_delay)
+                    self._send_chunk(chunk)
+                self.wfile.write(b"0\r\n\r\n")
+
+            def do_GET(self):
+                fake._count("landing_page")
+                time.sleep(fake.latency)
+                self._send(fake.landing_page, "text/html; charset=utf-8")
+
+            def do_POST(self):
+                length = int(self.headers.get("content-length", 0))
+                form = urllib.parse.parse_qs(self.rfile.read(length).decode())
+                name = (form.get("fb_api_req_friendly_name") or [""])[0]
+                fake._count(name)
+                time.sleep(fake.latency)
+                if name == "useAbraAcceptTOSForTempUserMutation":
+                    # Every temp user gets a new token, as on Meta AI.
+                    access_token = f"fake_access_token_{uuid.uuid4().hex}"
+                    auth = {"new_temp_user_auth": {"access_token": access_token}}
+                    body = {"data": {"xab_abra_accept_terms_of_service": auth}}
+                    self._send(json.dumps(body).encode(), "application/json")
+                elif name == "useAbraSendMessageMutation":
+                    variables = json.loads((form.get("variables") or ["{}"])[0])
+                    conversation_id = variables.get("externalConversationId") or str(
+                        uuid.uuid4()
+                    )
+                    self._stream(fake.message_lines(conversation_id))
+                elif name == "AbraSearchPluginDialogQuery":
+                    references = [
+                        {"link": f"https://example.com/{i}", "title": f"Source {i}"}
+                        for i in range(4)
+                    ]
+                    body = {
+                        "data": {
+                            "message": {"searchResults": {"references": references}}
+                        }
+                    }
+                    self._send(json.dumps(body).encode(), "application/json")
+                else:
+                    self.send_error(404)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--chunk-delay", type=float, default=0.0)
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--answer-words", type=int, default=200)
+    parser.add_argument("--recording", default=None)
+    args = parser.parse_args()
+    server = FakeMetaAI(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        chunk_delay=args.chunk_delay,
+        chunk_size=args.chunk_size,
+        answer_words=args.answer_words,
+        recording=args.recording,
+    )
+    print(f"Serving a fake Meta AI on {server.url}")
+    server._server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
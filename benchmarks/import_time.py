@@ -0,0 +1,99 @@
+"""
+Measures the time and memory taken by `import meta_ai_api` in a fresh interpreter.
+
+Fails when the import takes longer than --max-ms, or loads a module that only some features need
+(HTML parsing for the Facebook login, aiohttp for the async client). Run it with
+`python benchmarks/import_time.py`.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict
+
+# Modules that must not be loaded by a plain `import meta_ai_api`.
+LAZY_MODULES = ("requests_html", "pyppeteer", "lxml", "bs4", "aiohttp", "asyncio")
+
+PROBE = """
+import json, sys, time, tracemalloc
+if sys.argv[1] == "memory":
+    tracemalloc.start()
+start = time.perf_counter()
+import meta_ai_api
+elapsed = time.perf_counter() - start
+_, peak = tracemalloc.get_traced_memory()
+print(json.dumps({"seconds": elapsed, "peak_bytes": peak, "modules": list(sys.modules)}))
+"""
+
+
+def measure_import(mode: str = "time") -> Dict:
+    """
+    Imports the library in a new interpreter, and returns the time, peak memory and loaded modules.
+
+    Tracing allocations slows the import down, so memory is only traced in the "memory" mode.
+    """
+    src = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"
+    )
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [src, env.get("PYTHONPATH")]))
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE, mode],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--max-ms", type=float, default=None, help="Fail above this import time"
+    )
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    runs = [measure_import() for _ in range(args.repeat)]
+    memory = measure_import("memory")
+    lazy_loaded = sorted(
+        {
+            module.split(".")[0]
+            for module in runs[0]["modules"]
+            if module.split(".")[0] in LAZY_MODULES
+        }
+    )
+    results = {
+        "import_ms": statistics.median(run["seconds"] for run in runs) * 1000,
+        "import_peak_kb": memory["peak_bytes"] / 1024,
+        "modules_loaded": len(runs[0]["modules"]),
+        "lazy_modules_loaded": lazy_loaded,
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, value in results.items():
+            if isinstance(value, float):
+                value = f"{value:.3f}"
+            print(f"{name:32} {value}")
+
+    failures = []
+    if lazy_loaded:
+        failures.append(f"modules that should load lazily were imported: {lazy_loaded}")
+    if args.max_ms is not None and results["import_ms"] > args.max_ms:
+        failures.append(
+            f"import took {results['import_ms']:.1f} ms, over the {args.max_ms} ms budget"
+        )
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Benchmarks the library against the local stand-in server of fake_server.py.
+
+Reports the cold start time, time to first token, streamed tokens per second, parse CPU time per MB of
+response body, the parse overhead of a metrics collector, and memory per concurrent conversation. Run it with `python benchmarks/run.py`.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+# The fake server next to this script, and the package from the source tree rather than an installed one.
+sys.path.insert(0, BENCHMARKS)
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARKS), "src"))
+
+from fake_server import FakeMetaAI, build_message_stream  # noqa: E402
+from meta_ai_api import MetaAI, MetricsCollector  # noqa: E402
+from meta_ai_api.hooks import RequestTrace  # noqa: E402
+
+
+def timed(function: Callable, repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def bench_cold_start(client_class, repeat: int) -> Dict[str, float]:
+    """
+    Time from constructing a client to holding an access token, as paid by the first prompt.
+    """
+
+    def cold_start():
+        client = client_class()
+        client.get_access_token()
+
+    timings = timed(cold_start, repeat)
+    return {"cold_start_s": statistics.median(timings)}
+
+
+def bench_streaming(client: MetaAI, repeat: int) -> Dict[str, float]:
+    """
+    Time to first token and tokens per second of streamed prompts, a token being a streamed chunk.
+    """
+    first_token, rates = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stream = client.prompt("What was the Warriors score last game?", stream=True)
+        next(stream)
+        first = time.perf_counter()
+        tokens = 1 + sum(1 for _ in stream)
+        end = time.perf_counter()
+        first_token.append(first - start)
+        rates.append(tokens / max(end - start, 1e-9))
+    return {
+        "time_to_first_token_s": statistics.median(first_token),
+        "tokens_per_s": statistics.median(rates),
+    }
+
+
+def bench_parse(client: MetaAI, words: int, repeat: int) -> Dict[str, float]:
+    """
+    CPU time spent parsing a response body, without any network, per MB of body.
+    """
+    lines = build_message_stream("conversation", words=words, fetch_id=None)
+    body = b"".join(lines)
+    megabytes = len(body) / 1e6
+
+    start = time.process_time()
+    for _ in range(repeat):
+        client.extract_data(client.extract_last_response(iter(lines)))
+    non_stream = (time.process_time() - start) / repeat
+
+    start = time.process_time()
+    for _ in range(repeat):
+        for _ in client.stream_response(iter(lines)):
+            pass
+    stream = (time.process_time() - start) / repeat
+    return {
+        "body_mb": megabytes,
+        "parse_cpu_s_per_mb": non_stream / megabytes,
+        "stream_parse_cpu_s_per_mb": stream / megabytes,
+    }
+
+
+def bench_hooks(client: MetaAI, words: int, repeat: int) -> Dict[str, float]:
+    """
+    Extra parse CPU time when every line of a response is reported to a metrics collector.
+    """
+    lines = build_message_stream("conversation", words=words, fetch_id=None)
+    metrics = MetricsCollector()
+
+    def parse(traced: bool) -> float:
+        start = time.process_time()
+        for _ in range(repeat):
+            chunks = iter(lines)
+            if traced:
+                chunks = RequestTrace(metrics, "useAbraSendMessageMutation").iterate(
+                    chunks
+                )
+            client.extract_last_response(chunks)
+        return time.process_time() - start
+
+    plain, traced = parse(False), parse(True)
+    return {"hooks_parse_overhead_pct": (traced - plain) / plain * 100}
+
+
+def bench_memory(client: MetaAI, conversations: int) -> Dict[str, float]:
+    """
+    Peak memory allocated while the given number of conversations are in flight, per conversation.
+    """
+    tracemalloc.start()
+    client.prompt_many(
+        ["What was the Warriors score last game?"] * conversations,
+        concurrency=conversations,
+    )
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"memory_per_conversation_kb": peak / conversations / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--cold-start-repeat", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--chunk-delay", type=float, default=0.0)
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--answer-words", type=int, default=200)
+    parser.add_argument("--parse-words", type=int, default=2000)
+    parser.add_argument("--conversations", type=int, default=16)
+    parser.add_argument("--recording", default=None)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    with FakeMetaAI(
+        latency=args.latency,
+        chunk_delay=args.chunk_delay,
+        chunk_size=args.chunk_size,
+        answer_words=args.answer_words,
+        recording=args.recording,
+    ) as server:
+        client_class = server.client_class()
+        results = bench_cold_start(client_class, args.cold_start_repeat)
+        client = client_class()
+        client.access_token = client.get_access_token()
+        results.update(bench_streaming(client, args.repeat))
+        results.update(bench_parse(client, args.parse_words, args.repeat))
+        results.update(bench_hooks(client, args.parse_words, args.repeat))
+        results.update(bench_memory(client, args.conversations))
+        results["requests"] = server.requests
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, value in results.items():
+        if isinstance(value, float):
+            value = f"{value:.6f}"
+        print(f"{name:32} {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -24,7 +24,6 @@ setuptools.setup(
         "Intended Audience :: Developers",
         "Topic :: Software Development :: Build Tools",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.6",
         "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: 3.8",
         "Programming Language :: Python :: 3.9",
@@ -32,9 +31,12 @@ setuptools.setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    python_requires=">=3.6",
+    python_requires=">=3.7",
     extras_require={
         "dev": ["check-manifest"],
+        "async": ["aiohttp"],
+        "fast": ["orjson", "msgspec"],
+        "login": ["beautifulsoup4"],
     },
-    install_requires=["requests", "requests-html", "lxml_html_clean"],
+    install_requires=["requests"],
 )
@@ -1,2 +1,28 @@
 __version__ = "1.2.5"
 from .main import MetaAI  # noqa
+from .conversation import Conversation  # noqa
+from .session_pool import SessionPool  # noqa
+from .balancer import Identity, MetaAIPool  # noqa
+from .credentials import FileCredentialStore, SQLiteCredentialStore  # noqa
+from .cache import MemoryResponseCache, SQLiteResponseCache  # noqa
+from .coalesce import SingleFlight  # noqa
+from .retry import RetryPolicy  # noqa
+from .ratelimit import RateLimiter, SQLiteRateLimiter  # noqa
+from .hooks import CompositeHooks, Hooks, OpenTelemetryHooks  # noqa
+from .metrics import MetricsCollector  # noqa
+from .control import Timeout, stop_after, stop_at  # noqa
+from .history import JSONLHistoryStore, SQLiteHistoryStore  # noqa
+from .media import MediaDownloader  # noqa
+
+
+def __getattr__(name):
+    # aiohttp is only installed with the "async" extra, and is slow to import.
+    if name == "AsyncMetaAI":
+        from .async_main import AsyncMetaAI
+
+        return AsyncMetaAI
+    if name == "AsyncMediaDownloader":
+        from .async_media import AsyncMediaDownloader
+
+        return AsyncMediaDownloader
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
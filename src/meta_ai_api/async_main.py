@@ -0,0 +1,1039 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import (
+    AsyncGenerator,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TYPE_CHECKING,
+)
+
+import aiohttp
+
+from meta_ai_api.control import Deadline, Timeout
+from meta_ai_api.async_media import AsyncMediaDownloader
+from meta_ai_api.conversation import Conversation
+from meta_ai_api.hooks import ACCESS_TOKEN, COOKIES, GRACE_SLEEP, RequestTrace
+from meta_ai_api.main import ACCESS_TOKEN_TTL, MetaAI
+from meta_ai_api.media import Progress
+from meta_ai_api.ratelimit import LOGIN, SEND, SOURCES
+from meta_ai_api.retry import RetryPolicy
+from meta_ai_api.utils import (
+    format_response,
+    generate_offline_threading_id,
+    get_fb_session,
+    get_response_errors,
+    LastResponseReader,
+    MessageDeltas,
+    raise_for_errors,
+    StreamText,
+    AsyncClosingStream,
+    TokenExtractor,
+)
+
+from meta_ai_api import codec, graphql
+from meta_ai_api.exceptions import (
+    AccessTokenRejected,
+    FacebookRegionBlocked,
+    MetaAIResponseError,
+)
+
+if TYPE_CHECKING:
+    from meta_ai_api.cache import ResponseCache
+    from meta_ai_api.coalesce import SingleFlight
+    from meta_ai_api.history import HistoryStore
+    from meta_ai_api.hooks import Hooks
+    from meta_ai_api.ratelimit import RateLimiter
+
+
+class AsyncMetaAI:
+    """
+    An asyncio counterpart of :class:`MetaAI`.
+
+    All network calls go through a single ``aiohttp.ClientSession``. Pass the same session to many
+    ``AsyncMetaAI`` instances to keep hundreds of conversations in flight over one connection pool.
+    """
+
+    meta_ai_url = "https://www.meta.ai/"
+    graphql_url = "https://www.meta.ai/api/graphql/"
+    graph_api_url = "https://graph.meta.ai/graphql?locale=user"
+
+    def __init__(
+        self,
+        fb_email: str = None,
+        fb_password: str = None,
+        proxy: dict = None,
+        session: Optional[aiohttp.ClientSession] = None,
+        cookies: dict = None,
+        access_token: str = None,
+        response_cache: "ResponseCache" = None,
+        retry_policy: RetryPolicy = None,
+        rate_limiter: "RateLimiter" = None,
+        token_ttl: float = ACCESS_TOKEN_TTL,
+        refresh_margin: float = 300,
+        hooks: "Hooks" = None,
+        history: "HistoryStore" = None,
+        single_flight: "SingleFlight" = None,
+    ):
+        self.session = session
+        self._owns_session = session is None
+        self.access_token = access_token
+        # When the access token expires, None when unknown, as for tokens passed in.
+        self.access_token_expires_at = None
+        self.token_ttl = token_ttl
+        self.refresh_margin = refresh_margin
+        self.fb_email = fb_email
+        self.fb_password = fb_password
+        self.proxy = proxy
+        self.response_cache = response_cache
+        self.retry_policy = (
+            retry_policy
+            if retry_policy is not None
+            else RetryPolicy(
+                transport_errors=(aiohttp.ClientError, asyncio.TimeoutError)
+            )
+        )
+        self.rate_limiter = rate_limiter
+        self.hooks = hooks
+        self.history = history
+        self.single_flight = single_flight
+        self._media_downloader = None
+
+        self.is_authed = fb_password is not None and fb_email is not None
+        self.account = fb_email if self.is_authed else "anonymous"
+        self.cookies = cookies
+        # Created on first use, to bind to the running event loop.
+        self._auth_lock: Optional[asyncio.Lock] = None
+        self._cookies_lock: Optional[asyncio.Lock] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        # The conversation prompted when no other one is given.
+        self._conversation = Conversation(self)
+
+    external_conversation_id = MetaAI.external_conversation_id
+    offline_threading_id = MetaAI.offline_threading_id
+
+    @staticmethod
+    def create_session(limit: int = 100) -> aiohttp.ClientSession:
+        """
+        Creates a connection pool suitable for sharing between many clients.
+
+        Cookies are always sent explicitly per request, so the session uses a dummy cookie jar to
+        avoid leaking cookies from one client to another.
+
+        Args:
+            limit (int): The maximum number of simultaneous connections. Defaults to 100.
+
+        Returns:
+            aiohttp.ClientSession: The shared session.
+        """
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=limit),
+            cookie_jar=aiohttp.DummyCookieJar(),
+            # Every line of a streamed message holds the whole message, allow long ones.
+            read_bufsize=1 << 20,
+            headers={
+                "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 "
+                "(KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
+            },
+        )
+
+    async def __aenter__(self) -> "AsyncMetaAI":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """
+        Closes the underlying session if it was created by this client.
+        """
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def conversation(
+        self, external_conversation_id: str = None, offline_threading_id: str = None
+    ) -> Conversation:
+        """
+        Creates a handle on a conversation, sharing this instance's session, cookies and access token.
+        No network call is made.
+
+        Args:
+            external_conversation_id (str): The ID of an existing conversation to continue, None to start
+                a new one with the first prompt.
+            offline_threading_id (str): The offline threading ID of the last message of the conversation.
+
+        Returns:
+            Conversation: The conversation, whose prompts are awaited like those of this instance.
+        """
+        return Conversation(self, external_conversation_id, offline_threading_id)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self.session is None:
+            self.session = self.create_session()
+        return self.session
+
+    @property
+    def _proxy_url(self) -> Optional[str]:
+        if not self.proxy:
+            return None
+        return self.proxy.get("https") or self.proxy.get("http")
+
+    async def _ensure_cookies(self) -> dict:
+        """
+        Returns the cookies of the client, scraping them first if needed. Tasks needing them at the same
+        time wait for a single scrape.
+        """
+        if self.cookies is not None:
+            return self.cookies
+        # Not the auth lock, held by _replace_access_token while it waits for the cookies.
+        if self._cookies_lock is None:
+            self._cookies_lock = asyncio.Lock()
+        async with self._cookies_lock:
+            if self.cookies is None:
+                self.cookies = await self.get_cookies()
+            return self.cookies
+
+    @staticmethod
+    async def _run_blocking(function: Callable, *args):
+        """
+        Runs a blocking call, such as the disk I/O of a history store or response cache, in the default
+        executor of the event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def _throttle(self, kind: str):
+        """
+        Waits for the rate limiter, if any, to let a request of the given kind through.
+        """
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire_async(kind)
+
+    async def _post(
+        self,
+        name: str,
+        url: str,
+        headers: dict,
+        payload: str,
+        deadline: Deadline = None,
+    ) -> Tuple[aiohttp.ClientResponse, Optional[RequestTrace]]:
+        """
+        Posts a GraphQL request, reporting it to the hooks if any.
+
+        Args:
+            deadline (Deadline): The time limits of the request, if any.
+
+        Returns:
+            tuple: The response, to read and release, and the trace to finish once its body is read,
+            None without hooks.
+        """
+        trace = (
+            RequestTrace(self.hooks, name, len(payload))
+            if self.hooks is not None
+            else None
+        )
+        session = self._get_session()
+        timeout = session.timeout
+        if deadline is not None:
+            # Limits left unset keep the defaults of the session.
+            remaining, limits = deadline.remaining(), deadline.timeout
+            timeout = aiohttp.ClientTimeout(
+                total=remaining if remaining is not None else timeout.total,
+                connect=(
+                    limits.connect if limits.connect is not None else timeout.connect
+                ),
+                sock_read=(
+                    limits.first_token
+                    if limits.first_token is not None
+                    else timeout.sock_read
+                ),
+                sock_connect=timeout.sock_connect,
+            )
+        try:
+            response = await session.post(
+                url,
+                headers=headers,
+                data=payload,
+                proxy=self._proxy_url,
+                timeout=timeout,
+            )
+        except Exception as e:
+            if trace is not None:
+                trace.finish(e)
+            raise
+        if trace is not None:
+            trace.first_byte(response.status)
+        return response, trace
+
+    def _phase(self, name: str, started_at: float):
+        if self.hooks is not None:
+            self.hooks.on_phase(name, time.perf_counter() - started_at)
+
+    def _on_retry(self, error: Exception, attempt: int):
+        if self.hooks is not None:
+            self.hooks.on_retry(error, attempt)
+
+    async def _ensure_access_token(self) -> str:
+        """
+        Returns a valid access token, bootstrapping it first if needed.
+
+        A token about to expire is still returned while a background task refreshes it, an expired one
+        is refreshed first. Tasks needing a token at the same time wait for a single refresh.
+        """
+        access_token, expires_at = self.access_token, self.access_token_expires_at
+        now = time.time()
+        if access_token and (
+            expires_at is None or now < expires_at - self.refresh_margin
+        ):
+            return access_token
+        if access_token and now < expires_at:
+            if self._refresh_task is None or self._refresh_task.done():
+                self._refresh_task = asyncio.ensure_future(
+                    self._refresh_quietly(access_token)
+                )
+            return access_token
+        return await self._replace_access_token(access_token)
+
+    async def _refresh_quietly(self, stale: str):
+        try:
+            await self._replace_access_token(stale)
+        except Exception as e:
+            # The token is still valid, the next prompt tries again.
+            logging.warning(f"Unable to refresh the Meta AI access token: {e}")
+
+    async def refresh_access_token(self) -> str:
+        """
+        Replaces the access token with a new one. Tasks refreshing it at the same time wait for a single
+        refresh.
+
+        Returns:
+            str: The new access token.
+        """
+        return await self._replace_access_token(self.access_token)
+
+    async def _replace_access_token(self, stale: Optional[str]) -> str:
+        """
+        Replaces a stale access token, or bootstraps the first one when it is None. If another task
+        already replaced it, the new token is returned without another request.
+        """
+        if self._auth_lock is None:
+            self._auth_lock = asyncio.Lock()
+        async with self._auth_lock:
+            if self.access_token and self.access_token != stale:
+                return self.access_token
+            self.access_token, self.access_token_expires_at = (
+                await self._new_access_token()
+            )
+            return self.access_token
+
+    async def get_access_token(self) -> str:
+        """
+        Retrieves an access token using Meta's authentication API, and keeps it for the next prompts.
+        Refreshes the token first if it expired.
+
+        Returns:
+            str: A valid access token.
+        """
+        return await self._ensure_access_token()
+
+    async def _new_access_token(self) -> Tuple[str, float]:
+        """
+        Returns a new access token from Meta's authentication API, with the time it expires at.
+        """
+        cookies = await self._ensure_cookies()
+        started_at = time.perf_counter()
+        operation = graphql.OPERATIONS[graphql.ACCEPT_TOS]
+        payload = operation.encode(cookies["lsd"], self.is_authed)
+        headers = {
+            **operation.headers,
+            "cookie": f'_js_datr={cookies["_js_datr"]}; '
+            f'abra_csrf={cookies["abra_csrf"]}; datr={cookies["datr"]};',
+        }
+
+        await self._throttle(LOGIN)
+        response, trace = await self._post(
+            operation.name, operation.url(self), headers, payload
+        )
+        async with response:
+            body = await response.read()
+        if trace is not None:
+            trace.finish(bytes_received=len(body))
+
+        try:
+            auth_json = codec.loads(body)
+        except codec.DecodeError:
+            raise FacebookRegionBlocked(
+                "Unable to receive a valid response from Meta AI. This is likely due to your region being blocked. "
+                "Try manually accessing https://www.meta.ai/ to confirm."
+            )
+
+        access_token = auth_json["data"]["xab_abra_accept_terms_of_service"][
+            "new_temp_user_auth"
+        ]["access_token"]
+        expires_at = time.time() + self.token_ttl
+
+        # Same grace period as MetaAI.get_access_token, without blocking the event loop.
+        self._phase(ACCESS_TOKEN, started_at)
+        slept_at = time.perf_counter()
+        await asyncio.sleep(1)
+        self._phase(GRACE_SLEEP, slept_at)
+
+        return access_token, expires_at
+
+    async def prompt(
+        self,
+        message: str,
+        stream: bool = False,
+        attempts: int = 0,
+        new_conversation: bool = False,
+        delta: bool = False,
+        conversation: Conversation = None,
+        timeout: Timeout or float = None,
+        stop: Callable[[str], bool] = None,
+        cancel: asyncio.Event = None,
+    ) -> Dict or AsyncGenerator[Dict, None]:
+        """
+        Sends a message to the Meta AI and returns the response.
+
+        Cancelling the task awaiting the prompt, or closing the async generator it streams, closes the
+        response right away.
+
+        Args:
+            message (str): The message to send.
+            stream (bool): Whether to stream the response or not. Defaults to False.
+            attempts (int): The number of attempts already made. Defaults to 0.
+            new_conversation (bool): Whether to start a new conversation or not. Defaults to False.
+            delta (bool): When streaming, whether to yield only the text added by each chunk instead of
+                the whole message so far. The last item holds the full message, sources and media.
+                Defaults to False.
+            conversation (Conversation): The conversation to send the message in, see `conversation`.
+                Defaults to the conversation of this instance.
+            timeout (Timeout or float): The time limits of the prompt, or its total time limit in
+                seconds. When streaming, the total limit also covers reading the stream. Defaults to none.
+            stop (Callable[[str], bool]): Called with the message received so far, stops reading the
+                response, and returns or yields the message as it is, once it returns True. See
+                `stop_after` and `stop_at`.
+            cancel (asyncio.Event): Cancels the prompt once set.
+
+        Returns:
+            dict: A dictionary containing the response message and sources, or an async generator
+            of such dictionaries when streaming.
+
+        Raises:
+            RetriesExhausted: If unable to obtain a valid response after several attempts.
+            CircuitOpen: If Meta AI failed too many times in a row recently.
+            DeadlineExceeded: If the total time limit passed.
+            PromptCancelled: If the prompt was cancelled.
+        """
+        if conversation is None:
+            conversation = self._conversation
+        starts_conversation = (
+            new_conversation or not conversation.external_conversation_id
+        )
+        cache_key = None
+        if self.response_cache is not None and not stream and starts_conversation:
+            # Only prompts starting a conversation are cached, follow-ups depend on its history.
+            cache_key = self.response_cache.prompt_key(
+                message, new_conversation, self.account
+            )
+            cached_response = await self._run_blocking(
+                self.response_cache.get, cache_key
+            )
+            if cached_response is not None:
+                return cached_response
+
+        deadline = None
+        if timeout is not None or cancel is not None:
+            deadline = Deadline(timeout, cancel)
+        if self.single_flight is not None and stop is None and starts_conversation:
+            # Identical prompts in flight share one request, run without the total limit of any
+            # caller, each caller waiting within its own.
+            flight_timeout = None
+            if deadline is not None:
+                flight_timeout = Timeout(
+                    deadline.timeout.connect, deadline.timeout.first_token
+                )
+            flight, owner = self.single_flight.join_async(
+                self.single_flight.prompt_key(message, stream, delta, self),
+                lambda: self.retry_policy.call_async(
+                    self._send_prompt,
+                    message,
+                    stream=stream,
+                    new_conversation=new_conversation,
+                    delta=delta,
+                    conversation=conversation,
+                    deadline=(
+                        Deadline(flight_timeout) if flight_timeout is not None else None
+                    ),
+                    attempts=attempts,
+                    on_retry=self._on_retry,
+                ),
+            )
+            response = (
+                flight.stream(deadline) if stream else await flight.result(deadline)
+            )
+            if not owner:
+                # The conversation of the caller is left as is, as on a cache hit.
+                return response
+        else:
+            response = await self.retry_policy.call_async(
+                self._send_prompt,
+                message,
+                stream=stream,
+                new_conversation=new_conversation,
+                delta=delta,
+                conversation=conversation,
+                deadline=deadline,
+                stop=stop,
+                attempts=attempts,
+                on_retry=self._on_retry,
+            )
+        if self.history is not None:
+            if stream:
+                return AsyncClosingStream(
+                    self._record_stream(conversation, message, response),
+                    response.aclose,
+                )
+            await self._run_blocking(
+                self.history.record,
+                conversation.external_conversation_id,
+                message,
+                response,
+            )
+        if cache_key is not None and not response.get("stopped"):
+            await self._run_blocking(self.response_cache.set, cache_key, response)
+        return response
+
+    async def _send_prompt(
+        self,
+        message: str,
+        stream: bool = False,
+        new_conversation: bool = False,
+        delta: bool = False,
+        conversation: Conversation = None,
+        deadline: Deadline = None,
+        stop: Callable[[str], bool] = None,
+    ) -> Dict or AsyncGenerator[Dict, None]:
+        """
+        Sends a message to the Meta AI once, without retrying.
+
+        Raises:
+            MetaAIResponseError: If Meta AI did not return a valid response.
+            DeadlineExceeded: If the total time limit passed, which also ends the retries.
+            PromptCancelled: If the prompt was cancelled.
+        """
+        if deadline is not None:
+            deadline.check()
+        if conversation is None:
+            conversation = self._conversation
+        cookies = await self._ensure_cookies()
+        if not conversation.external_conversation_id or new_conversation:
+            external_id = str(uuid.uuid4())
+            conversation.external_conversation_id = external_id
+        variables = graphql.OPERATIONS[graphql.SEND_MESSAGE].encode_variables(
+            message={"sensitive_string_value": message},
+            externalConversationId=conversation.external_conversation_id,
+            offlineThreadingId=generate_offline_threading_id(),
+        )
+        if self.is_authed:
+            return await self._post_message(
+                cookies["fb_dtsg"],
+                variables,
+                stream,
+                delta,
+                conversation,
+                deadline,
+                stop,
+            )
+
+        access_token = await self._ensure_access_token()
+        try:
+            return await self._post_message(
+                access_token,
+                variables,
+                stream,
+                delta,
+                conversation,
+                deadline,
+                stop,
+            )
+        except AccessTokenRejected:
+            # The token expired early or was revoked: refresh it once and resend, instead of retrying it.
+            logging.info("Meta AI rejected the access token, refreshing it.")
+            access_token = await self._replace_access_token(access_token)
+            return await self._post_message(
+                access_token,
+                variables,
+                stream,
+                delta,
+                conversation,
+                deadline,
+                stop,
+            )
+
+    async def _post_message(
+        self,
+        credential: str,
+        variables: str,
+        stream: bool,
+        delta: bool,
+        conversation: Conversation,
+        deadline: Optional[Deadline] = None,
+        stop: Optional[Callable[[str], bool]] = None,
+    ) -> Dict or AsyncGenerator[Dict, None]:
+        """
+        Posts a message and reads the response.
+
+        Raises:
+            AccessTokenRejected: If Meta AI rejected the access token.
+            MetaAIResponseError: If Meta AI did not return a valid response.
+        """
+        operation = graphql.OPERATIONS[graphql.SEND_MESSAGE]
+        payload = operation.encode(credential, self.is_authed, variables)
+        headers = operation.headers
+        if self.is_authed:
+            # Cookies are sent per request, the shared session never stores them.
+            headers = {**headers, "cookie": f'abra_sess={self.cookies["abra_sess"]}'}
+        url = operation.url(self)
+
+        await self._throttle(SEND)
+        try:
+            response, trace = await self._post(
+                operation.name, url, headers, payload, deadline
+            )
+        except Exception:
+            if deadline is not None:
+                # Report a timeout due to the total limit as such, rather than as a transport error.
+                deadline.check()
+            raise
+        try:
+            if response.status == 401 and not self.is_authed:
+                raise AccessTokenRejected("Meta AI rejected the access token.")
+            if not stream and stop is None:
+                reader = LastResponseReader()
+                async with response:
+                    lines = response.content
+                    if trace is not None:
+                        lines = trace.iterate_async(lines)
+                    if deadline is not None:
+                        lines = deadline.watch_async(lines)
+                    async for line in lines:
+                        reader.feed(line.rstrip(b"\r\n"))
+                if reader.last_response is None:
+                    raise_for_errors(reader.errors, self.is_authed)
+                conversation_ids = reader.conversation_ids()
+                if conversation_ids:
+                    (
+                        conversation.external_conversation_id,
+                        conversation.offline_threading_id,
+                    ) = conversation_ids
+                last_streamed_response = reader.last_response
+                if not last_streamed_response:
+                    raise MetaAIResponseError(
+                        "Meta AI did not return a complete response."
+                    )
+
+                extracted_data = await self.extract_data(last_streamed_response)
+                return extracted_data
+
+            else:
+                first_line = await response.content.readline()
+                if trace is not None:
+                    trace.bytes_received += len(first_line)
+                try:
+                    is_error = codec.loads(first_line)
+                except codec.DecodeError:
+                    raise MetaAIResponseError("Meta AI returned an invalid stream.")
+                raise_for_errors(get_response_errors(is_error), self.is_authed)
+                if stream and delta:
+                    items = self.stream_deltas(response, trace, deadline)
+                else:
+                    items = self.stream_response(response, trace, deadline)
+                # Releases the response even if the caller closes the stream before reading it.
+                items = AsyncClosingStream(
+                    self._read_stream(response, items, stop), response.release
+                )
+                if stream:
+                    return items
+                # Stopping a prompt needs every message snapshot, read the response as a stream.
+                extracted_data = None
+                async for extracted_data in items:
+                    pass
+                if extracted_data is None:
+                    raise MetaAIResponseError(
+                        "Meta AI did not return a complete response."
+                    )
+                return extracted_data
+        except BaseException as e:
+            # Cancelled tasks included, give the connection back rather than wait for the response.
+            response.release()
+            if trace is not None:
+                trace.finish(e)
+            if deadline is not None and isinstance(e, Exception):
+                deadline.check()
+            raise
+
+    @staticmethod
+    async def _read_stream(
+        response: aiohttp.ClientResponse,
+        items: AsyncGenerator[Dict, None],
+        stop: Optional[Callable[[str], bool]] = None,
+    ) -> AsyncIterator[Dict]:
+        """
+        Yields the items of a streamed response, and releases the response as soon as the stream ends,
+        fails, is closed by the caller, or meets the stop condition.
+        """
+        text = StreamText() if stop is not None else None
+        try:
+            async for item in items:
+                if text is not None and stop(text.feed(item)):
+                    item["stopped"] = True
+                    yield item
+                    return
+                yield item
+        finally:
+            await items.aclose()
+            response.release()
+
+    async def _record_stream(
+        self, conversation: Conversation, message: str, items: AsyncGenerator
+    ) -> AsyncIterator[Dict]:
+        """
+        Yields the items of a stream, and records the prompt in the history once the stream is over,
+        with as much of the answer as was read.
+        """
+        text = StreamText()
+        last_item = None
+        try:
+            async for last_item in items:
+                text.feed(last_item)
+                yield last_item
+        finally:
+            await items.aclose()
+            if last_item is not None:
+                await self._run_blocking(
+                    self.history.record,
+                    conversation.external_conversation_id,
+                    message,
+                    {**last_item, "message": text.text},
+                )
+
+    async def prompt_many(
+        self,
+        messages: Iterable[str],
+        concurrency: int = 10,
+        new_conversation: bool = True,
+        ordered: bool = True,
+    ) -> List[Dict or Exception] or AsyncIterator[Tuple[int, Dict or Exception]]:
+        """
+        Sends many messages concurrently, each one in its own conversation handle.
+
+        A message that fails does not abort the batch, the exception it raised takes the place of its
+        response.
+
+        Args:
+            messages (Iterable[str]): The messages to send.
+            concurrency (int): The maximum number of prompts in flight. Defaults to 10.
+            new_conversation (bool): Whether each message starts a new conversation, rather than
+                following up on the current one. Defaults to True.
+            ordered (bool): Whether to return the responses in input order once all of them are done,
+                or an async iterator of (index, response) tuples as they complete. Defaults to True.
+
+        Returns:
+            list: The responses, or exceptions, in the order of the messages.
+        """
+        # Bootstrap once here, rather than once per task.
+        await self._ensure_cookies()
+        self._get_session()
+        if not self.is_authed:
+            await self._ensure_access_token()
+        # A fixed set of workers pulls the messages, so that a large or endless input only has
+        # `concurrency` prompts, and coroutines, in flight.
+        pending = enumerate(messages)
+
+        async def prompt_isolated(message: str) -> Dict or Exception:
+            conversation = self.conversation(
+                None if new_conversation else self.external_conversation_id,
+                None if new_conversation else self.offline_threading_id,
+            )
+            try:
+                return await conversation.prompt(
+                    message, new_conversation=new_conversation
+                )
+            except Exception as e:
+                logging.warning(f"Prompt failed in batch: {e}")
+                return e
+
+        if ordered:
+            responses: Dict[int, Dict or Exception] = {}
+
+            async def worker():
+                for index, message in pending:
+                    responses[index] = await prompt_isolated(message)
+
+            workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for task in workers:
+                    task.cancel()
+            return [responses[index] for index in range(len(responses))]
+        return self._as_completed(prompt_isolated, pending, concurrency)
+
+    @staticmethod
+    async def _as_completed(
+        function, pending: Iterator[Tuple[int, str]], concurrency: int
+    ) -> AsyncIterator[Tuple[int, Dict or Exception]]:
+        done = asyncio.Queue()
+
+        async def worker():
+            try:
+                for index, message in pending:
+                    done.put_nowait((index, await function(message)))
+            finally:
+                done.put_nowait(None)
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+        try:
+            finished = 0
+            while finished < len(workers):
+                item = await done.get()
+                if item is None:
+                    finished += 1
+                else:
+                    yield item
+            # Raises what stopped a worker early, such as an error of the input iterator.
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+
+    def extract_last_response(
+        self, response: str or Iterable[bytes], conversation: Conversation = None
+    ) -> Dict:
+        """
+        Extracts the last response from the Meta AI API.
+
+        Args:
+            response (str or Iterable[bytes]): The response body, or its lines.
+            conversation (Conversation): The conversation whose IDs to update, defaults to the
+                conversation of this instance.
+
+        Returns:
+            dict: A dictionary containing the last response.
+        """
+        return MetaAI.extract_last_response(self, response, conversation)
+
+    async def stream_response(
+        self,
+        response: aiohttp.ClientResponse,
+        trace: RequestTrace = None,
+        deadline: Deadline = None,
+    ) -> AsyncIterator[Dict]:
+        """
+        Streams the response from the Meta AI API.
+
+        Args:
+            response (aiohttp.ClientResponse): The streaming response to read lines from.
+            trace (RequestTrace): Reports the lines read to the hooks, if any.
+            deadline (Deadline): The time limits and cancellation of the prompt, if any.
+
+        Yields:
+            dict: A dictionary containing the response message and sources.
+        """
+        # Sources are fetched once, when the message is complete, to keep the stream flowing.
+        sources = {}
+        lines = (
+            response.content if trace is None else trace.iterate_async(response.content)
+        )
+        if deadline is not None:
+            lines = deadline.watch_async(lines)
+        async with response:
+            async for line in lines:
+                line = line.strip()
+                if line:
+                    json_line = codec.loads_message(line)
+                    extracted_data = await self.extract_data(json_line, sources=sources)
+                    if not extracted_data.get("message"):
+                        continue
+                    yield extracted_data
+
+    async def stream_deltas(
+        self,
+        response: aiohttp.ClientResponse,
+        trace: RequestTrace = None,
+        deadline: Deadline = None,
+    ) -> AsyncIterator[Dict]:
+        """
+        Streams the response from the Meta AI API, yielding only the text added by each chunk.
+
+        Args:
+            response (aiohttp.ClientResponse): The streaming response to read lines from.
+            trace (RequestTrace): Reports the lines read to the hooks, if any.
+            deadline (Deadline): The time limits and cancellation of the prompt, if any.
+
+        Yields:
+            dict: The new text ("delta") and whether it replaces all the text sent before ("reset").
+            The last item also holds the full message, sources and media.
+        """
+        deltas = MessageDeltas()
+        last_json_line = None
+        lines = (
+            response.content if trace is None else trace.iterate_async(response.content)
+        )
+        if deadline is not None:
+            lines = deadline.watch_async(lines)
+        async with response:
+            async for line in lines:
+                line = line.strip()
+                if line:
+                    last_json_line = codec.loads_message(line)
+                    text, reset = deltas.feed(last_json_line)
+                    if text or reset:
+                        yield {"delta": text, "reset": reset}
+        if last_json_line is not None:
+            yield {
+                "delta": deltas.finish(),
+                "reset": False,
+                **await self.extract_data(last_json_line),
+            }
+
+    async def extract_data(
+        self, json_line: dict, sources: Dict[str, List[Dict]] = None
+    ) -> Dict:
+        """
+        Extract data and sources from a parsed JSON line.
+
+        Args:
+            json_line (dict): Parsed JSON line.
+            sources (dict): Sources already fetched for this message, by fetch ID. When given, sources are
+                only fetched once the message is complete, and at most once per fetch ID.
+
+        Returns:
+            dict: Response message, list of sources and list of medias.
+        """
+        bot_response_message = (
+            json_line.get("data", {}).get("node", {}).get("bot_response_message", {})
+        )
+        response = format_response(response=json_line)
+        fetch_id = bot_response_message.get("fetch_id")
+        if fetch_id and sources is not None:
+            if (
+                fetch_id not in sources
+                and bot_response_message.get("streaming_state") == "OVERALL_DONE"
+            ):
+                sources[fetch_id] = await self.fetch_sources(fetch_id)
+            message_sources = sources.get(fetch_id, [])
+        else:
+            message_sources = await self.fetch_sources(fetch_id) if fetch_id else []
+        medias = MetaAI.extract_media(bot_response_message)
+        return {"message": response, "sources": message_sources, "media": medias}
+
+    async def download_media(
+        self, media: Iterable[Dict or str], directory: str, progress: Progress = None
+    ) -> List[str or Exception]:
+        """
+        Downloads the media of responses concurrently, over the session of this instance, see
+        MetaAI.download_media.
+        """
+        if self._media_downloader is None:
+            self._media_downloader = AsyncMediaDownloader(
+                self._get_session(), proxy=self._proxy_url
+            )
+        return await self._media_downloader.download(media, directory, progress)
+
+    async def get_cookies(self) -> dict:
+        """
+        Extracts necessary cookies from the Meta AI main page.
+
+        Returns:
+            dict: A dictionary containing essential cookies.
+        """
+        started_at = time.perf_counter()
+        await self._throttle(LOGIN)
+        headers = {}
+        if self.fb_email is not None and self.fb_password is not None:
+            # The Facebook login flow is blocking, keep it off the event loop.
+            fb_session = await self._run_blocking(
+                get_fb_session, self.fb_email, self.fb_password, self.proxy
+            )
+            headers = {"cookie": f"abra_sess={fb_session['abra_sess']}"}
+        names = ["_js_datr", "datr", "lsd", "fb_dtsg"]
+        if not headers:
+            names.append("abra_csrf")
+        extractor = TokenExtractor(names)
+        trace = (
+            RequestTrace(self.hooks, "landing_page") if self.hooks is not None else None
+        )
+        # Stop downloading the page once every token is found.
+        async with self._get_session().get(
+            self.meta_ai_url, headers=headers, proxy=self._proxy_url
+        ) as response:
+            chunks = response.content.iter_chunked(64 * 1024)
+            if trace is not None:
+                trace.first_byte(response.status)
+                chunks = trace.iterate_async(chunks)
+            try:
+                async for chunk in chunks:
+                    if extractor.feed(chunk):
+                        break
+            finally:
+                if trace is not None:
+                    await chunks.aclose()
+        cookies = extractor.result()
+
+        if len(headers) > 0:
+            cookies["abra_sess"] = fb_session["abra_sess"]
+        self._phase(COOKIES, started_at)
+        return cookies
+
+    async def fetch_sources(self, fetch_id: str) -> List[Dict]:
+        """
+        Fetches sources from the Meta AI API based on the given query.
+
+        Args:
+            fetch_id (str): The fetch ID to use for the query.
+
+        Returns:
+            list: A list of dictionaries containing the fetched sources.
+        """
+        if self.response_cache is not None:
+            cache_key = self.response_cache.sources_key(fetch_id)
+            references = await self._run_blocking(self.response_cache.get, cache_key)
+            if references is not None:
+                return references
+
+        cookies = await self._ensure_cookies()
+        operation = graphql.OPERATIONS[graphql.SEARCH_SOURCES]
+        payload = operation.encode(
+            self.access_token,
+            self.is_authed,
+            operation.encode_variables(abraMessageFetchID=fetch_id),
+        )
+        headers = {
+            **operation.headers,
+            "cookie": f'dpr=2; abra_csrf={cookies.get("abra_csrf")}; datr={cookies.get("datr")}; ps_n=1; ps_l=1',
+        }
+
+        await self._throttle(SOURCES)
+        response, trace = await self._post(
+            operation.name, operation.url(self), headers, payload
+        )
+        async with response:
+            body = await response.read()
+        if trace is not None:
+            trace.finish(bytes_received=len(body))
+        response_json = codec.loads(body)
+        message = response_json.get("data", {}).get("message", {})
+        search_results = message.get("searchResults") if message else None
+        references = search_results["references"] if search_results else []
+        if self.response_cache is not None:
+            await self._run_blocking(self.response_cache.set, cache_key, references)
+        return references
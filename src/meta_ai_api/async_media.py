@@ -0,0 +1,136 @@
+import asyncio
+import os
+from typing import BinaryIO, Dict, Iterable, List
+
+import aiohttp
+
+from meta_ai_api.media import (
+    check_complete,
+    media_targets,
+    PARTIAL_SUFFIX,
+    Progress,
+    READ_CHUNK_SIZE,
+    response_total,
+    restart,
+)
+from meta_ai_api.retry import RetryPolicy
+
+
+class AsyncMediaDownloader:
+    """
+    An asyncio counterpart of :class:`MediaDownloader`.
+
+    Chunks are written to disk from the event loop, they are small enough not to hold it up.
+    """
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        concurrency: int = 8,
+        chunk_size: int = READ_CHUNK_SIZE,
+        retry_policy: RetryPolicy = None,
+        proxy: str = None,
+    ):
+        """
+        Args:
+            session (aiohttp.ClientSession): The session to download with, such as the one of an
+                AsyncMetaAI instance.
+            concurrency (int): The maximum number of downloads in flight. Defaults to 8.
+            chunk_size (int): The bytes read and written at a time. Defaults to 64 KiB.
+            retry_policy (RetryPolicy): Decides whether a failed download is resumed. Defaults to a
+                policy of its own, without circuit breaker.
+            proxy (str): The proxy URL to download through, if any.
+        """
+        self.session = session
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.retry_policy = (
+            retry_policy
+            if retry_policy is not None
+            else RetryPolicy(
+                failure_threshold=0,
+                # Not every aiohttp.ClientError: error statuses are fatal, as in MediaDownloader.
+                transport_errors=(
+                    aiohttp.ClientConnectionError,
+                    aiohttp.ClientPayloadError,
+                    asyncio.TimeoutError,
+                ),
+            )
+        )
+        self.proxy = proxy
+        self._semaphore = None
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    async def download(
+        self,
+        media: Iterable[Dict or str],
+        directory: str,
+        progress: Progress = None,
+    ) -> List[str or Exception]:
+        """
+        Downloads media to a directory concurrently, see MediaDownloader.download.
+        """
+        os.makedirs(directory, exist_ok=True)
+        urls, paths = media_targets(media, directory)
+        futures = [self.submit(url, path, progress) for url, path in paths.items()]
+        outcomes = await asyncio.gather(*futures, return_exceptions=True)
+        results = dict(zip(paths, outcomes))
+        return [results[url] for url in urls]
+
+    def submit(self, url: str, path: str, progress: Progress = None) -> asyncio.Future:
+        """
+        Starts downloading a media to a path, unless it is downloading already.
+        """
+        future = self._in_flight.get(path)
+        if future is None:
+            future = asyncio.ensure_future(self.fetch_to_path(url, path, progress))
+            self._in_flight[path] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(path, None))
+        return future
+
+    async def fetch_to_path(
+        self, url: str, path: str, progress: Progress = None
+    ) -> str:
+        """
+        Downloads a media to a path, resuming a previous partial download if any.
+        """
+        if os.path.exists(path):
+            return path
+        partial_path = path + PARTIAL_SUFFIX
+        with open(partial_path, "ab") as file:
+            await self.fetch(url, file, progress)
+        os.replace(partial_path, path)
+        return path
+
+    async def fetch(self, url: str, file: BinaryIO, progress: Progress = None) -> int:
+        """
+        Streams a media into a file object, see MediaDownloader.fetch.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            return await self.retry_policy.call_async(
+                self._fetch_once, url, file, progress
+            )
+
+    async def _fetch_once(
+        self, url: str, file: BinaryIO, progress: Progress = None
+    ) -> int:
+        offset = file.tell()
+        headers = {"range": f"bytes={offset}-"} if offset else None
+        async with self.session.get(url, headers=headers, proxy=self.proxy) as response:
+            if offset and response.status == 416:
+                return offset
+            response.raise_for_status()
+            if offset and response.status != 206:
+                restart(file)
+                offset = 0
+            total = response_total(response.status, response.headers, offset)
+            async for chunk in response.content.iter_chunked(self.chunk_size):
+                file.write(chunk)
+                offset += len(chunk)
+                if progress is not None:
+                    progress(url, offset, total)
+        file.flush()
+        check_complete(url, offset, total)
+        return offset
@@ -0,0 +1,345 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Generator, Iterable, List, Optional, Tuple, Type
+
+from meta_ai_api.control import Timeout
+from meta_ai_api.conversation import Conversation
+from meta_ai_api.exceptions import (
+    DeadlineExceeded,
+    FacebookRegionBlocked,
+    NoIdentityAvailable,
+    PromptCancelled,
+    RateLimited,
+    UnknownConversation,
+)
+from meta_ai_api.main import MetaAI
+from meta_ai_api.utils import ClosingStream
+
+
+class Identity:
+    """
+    One way of reaching Meta AI: an anonymous temp user or a Facebook account, behind its own proxy.
+    """
+
+    def __init__(
+        self,
+        fb_email: str = None,
+        fb_password: str = None,
+        proxy: dict = None,
+        name: str = None,
+        rate_limit: Optional[int] = None,
+        rate_period: float = 60.0,
+    ):
+        """
+        Args:
+            fb_email (str): The Facebook account email, None for an anonymous temp user.
+            fb_password (str): The Facebook account password.
+            proxy (dict): The proxy every request of this identity goes through.
+            name (str): A name for logs and stats. Defaults to the email, or a name given by the pool.
+            rate_limit (int): The maximum number of prompts per `rate_period`, None for no limit.
+            rate_period (float): The period of the rate limit in seconds. Defaults to 60.
+        """
+        self.fb_email = fb_email
+        self.fb_password = fb_password
+        self.proxy = proxy
+        self.name = name or fb_email
+        self.rate_limit = rate_limit
+        self.rate_period = rate_period
+        self.client: Optional[MetaAI] = None
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.last_used = 0.0
+        self._sent = deque()
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"Identity({self.name!r})"
+
+    def is_ejected(self, now: float) -> bool:
+        return now < self.ejected_until
+
+    def next_slot(self, now: float) -> float:
+        """
+        Returns the seconds to wait before the rate limit lets another prompt through, 0 if it does now.
+        """
+        if self.rate_limit is None:
+            return 0.0
+        while self._sent and self._sent[0] <= now - self.rate_period:
+            self._sent.popleft()
+        if len(self._sent) < self.rate_limit:
+            return 0.0
+        return self._sent[0] + self.rate_period - now
+
+
+class MetaAIPool:
+    """
+    Spreads prompts over many identities, to scale past the rate limits of a single account or IP.
+
+    New conversations go to the healthy identity with the fewest prompts in flight, and follow-ups stay
+    on the identity that started the conversation. An identity is ejected for `eject_time` seconds when
+    it is region blocked, or after `max_failures` consecutive failed prompts. The follow-ups of its
+    conversations wait for the ejection to end, within their timeout.
+    """
+
+    def __init__(
+        self,
+        identities: Iterable[Identity],
+        max_failures: int = 3,
+        eject_time: float = 60.0,
+        max_conversations: int = 10000,
+        client_class: Type[MetaAI] = MetaAI,
+        **client_kwargs,
+    ):
+        """
+        Args:
+            identities (Iterable[Identity]): The identities to spread prompts over.
+            max_failures (int): Consecutive failures after which an identity is ejected. Defaults to 3.
+            eject_time (float): Seconds an ejected identity receives no prompts. Defaults to 60.
+            max_conversations (int): The number of conversations whose identity is remembered, the least
+                recently used ones are forgotten first. Defaults to 10000.
+            client_class (type): The MetaAI class of the identity clients.
+            **client_kwargs: Passed to the client of every identity, such as response_cache.
+        """
+        self.identities: List[Identity] = list(identities)
+        if not self.identities:
+            raise ValueError("MetaAIPool needs at least one identity.")
+        for i, identity in enumerate(self.identities):
+            if identity.name is None:
+                identity.name = f"identity-{i}"
+        self.max_failures = max_failures
+        self.eject_time = eject_time
+        self.max_conversations = max_conversations
+        self.client_class = client_class
+        self.client_kwargs = client_kwargs
+        self._conversations: "OrderedDict[str, Tuple[Identity, Optional[str]]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "MetaAIPool":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Closes the connections of every identity.
+        """
+        for identity in self.identities:
+            if identity.client is not None:
+                identity.client.session.close()
+
+    def prompt(
+        self,
+        message: str,
+        conversation_id: str = None,
+        stream: bool = False,
+        delta: bool = False,
+        timeout: Optional[float] = None,
+        prompt_timeout: Timeout or float = None,
+        stop: Callable[[str], bool] = None,
+        cancel: threading.Event = None,
+    ) -> Dict or Generator[Dict, None, None]:
+        """
+        Sends a message through one of the identities.
+
+        Args:
+            message (str): The message to send.
+            conversation_id (str): The conversation to continue, as returned by a previous prompt. None to
+                start a new one.
+            stream (bool): Whether to stream the response or not. Defaults to False.
+            delta (bool): When streaming, whether to yield only the text added by each chunk.
+            timeout (float): Seconds to wait for an identity within its rate limit, None to wait forever.
+            prompt_timeout (Timeout or float): The time limits of the prompt once sent, see MetaAI.prompt.
+            stop (Callable[[str], bool]): The condition to stop reading the response at, see MetaAI.prompt.
+            cancel (threading.Event): Cancels the prompt once set, from any thread.
+
+        Returns:
+            dict: The response, as returned by MetaAI.prompt, with the "conversation_id" to pass to continue
+            the conversation. When streaming, every item holds it.
+
+        Raises:
+            UnknownConversation: A KeyError, if the conversation is unknown or was forgotten, such as
+                after `max_conversations` more recent ones.
+            NoIdentityAvailable: If no identity became available within the timeout.
+        """
+        owner, offline_threading_id = None, None
+        if conversation_id is not None:
+            with self._lock:
+                if conversation_id not in self._conversations:
+                    raise UnknownConversation(
+                        f"The conversation {conversation_id} is unknown to the pool, or was "
+                        "forgotten. Start a new one."
+                    )
+                owner, offline_threading_id = self._conversations[conversation_id]
+                self._conversations.move_to_end(conversation_id)
+
+        identity = self._acquire(owner, timeout)
+        conversation = None
+        try:
+            conversation = self._get_client(identity).conversation(
+                conversation_id, offline_threading_id
+            )
+            response = conversation.prompt(
+                message,
+                stream=stream,
+                new_conversation=conversation_id is None,
+                delta=delta,
+                timeout=prompt_timeout,
+                stop=stop,
+                cancel=cancel,
+            )
+        except Exception as e:
+            self._release(identity, conversation, e)
+            raise
+        if stream:
+            return ClosingStream(
+                self._stream(identity, conversation, response),
+                lambda: self._close_unread(identity, conversation, response),
+            )
+        self._release(identity, conversation)
+        return {**response, "conversation_id": conversation.external_conversation_id}
+
+    def _stream(
+        self, identity: Identity, conversation: Conversation, response: Generator
+    ) -> Generator[Dict, None, None]:
+        error = None
+        try:
+            for item in response:
+                yield {
+                    **item,
+                    "conversation_id": conversation.external_conversation_id,
+                }
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # Also reached when the caller stops reading the stream early, close the response right away.
+            response.close()
+            self._release(identity, conversation, error)
+
+    def _close_unread(
+        self, identity: Identity, conversation: Conversation, response: Generator
+    ):
+        # The stream was closed before it started, so the finally clause of _stream never ran.
+        response.close()
+        self._release(identity, conversation)
+
+    def _get_client(self, identity: Identity) -> MetaAI:
+        with identity._lock:
+            if identity.client is None:
+                client = self.client_class(
+                    fb_email=identity.fb_email,
+                    fb_password=identity.fb_password,
+                    proxy=identity.proxy,
+                    **self.client_kwargs,
+                )
+                if not client.is_authed:
+                    # Bootstrap the temp user once, so that its requests share it.
+                    client._ensure_access_token()
+                identity.client = client
+            return identity.client
+
+    def _acquire(self, owner: Optional[Identity], timeout: Optional[float]) -> Identity:
+        """
+        Picks the identity of the next prompt, waiting for rate limits and ejections to lapse.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                # Conversations cannot move, they wait for their identity to be reinstated if ejected.
+                pool = [owner] if owner is not None else self.identities
+                candidates = [i for i in pool if not i.is_ejected(now)]
+                if candidates:
+                    waits = [identity.next_slot(now) for identity in candidates]
+                    ready = [i for i, wait in zip(candidates, waits) if wait == 0]
+                    if ready:
+                        identity = min(ready, key=lambda i: (i.in_flight, i.last_used))
+                        identity.in_flight += 1
+                        identity.requests += 1
+                        identity.last_used = now
+                        if identity.rate_limit is not None:
+                            identity._sent.append(now)
+                        return identity
+                    wait = min(waits)
+                else:
+                    wait = min(i.ejected_until for i in pool) - now
+            if deadline is not None and now + wait > deadline:
+                raise NoIdentityAvailable(
+                    "Every identity is rate limited or ejected, try again later."
+                )
+            time.sleep(wait)
+
+    def _release(
+        self,
+        identity: Identity,
+        conversation: Optional[Conversation],
+        error: Exception = None,
+    ):
+        """
+        Records the outcome of a prompt sent through an identity.
+        """
+        with self._lock:
+            identity.in_flight -= 1
+            if isinstance(error, (RateLimited, PromptCancelled, DeadlineExceeded)):
+                # Shed by our own rate limiter, or ended by the controls of the caller: the identity is
+                # not at fault.
+                return
+            if error is not None:
+                identity.failures += 1
+                if (
+                    isinstance(error, FacebookRegionBlocked)
+                    or identity.failures >= self.max_failures
+                ):
+                    identity.ejected_until = time.monotonic() + self.eject_time
+                    identity.failures = 0
+                    logging.warning(
+                        f"Ejected {identity.name} for {self.eject_time}s after: {error}"
+                    )
+                return
+            identity.failures = 0
+            if (
+                conversation is not None
+                and conversation.external_conversation_id is not None
+            ):
+                self._conversations[conversation.external_conversation_id] = (
+                    identity,
+                    conversation.offline_threading_id,
+                )
+                self._conversations.move_to_end(conversation.external_conversation_id)
+                while len(self._conversations) > self.max_conversations:
+                    self._conversations.popitem(last=False)
+
+    def forget(self, conversation_id: str):
+        """
+        Forgets a conversation, it cannot be continued anymore.
+        """
+        with self._lock:
+            self._conversations.pop(conversation_id, None)
+
+    def stats(self) -> List[Dict]:
+        """
+        Returns the state of every identity.
+
+        Returns:
+            list: One dictionary per identity, with its name, prompts in flight, prompts sent,
+            consecutive failures and the seconds left before an ejection ends.
+        """
+        with self._lock:
+            now = time.monotonic()
+            return [
+                {
+                    "name": identity.name,
+                    "in_flight": identity.in_flight,
+                    "requests": identity.requests,
+                    "failures": identity.failures,
+                    "ejected_for": max(identity.ejected_until - now, 0.0),
+                }
+                for identity in self.identities
+            ]
@@ -0,0 +1,201 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from meta_ai_api import codec
+
+
+def normalize_prompt(message: str) -> str:
+    """
+    Normalizes a prompt so that trivially different spellings share a cache entry.
+
+    Args:
+        message (str): The prompt to normalize.
+
+    Returns:
+        str: The prompt, case folded and with whitespace collapsed.
+    """
+    return " ".join(message.split()).casefold()
+
+
+class ResponseCache:
+    """
+    Base class of the response caches.
+
+    Entries are evicted in least recently used order once the cache holds more than `maxsize` of them,
+    and expire `ttl` seconds after being stored.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = 3600):
+        """
+        Args:
+            maxsize (int): The maximum number of entries. Defaults to 1024.
+            ttl (float): Seconds an entry stays valid, None for no expiry. Defaults to 3600.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def prompt_key(message: str, new_conversation: bool, account: str) -> str:
+        """
+        Builds the cache key of a prompt.
+
+        Args:
+            message (str): The prompt.
+            new_conversation (bool): Whether the prompt starts a new conversation.
+            account (str): The Facebook email of the client, or "anonymous".
+        """
+        return f"prompt:{account}:{int(new_conversation)}:{normalize_prompt(message)}"
+
+    @staticmethod
+    def sources_key(fetch_id: str) -> str:
+        """
+        Builds the cache key of a source lookup.
+        """
+        return f"sources:{fetch_id}"
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Returns a cached value, or None if it is missing or expired.
+        """
+        value = self._get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any):
+        """
+        Caches a JSON serializable value.
+        """
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        self._set(key, value, expires_at)
+
+    def clear(self):
+        """
+        Removes every entry.
+        """
+        raise NotImplementedError
+
+    def _get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def _set(self, key: str, value: Any, expires_at: Optional[float]):
+        raise NotImplementedError
+
+
+class MemoryResponseCache(ResponseCache):
+    """
+    Keeps the responses in memory, for the lifetime of the process.
+
+    Values are stored encoded, as by SQLiteResponseCache, so that callers modifying a response they
+    cached or got from the cache do not change the entry.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = 3600):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return codec.loads(value)
+
+    def _set(self, key: str, value: Any, expires_at: Optional[float]):
+        value = codec.dumps(value)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteResponseCache(ResponseCache):
+    """
+    Stores the responses in a SQLite database, shared between processes and kept across restarts.
+    """
+
+    def __init__(self, path: str, maxsize: int = 1024, ttl: Optional[float] = 3600):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.path = path
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, "
+                    "used_at REAL NOT NULL)"
+                )
+        finally:
+            connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        connection = self._connect()
+        try:
+            with connection:
+                row = connection.execute(
+                    "SELECT value FROM responses "
+                    "WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                    (key, now),
+                ).fetchone()
+                if row is None:
+                    return None
+                connection.execute(
+                    "UPDATE responses SET used_at = ? WHERE key = ?", (now, key)
+                )
+        finally:
+            connection.close()
+        return codec.loads(row[0])
+
+    def _set(self, key: str, value: Any, expires_at: Optional[float]):
+        now = time.time()
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                    (key, codec.dumps(value), expires_at, now),
+                )
+                connection.execute(
+                    "DELETE FROM responses WHERE expires_at <= ?", (now,)
+                )
+                connection.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                    (self.maxsize,),
+                )
+        finally:
+            connection.close()
+
+    def clear(self):
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute("DELETE FROM responses")
+        finally:
+            connection.close()
@@ -0,0 +1,367 @@
+"""
+Coalescing of identical prompts sent at the same time, also known as single-flight.
+
+When many callers send the same prompt starting a new conversation while a first one is still waiting for
+its answer, only that first prompt is sent to Meta AI. The others subscribe to its response: the message
+of a prompt, or every item of a stream, starting from the first one for late joiners.
+"""
+
+import threading
+from typing import (
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Generator,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from meta_ai_api.cache import normalize_prompt
+from meta_ai_api.control import Deadline
+from meta_ai_api.utils import AsyncClosingStream, ClosingStream
+
+# How often a subscriber waiting for the next item checks whether it was cancelled, in seconds.
+CANCEL_POLL_INTERVAL = 0.1
+
+
+def wait_timeout(deadline: Optional[Deadline]) -> Optional[float]:
+    """
+    Returns the longest a subscriber may wait for the next item before checking its deadline again.
+    """
+    if deadline is None:
+        return None
+    remaining = deadline.remaining()
+    if deadline.cancel is None:
+        return remaining
+    if remaining is None:
+        return CANCEL_POLL_INTERVAL
+    return min(remaining, CANCEL_POLL_INTERVAL)
+
+
+class Flight:
+    """
+    One prompt sent to Meta AI, whose response is shared by every caller subscribed to it.
+
+    The prompt runs on a thread of its own, which stores the response, or every item of the stream, for
+    the subscribers to read at their own pace. Once every subscriber left, the prompt is cancelled.
+    """
+
+    def __init__(self, start: Callable[[threading.Event], Dict or Iterator[Dict]]):
+        """
+        Args:
+            start (Callable[[threading.Event], dict or Iterator[dict]]): Sends the prompt, cancelling it
+                once the given event is set, and returns its response or stream.
+        """
+        self.items: List[Dict] = []
+        self.done = False
+        self.error: Optional[Exception] = None
+        self.subscribers = 0
+        self.cancel = threading.Event()
+        self._start = start
+        self._condition = threading.Condition()
+
+    def run(self):
+        try:
+            result = self._start(self.cancel)
+            if isinstance(result, dict):
+                self._push(result)
+            else:
+                for item in result:
+                    self._push(item)
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._condition:
+                self.done = True
+                self._condition.notify_all()
+
+    def _push(self, item: Dict):
+        with self._condition:
+            self.items.append(item)
+            self._condition.notify_all()
+
+    def subscribe(self) -> bool:
+        """
+        Adds a subscriber, unless the flight is over or cancelled already.
+        """
+        with self._condition:
+            if self.done or self.cancel.is_set():
+                return False
+            self.subscribers += 1
+            return True
+
+    def leave(self):
+        """
+        Removes a subscriber, cancelling the prompt if it was the last one.
+        """
+        with self._condition:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                self.cancel.set()
+
+    def _wait(self, index: int, deadline: Optional[Deadline]) -> Optional[Dict]:
+        """
+        Returns the item at the given index once received, or None once the response ended before it.
+        """
+        with self._condition:
+            while index >= len(self.items) and not self.done:
+                if deadline is not None:
+                    deadline.check()
+                self._condition.wait(wait_timeout(deadline))
+            if index < len(self.items):
+                return self.items[index]
+            if self.error is not None:
+                raise self.error
+            return None
+
+    def result(self, deadline: Deadline = None) -> Dict:
+        """
+        Waits for the response of a prompt, as a subscriber.
+
+        Raises:
+            DeadlineExceeded: If the total time limit of the deadline passed.
+            PromptCancelled: If the deadline was cancelled.
+        """
+        try:
+            return dict(self._wait(0, deadline))
+        finally:
+            self.leave()
+
+    def stream(self, deadline: Deadline = None) -> Iterator[Dict]:
+        """
+        Yields the items of a streamed prompt as they arrive, as a subscriber, from the first one.
+        """
+        return ClosingStream(self._stream(deadline), self.leave)
+
+    def _stream(self, deadline: Optional[Deadline]) -> Generator[Dict, None, None]:
+        try:
+            index = 0
+            while True:
+                item = self._wait(index, deadline)
+                if item is None:
+                    return
+                yield dict(item)
+                index += 1
+        finally:
+            self.leave()
+
+
+class AsyncFlight:
+    """
+    Async counterpart of Flight, running the prompt as a task, cancelled once every subscriber left.
+    """
+
+    def __init__(self, start: Callable[[], Awaitable]):
+        """
+        Args:
+            start (Callable[[], Awaitable]): Sends the prompt and returns its response or async stream.
+        """
+        import asyncio
+
+        self.items: List[Dict] = []
+        self.done = False
+        self.error: Optional[Exception] = None
+        self.subscribers = 0
+        self.cancelled = False
+        self.task = None
+        self._start = start
+        self._condition = asyncio.Condition()
+
+    async def run(self):
+        try:
+            result = await self._start()
+            if isinstance(result, dict):
+                await self._push(result)
+            else:
+                try:
+                    async for item in result:
+                        await self._push(item)
+                finally:
+                    await result.aclose()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            async with self._condition:
+                self._condition.notify_all()
+
+    async def _push(self, item: Dict):
+        async with self._condition:
+            self.items.append(item)
+            self._condition.notify_all()
+
+    def subscribe(self) -> bool:
+        """
+        Adds a subscriber, unless the flight is over or cancelled already.
+        """
+        if self.done or self.cancelled:
+            return False
+        self.subscribers += 1
+        return True
+
+    def leave(self):
+        """
+        Removes a subscriber, cancelling the prompt if it was the last one.
+        """
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done:
+            self.cancelled = True
+            self.task.cancel()
+
+    async def _wait(self, index: int, deadline: Optional[Deadline]) -> Optional[Dict]:
+        import asyncio
+
+        async with self._condition:
+            while index >= len(self.items) and not self.done:
+                if deadline is not None:
+                    deadline.check()
+                try:
+                    await asyncio.wait_for(
+                        self._condition.wait(), wait_timeout(deadline)
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            if index < len(self.items):
+                return self.items[index]
+            if self.error is not None:
+                raise self.error
+            return None
+
+    async def result(self, deadline: Deadline = None) -> Dict:
+        """
+        Async counterpart of Flight.result.
+        """
+        try:
+            return dict(await self._wait(0, deadline))
+        finally:
+            self.leave()
+
+    def stream(self, deadline: Deadline = None) -> AsyncIterator[Dict]:
+        """
+        Async counterpart of Flight.stream.
+        """
+        return AsyncClosingStream(self._stream(deadline), self.leave)
+
+    async def _stream(self, deadline: Optional[Deadline]) -> AsyncGenerator[Dict, None]:
+        try:
+            index = 0
+            while True:
+                item = await self._wait(index, deadline)
+                if item is None:
+                    return
+                yield dict(item)
+                index += 1
+        finally:
+            self.leave()
+
+
+class SingleFlight:
+    """
+    Tracks the prompts in flight, so that identical prompts share one request to Meta AI.
+
+    Pass one to MetaAI or AsyncMetaAI as `single_flight`. Only prompts starting a new conversation,
+    without stop condition, are coalesced: follow-ups depend on the history of their conversation.
+    Prompts are only coalesced between clients of the same account and proxy, so that each is sent as
+    the identity it was meant for.
+
+    The first caller of a prompt owns the conversation it starts. The callers that joined it receive a
+    response that cannot be continued: their conversations are left as they were, as when a response
+    comes from the response cache. Do not share one between the clients of a MetaAIPool, whose callers
+    expect to follow up on every response.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self._async_flights: Dict[str, AsyncFlight] = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.joined = 0
+
+    @staticmethod
+    def prompt_key(message: str, stream: bool, delta: bool, client) -> str:
+        """
+        Builds the key of a prompt, shared by the prompts answered by the same response.
+
+        Args:
+            message (str): The prompt.
+            stream (bool): Whether the prompt is streamed.
+            delta (bool): Whether the stream yields deltas.
+            client (MetaAI or AsyncMetaAI): The client sending the prompt, whose account and proxy
+                are part of the key.
+        """
+        account = client.fb_email if client.is_authed else "anonymous"
+        proxy = ",".join(f"{k}={v}" for k, v in sorted((client.proxy or {}).items()))
+        read_mode = ("delta" if delta else "stream") if stream else "message"
+        return f"{account}:{proxy}:{read_mode}:{normalize_prompt(message)}"
+
+    def join(
+        self, key: str, start: Callable[[threading.Event], Dict or Iterator[Dict]]
+    ) -> Tuple[Flight, bool]:
+        """
+        Subscribes to the flight of a prompt, starting it unless it is in flight already.
+
+        Args:
+            key (str): The key of the prompt, see `prompt_key`.
+            start (Callable[[threading.Event], dict or Iterator[dict]]): Sends the prompt, see Flight.
+
+        Returns:
+            tuple: The flight, to read the response from with `result` or `stream`, and whether this
+            call started it.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight.subscribe():
+                self.joined += 1
+                return flight, False
+            flight = Flight(start)
+            flight.subscribe()
+            self._flights[key] = flight
+            self.started += 1
+        threading.Thread(
+            target=self._run, args=(key, flight), name="meta-ai-flight", daemon=True
+        ).start()
+        return flight, True
+
+    def _run(self, key: str, flight: Flight):
+        try:
+            flight.run()
+        finally:
+            self._forget(self._flights, key, flight)
+
+    def join_async(
+        self, key: str, start: Callable[[], Awaitable]
+    ) -> Tuple[AsyncFlight, bool]:
+        """
+        Async counterpart of `join`, to call from the event loop.
+        """
+        import asyncio
+
+        with self._lock:
+            flight = self._async_flights.get(key)
+            if flight is not None and flight.subscribe():
+                self.joined += 1
+                return flight, False
+            flight = AsyncFlight(start)
+            flight.task = asyncio.ensure_future(flight.run())
+            flight.subscribe()
+            self._async_flights[key] = flight
+            self.started += 1
+        flight.task.add_done_callback(
+            lambda _: self._forget(self._async_flights, key, flight)
+        )
+        return flight, True
+
+    def _forget(self, flights: Dict, key: str, flight: Flight or AsyncFlight):
+        with self._lock:
+            if flights.get(key) is flight:
+                del flights[key]
+
+    def __len__(self) -> int:
+        """
+        Returns the number of prompts in flight.
+        """
+        return len(self._flights) + len(self._async_flights)
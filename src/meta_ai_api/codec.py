@@ -0,0 +1,205 @@
+"""
+JSON encoding and decoding through the fastest backend installed.
+
+orjson, msgspec and ujson are picked in that order when installed, the standard library json module
+otherwise. Set the META_AI_JSON environment variable to "orjson", "msgspec", "ujson" or "json", or call
+`set_codec`, to choose one.
+
+The lines of a streamed message are decoded by `loads_message`. When msgspec is installed it decodes
+them against the shape of bot_response_message, keeping only the fields the clients read and skipping
+the rest of the document without building it.
+"""
+
+import json
+import os
+from typing import Any, Callable, List, Optional, Tuple, Type
+
+BACKENDS = ("orjson", "msgspec", "ujson", "json")
+
+
+class JSONCodec:
+    """
+    A JSON backend.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        loads: Callable[[str or bytes], Any],
+        dumps: Callable[[Any], str],
+        decode_errors: Tuple[Type[Exception], ...] = (ValueError,),
+    ):
+        """
+        Args:
+            name (str): The name of the backend.
+            loads (callable): Decodes a str or bytes document.
+            dumps (callable): Encodes an object to a str document.
+            decode_errors (tuple): The exceptions raised by loads on invalid documents.
+        """
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+        self.decode_errors = decode_errors
+
+    def __repr__(self) -> str:
+        return f"JSONCodec({self.name!r})"
+
+
+def load_codec(name: str) -> JSONCodec:
+    """
+    Creates the codec of a backend.
+
+    Args:
+        name (str): One of BACKENDS.
+
+    Returns:
+        JSONCodec: The codec.
+
+    Raises:
+        ImportError: If the backend is not installed.
+    """
+    if name == "orjson":
+        import orjson
+
+        return JSONCodec(
+            "orjson",
+            orjson.loads,
+            lambda obj: orjson.dumps(obj).decode(),
+            (orjson.JSONDecodeError,),
+        )
+    if name == "msgspec":
+        import msgspec
+
+        decoder = msgspec.json.Decoder()
+        encoder = msgspec.json.Encoder()
+        return JSONCodec(
+            "msgspec",
+            decoder.decode,
+            lambda obj: encoder.encode(obj).decode(),
+            (msgspec.DecodeError,),
+        )
+    if name == "ujson":
+        import ujson
+
+        return JSONCodec(
+            "ujson",
+            ujson.loads,
+            lambda obj: ujson.dumps(obj, ensure_ascii=False),
+            (ujson.JSONDecodeError,),
+        )
+    if name == "json":
+        return JSONCodec("json", json.loads, json.dumps, (json.JSONDecodeError,))
+    raise ValueError(f"Unknown JSON backend {name!r}, expected one of {BACKENDS}.")
+
+
+def default_codec() -> JSONCodec:
+    """
+    Returns the codec named by META_AI_JSON, or the first installed backend.
+    """
+    names = [os.environ["META_AI_JSON"]] if os.environ.get("META_AI_JSON") else []
+    for name in names + list(BACKENDS):
+        try:
+            return load_codec(name)
+        except ImportError:
+            continue
+
+
+def typed_message_decoder(codec: JSONCodec) -> Optional[Callable[[str or bytes], dict]]:
+    """
+    Builds a decoder of streamed message lines reading only the fields of bot_response_message used by
+    the clients, or returns None if msgspec is not installed.
+
+    The decoded line has the same shape as a fully decoded one, minus the fields that were skipped and
+    those that were null. Lines that do not match the expected types are decoded in full by the codec.
+    """
+    try:
+        import msgspec
+    except ImportError:
+        return None
+
+    class Struct(msgspec.Struct, omit_defaults=True):
+        pass
+
+    class Media(Struct):
+        uri: Optional[str] = None
+        media_type: Optional[str] = None
+        prompt: Optional[str] = None
+
+    class MediaSet(Struct):
+        imagine_media: List[Media] = []
+
+    class ImagineSession(Struct):
+        media_sets: List[MediaSet] = []
+
+    class ImagineCard(Struct):
+        session: Optional[ImagineSession] = None
+
+    class Content(Struct):
+        text: str
+
+    class ComposedText(Struct):
+        content: List[Content] = []
+
+    class BotResponseMessage(Struct):
+        id: Optional[str] = None
+        streaming_state: Optional[str] = None
+        fetch_id: Optional[str] = None
+        composed_text: Optional[ComposedText] = None
+        imagine_card: Optional[ImagineCard] = None
+
+    class Node(Struct):
+        bot_response_message: Optional[BotResponseMessage] = None
+
+    class Data(Struct):
+        node: Optional[Node] = None
+
+    class Line(Struct):
+        data: Optional[Data] = None
+
+    decoder = msgspec.json.Decoder(Line)
+    to_builtins = msgspec.to_builtins
+    fallback = codec.loads
+
+    def decode(line: str or bytes) -> dict:
+        try:
+            return to_builtins(decoder.decode(line))
+        except msgspec.DecodeError:
+            # Unexpected types, or invalid JSON which the codec reports with its own error.
+            return fallback(line)
+
+    return decode
+
+
+def set_codec(codec: JSONCodec or str, typed_messages: bool = True):
+    """
+    Chooses the JSON backend used by the library.
+
+    Args:
+        codec (JSONCodec or str): A codec, or the name of an installed backend.
+        typed_messages (bool): Whether to decode streamed messages with the msgspec typed decoder when
+            msgspec is installed. Defaults to True.
+    """
+    global CODEC, loads, dumps, loads_message, DecodeError
+    if isinstance(codec, str):
+        codec = load_codec(codec)
+    CODEC = codec
+    loads = codec.loads
+    dumps = codec.dumps
+    loads_message = _build_loads_message if typed_messages else codec.loads
+    DecodeError = codec.decode_errors
+
+
+def _build_loads_message(line: str or bytes) -> dict:
+    # Importing msgspec and building the decoder is deferred to the first message, to keep imports fast.
+    global loads_message
+    loads_message = typed_message_decoder(CODEC) or CODEC.loads
+    return loads_message(line)
+
+
+CODEC: JSONCodec
+loads: Callable[[str or bytes], Any]
+dumps: Callable[[Any], str]
+loads_message: Callable[[str or bytes], dict]
+DecodeError: Tuple[Type[Exception], ...]
+
+set_codec(default_codec())
@@ -0,0 +1,179 @@
+"""
+Deadlines, cancellation and stop conditions of prompts.
+"""
+
+import time
+from typing import (
+    AsyncIterator,
+    Callable,
+    Iterable,
+    Iterator,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+from meta_ai_api.exceptions import DeadlineExceeded, PromptCancelled
+
+T = TypeVar("T")
+
+
+class Timeout:
+    """
+    The time limits of a prompt, in seconds. None means no limit.
+    """
+
+    __slots__ = ("connect", "first_token", "total")
+
+    def __init__(
+        self,
+        connect: Optional[float] = None,
+        first_token: Optional[float] = None,
+        total: Optional[float] = None,
+    ):
+        """
+        Args:
+            connect (float): The longest wait to connect to Meta AI.
+            first_token (float): The longest wait for the response to start once the message is sent.
+                Later reads of the response may not stall longer than this either.
+            total (float): The longest the whole prompt may take, retries included.
+        """
+        self.connect = connect
+        self.first_token = first_token
+        self.total = total
+
+    def __repr__(self) -> str:
+        return (
+            f"Timeout(connect={self.connect!r}, first_token={self.first_token!r}, "
+            f"total={self.total!r})"
+        )
+
+
+class Deadline:
+    """
+    Tracks the time limits and cancellation of one prompt.
+    """
+
+    __slots__ = ("timeout", "cancel", "expires_at")
+
+    def __init__(self, timeout: Timeout or float = None, cancel=None):
+        """
+        Args:
+            timeout (Timeout or float): The time limits, or the total time limit in seconds.
+            cancel (threading.Event or asyncio.Event): Cancels the prompt once set.
+        """
+        if timeout is not None and not isinstance(timeout, Timeout):
+            timeout = Timeout(total=timeout)
+        self.timeout = timeout if timeout is not None else Timeout()
+        self.cancel = cancel
+        self.expires_at = (
+            time.monotonic() + self.timeout.total
+            if self.timeout.total is not None
+            else None
+        )
+
+    def remaining(self) -> Optional[float]:
+        """
+        Returns the seconds left before the total deadline, None without one.
+        """
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.monotonic()
+
+    def check(self):
+        """
+        Raises:
+            PromptCancelled: If the prompt was cancelled.
+            DeadlineExceeded: If the total deadline passed.
+        """
+        if self.cancel is not None and self.cancel.is_set():
+            raise PromptCancelled("The prompt was cancelled.")
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            raise DeadlineExceeded(
+                f"The prompt did not complete within {self.timeout.total}s."
+            )
+
+    def read_timeout(self) -> Optional[float]:
+        """
+        Returns the longest a single read of the response may block: the first token limit, capped by
+        the time left.
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return self.timeout.first_token
+        remaining = max(remaining, 0.001)
+        if self.timeout.first_token is None:
+            return remaining
+        return min(self.timeout.first_token, remaining)
+
+    def request_timeout(self) -> Tuple[Optional[float], Optional[float]]:
+        """
+        Returns the (connect, read) timeout of a request sent with the requests library.
+        """
+        return self.timeout.connect, self.read_timeout()
+
+    def sleep(self, seconds: float):
+        """
+        Sleeps up to the given time, no longer than the time left, and waking up as soon as the prompt is
+        cancelled.
+
+        Raises:
+            PromptCancelled: If the prompt was cancelled.
+            DeadlineExceeded: If the total deadline passed.
+        """
+        remaining = self.remaining()
+        if remaining is not None:
+            seconds = min(seconds, max(remaining, 0))
+        if self.cancel is not None:
+            self.cancel.wait(seconds)
+        else:
+            time.sleep(seconds)
+        self.check()
+
+    async def sleep_async(self, seconds: float):
+        """
+        Async counterpart of `sleep`, for a cancel event that is an asyncio.Event.
+        """
+        import asyncio
+
+        remaining = self.remaining()
+        if remaining is not None:
+            seconds = min(seconds, max(remaining, 0))
+        if self.cancel is not None:
+            try:
+                await asyncio.wait_for(self.cancel.wait(), seconds)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            await asyncio.sleep(seconds)
+        self.check()
+
+    def watch(self, lines: Iterable[T]) -> Iterator[T]:
+        """
+        Yields the lines of a response, raising as soon as the prompt is cancelled or out of time.
+        """
+        for line in lines:
+            self.check()
+            yield line
+
+    async def watch_async(self, lines: AsyncIterator[T]) -> AsyncIterator[T]:
+        """
+        Async counterpart of `watch`.
+        """
+        async for line in lines:
+            self.check()
+            yield line
+
+
+def stop_after(chars: int) -> Callable[[str], bool]:
+    """
+    Returns a stop condition met once the message reaches the given number of characters.
+    """
+    return lambda text: len(text) >= chars
+
+
+def stop_at(*strings: str) -> Callable[[str], bool]:
+    """
+    Returns a stop condition met once the message contains any of the given strings.
+    """
+    return lambda text: any(string in text for string in strings)
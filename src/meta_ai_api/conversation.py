@@ -0,0 +1,67 @@
+import threading
+from typing import Callable, Dict, Generator, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from meta_ai_api.control import Timeout
+    from meta_ai_api.main import MetaAI
+
+
+class Conversation:
+    """
+    The state of one conversation with Meta AI.
+
+    A conversation shares the cookies, access token and connection pool of its client, and holds
+    nothing but its IDs, so creating one costs no network call and a few hundred bytes. Different
+    conversations of a client can be prompted from different threads at the same time, a single
+    conversation should be prompted by one thread at a time.
+
+    Works the same with AsyncMetaAI, whose prompt returns a coroutine to await.
+    """
+
+    __slots__ = ("client", "external_conversation_id", "offline_threading_id")
+
+    def __init__(
+        self,
+        client: "MetaAI",
+        external_conversation_id: str = None,
+        offline_threading_id: str = None,
+    ):
+        """
+        Args:
+            client (MetaAI): The client sending the prompts.
+            external_conversation_id (str): The ID of an existing conversation to continue, None to start
+                a new one with the first prompt.
+            offline_threading_id (str): The offline threading ID of the last message of the conversation.
+        """
+        self.client = client
+        self.external_conversation_id = external_conversation_id
+        self.offline_threading_id = offline_threading_id
+
+    def __repr__(self) -> str:
+        return f"Conversation({self.external_conversation_id!r})"
+
+    def prompt(
+        self,
+        message: str,
+        stream: bool = False,
+        attempts: int = 0,
+        new_conversation: bool = False,
+        delta: bool = False,
+        timeout: "Timeout" or float = None,
+        stop: Callable[[str], bool] = None,
+        cancel: threading.Event = None,
+    ) -> Dict or Generator[Dict, None, None]:
+        """
+        Sends a message in this conversation, see MetaAI.prompt.
+        """
+        return self.client.prompt(
+            message,
+            stream=stream,
+            attempts=attempts,
+            new_conversation=new_conversation,
+            delta=delta,
+            conversation=self,
+            timeout=timeout,
+            stop=stop,
+            cancel=cancel,
+        )
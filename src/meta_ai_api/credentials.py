@@ -0,0 +1,260 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, where the file store is only safe to share between threads.
+    fcntl = None
+
+# Default lifetimes, in seconds, of the cached credentials.
+CREDENTIAL_TTLS = {
+    "abra_sess": 30 * 24 * 3600,
+    "datr": 30 * 24 * 3600,
+    "_js_datr": 30 * 24 * 3600,
+    "abra_csrf": 24 * 3600,
+    "lsd": 24 * 3600,
+    "fb_dtsg": 24 * 3600,
+    "access_token": 3600,
+}
+
+
+class CredentialStore:
+    """
+    Base class of the persistent credential caches.
+
+    Credentials are stored per account (the Facebook email, or "anonymous") and per name (cookie or
+    token name), each entry with its own expiry. Expired entries are never returned.
+    """
+
+    def __init__(
+        self, ttls: Dict[str, float] = None, clock: Callable[[], float] = time.time
+    ):
+        """
+        Args:
+            ttls (dict): Lifetimes in seconds per credential name, merged over CREDENTIAL_TTLS.
+            clock (Callable[[], float]): The wall clock the expiries are stored in, shared by every
+                process using the store. Defaults to time.time.
+        """
+        self.ttls = {**CREDENTIAL_TTLS, **(ttls or {})}
+        self.clock = clock
+
+    def get(self, account: str, name: str) -> Optional[str]:
+        """
+        Returns a cached credential, or None if it is missing or expired.
+        """
+        return self.get_all(account).get(name)
+
+    def get_all(self, account: str) -> Dict[str, str]:
+        """
+        Returns every credential of an account that has not expired yet.
+        """
+        raise NotImplementedError
+
+    def get_expiry(self, account: str, name: str) -> Optional[float]:
+        """
+        Returns the time, in seconds since the epoch, at which a cached credential expires, or None if
+        it is missing or expired.
+        """
+        raise NotImplementedError
+
+    def set(self, account: str, name: str, value: str, ttl: float = None):
+        """
+        Caches a credential.
+
+        Args:
+            account (str): The account the credential belongs to.
+            name (str): The name of the credential.
+            value (str): The credential itself.
+            ttl (float): Seconds before expiry, defaults to the configured lifetime of the name.
+        """
+        self.update(account, {name: value}, ttl=ttl)
+
+    def update(self, account: str, values: Dict[str, str], ttl: float = None):
+        """
+        Caches several credentials of an account at once.
+        """
+        raise NotImplementedError
+
+    def delete(self, account: str, name: str = None):
+        """
+        Removes one credential of an account, or all of them when no name is given.
+        """
+        raise NotImplementedError
+
+    def _expires_at(self, name: str, ttl: Optional[float]) -> float:
+        if ttl is None:
+            ttl = self.ttls.get(name, 3600)
+        return self.clock() + ttl
+
+
+class FileCredentialStore(CredentialStore):
+    """
+    Stores credentials in a JSON file. The file is re-read on every access and replaced atomically on
+    every write. Writes hold an exclusive lock on a `.lock` file next to it, so several processes can
+    share it on POSIX systems. Use SQLiteCredentialStore to share credentials between processes on
+    Windows.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttls: Dict[str, float] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        super().__init__(ttls=ttls, clock=clock)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write(self, data: dict):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def _modify(self, change: Callable[[dict], None]):
+        """
+        Reads the file, applies a change to its data and writes it back, as one transaction between
+        the threads and processes sharing it.
+        """
+        with self._lock:
+            if fcntl is None:
+                data = self._read()
+                change(data)
+                self._write(data)
+                return
+            with open(f"{self.path}.lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    data = self._read()
+                    change(data)
+                    self._write(data)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_all(self, account: str) -> Dict[str, str]:
+        now = self.clock()
+        entries = self._read().get(account, {})
+        return {
+            name: value
+            for name, (value, expires_at) in entries.items()
+            if expires_at > now
+        }
+
+    def get_expiry(self, account: str, name: str) -> Optional[float]:
+        entry = self._read().get(account, {}).get(name)
+        if entry is None or entry[1] <= self.clock():
+            return None
+        return entry[1]
+
+    def update(self, account: str, values: Dict[str, str], ttl: float = None):
+        def change(data: dict):
+            entries = data.setdefault(account, {})
+            for name, value in values.items():
+                entries[name] = [value, self._expires_at(name, ttl)]
+
+        self._modify(change)
+
+    def delete(self, account: str, name: str = None):
+        def change(data: dict):
+            if name is None:
+                data.pop(account, None)
+            else:
+                data.get(account, {}).pop(name, None)
+
+        self._modify(change)
+
+
+class SQLiteCredentialStore(CredentialStore):
+    """
+    Stores credentials in a SQLite database. A connection is opened per operation, which keeps the
+    store safe to use across threads and forked worker processes.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttls: Dict[str, float] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        super().__init__(ttls=ttls, clock=clock)
+        self.path = path
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS credentials ("
+                    "account TEXT NOT NULL, name TEXT NOT NULL, value TEXT NOT NULL, "
+                    "expires_at REAL NOT NULL, PRIMARY KEY (account, name))"
+                )
+        finally:
+            connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_all(self, account: str) -> Dict[str, str]:
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT name, value FROM credentials WHERE account = ? AND expires_at > ?",
+                (account, self.clock()),
+            ).fetchall()
+        finally:
+            connection.close()
+        return dict(rows)
+
+    def get_expiry(self, account: str, name: str) -> Optional[float]:
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                "SELECT expires_at FROM credentials "
+                "WHERE account = ? AND name = ? AND expires_at > ?",
+                (account, name, self.clock()),
+            ).fetchone()
+        finally:
+            connection.close()
+        return row[0] if row is not None else None
+
+    def update(self, account: str, values: Dict[str, str], ttl: float = None):
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO credentials VALUES (?, ?, ?, ?)",
+                    [
+                        (account, name, value, self._expires_at(name, ttl))
+                        for name, value in values.items()
+                    ],
+                )
+        finally:
+            connection.close()
+
+    def delete(self, account: str, name: str = None):
+        connection = self._connect()
+        try:
+            with connection:
+                if name is None:
+                    connection.execute(
+                        "DELETE FROM credentials WHERE account = ?", (account,)
+                    )
+                else:
+                    connection.execute(
+                        "DELETE FROM credentials WHERE account = ? AND name = ?",
+                        (account, name),
+                    )
+        finally:
+            connection.close()
@@ -4,3 +4,47 @@ class FacebookInvalidCredentialsException(Exception):
 
 class FacebookRegionBlocked(Exception):
     pass
+
+
+class MetaAIResponseError(Exception):
+    pass
+
+
+class MissingTokenError(MetaAIResponseError):
+    pass
+
+
+class AccessTokenRejected(MetaAIResponseError):
+    pass
+
+
+class RetriesExhausted(Exception):
+    pass
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class NoIdentityAvailable(Exception):
+    pass
+
+
+class RateLimited(Exception):
+    pass
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class PromptCancelled(Exception):
+    pass
+
+
+class WorkerOverloaded(Exception):
+    pass
+
+
+class UnknownConversation(KeyError):
+    pass
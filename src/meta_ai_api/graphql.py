@@ -0,0 +1,223 @@
+"""
+The GraphQL operations sent to Meta AI, and the encoding of their requests.
+
+Every operation is registered here once, with its `doc_id`, the variables that never change, its endpoint
+and the credential it is authenticated with. The static parts of a request are encoded when the operation
+is registered, so that sending it only encodes its dynamic variables and credential. This is the place to
+update when Meta rotates a `doc_id`, or at runtime:
+
+    from meta_ai_api import graphql
+
+    graphql.update_doc_id(graphql.SEND_MESSAGE, "1234567890")
+"""
+
+import copy
+import json
+import urllib.parse
+from typing import Dict
+
+from meta_ai_api import codec
+
+ACCEPT_TOS = "useAbraAcceptTOSForTempUserMutation"
+SEND_MESSAGE = "useAbraSendMessageMutation"
+SEARCH_SOURCES = "AbraSearchPluginDialogQuery"
+
+# Endpoints, named after the URL attributes of the clients.
+GRAPHQL = "graphql_url"
+GRAPH_API = "graph_api_url"
+
+# Credentials, named after the form field carrying them.
+LSD = "lsd"
+ACCESS_TOKEN = "access_token"
+# fb_dtsg on the meta.ai endpoint when logged in with Facebook, the access token otherwise.
+SESSION = "session"
+
+FORM_CONTENT_TYPE = "application/x-www-form-urlencoded"
+
+
+class Operation:
+    """
+    A GraphQL operation, with the static parts of its requests encoded once.
+    """
+
+    __slots__ = (
+        "name",
+        "doc_id",
+        "variables",
+        "endpoint",
+        "auth",
+        "server_timestamps",
+        "headers",
+        "_static_form",
+        "_static_variables",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        doc_id: str,
+        variables: Dict = None,
+        endpoint: str = GRAPHQL,
+        auth: str = ACCESS_TOKEN,
+        server_timestamps: bool = True,
+        headers: Dict[str, str] = None,
+    ):
+        """
+        Args:
+            name (str): The friendly name of the operation, such as "useAbraSendMessageMutation".
+            doc_id (str): The ID of the persisted query.
+            variables (dict): The variables sent unchanged with every request.
+            endpoint (str): The endpoint, GRAPHQL or GRAPH_API. Defaults to GRAPHQL.
+            auth (str): The credential, LSD, ACCESS_TOKEN or SESSION. Defaults to ACCESS_TOKEN.
+            server_timestamps (bool): Whether to ask for server timestamps. Defaults to True.
+            headers (dict): Headers sent with every request, besides the content type and friendly name.
+        """
+        self.name = name
+        self.doc_id = doc_id
+        self.variables = variables or {}
+        self.endpoint = endpoint
+        self.auth = auth
+        self.server_timestamps = server_timestamps
+        # Shared by every request, not to be modified.
+        self.headers = {
+            "content-type": FORM_CONTENT_TYPE,
+            "x-fb-friendly-name": name,
+            **(headers or {}),
+        }
+        self._static_form = None
+        self._static_variables = None
+        self._encode_static()
+
+    def _encode_static(self):
+        fields = {
+            "fb_api_caller_class": "RelayModern",
+            "fb_api_req_friendly_name": self.name,
+        }
+        if self.server_timestamps:
+            fields["server_timestamps"] = "true"
+        fields["doc_id"] = self.doc_id
+        self._static_form = urllib.parse.urlencode(fields)
+        # The static variables without their braces, spliced after the dynamic ones.
+        static_variables = json.dumps(self.variables, separators=(",", ":"))
+        self._static_variables = urllib.parse.quote_plus(static_variables[1:-1])
+
+    def __repr__(self) -> str:
+        return f"Operation({self.name!r}, doc_id={self.doc_id!r})"
+
+    def encode_variables(self, **variables) -> str:
+        """
+        Encodes the variables of a request, the given dynamic ones followed by the static ones.
+
+        Returns:
+            str: The URL encoded JSON object, to pass to `encode`.
+        """
+        if not variables:
+            return f"%7B{self._static_variables}%7D"
+        dynamic = urllib.parse.quote_plus(codec.dumps(variables)[:-1])
+        if not self._static_variables:
+            return f"{dynamic}%7D"
+        return f"{dynamic}%2C{self._static_variables}%7D"
+
+    def auth_field(self, is_authed: bool) -> str:
+        """
+        Returns the form field carrying the credential of a request.
+        """
+        if self.auth == SESSION:
+            return "fb_dtsg" if is_authed else ACCESS_TOKEN
+        return self.auth
+
+    def url(self, client) -> str:
+        """
+        Returns the URL a client sends the operation to.
+        """
+        if self.auth == SESSION and client.is_authed:
+            return client.graphql_url
+        return getattr(client, self.endpoint)
+
+    def encode(self, credential: str, is_authed: bool, variables: str = None) -> str:
+        """
+        Encodes the form body of a request.
+
+        Args:
+            credential (str): The lsd token, access token or fb_dtsg token, see `auth_field`.
+            is_authed (bool): Whether the client is logged in with Facebook.
+            variables (str): The variables encoded by `encode_variables`. Defaults to the static ones.
+
+        Returns:
+            str: The form body.
+        """
+        if variables is None:
+            variables = self.encode_variables()
+        credential = urllib.parse.quote_plus(str(credential))
+        return (
+            f"{self.auth_field(is_authed)}={credential}&variables={variables}&"
+            f"{self._static_form}"
+        )
+
+
+OPERATIONS: Dict[str, Operation] = {}
+
+
+def register(operation: Operation) -> Operation:
+    """
+    Adds an operation to the registry, replacing the one of the same name.
+    """
+    OPERATIONS[operation.name] = operation
+    return operation
+
+
+def update_doc_id(name: str, doc_id: str) -> Operation:
+    """
+    Replaces a registered operation with a copy under a new `doc_id`, such as after Meta rotated it.
+    """
+    operation = copy.copy(OPERATIONS[name])
+    operation.doc_id = doc_id
+    operation._encode_static()
+    return register(operation)
+
+
+register(
+    Operation(
+        ACCEPT_TOS,
+        "7604648749596940",
+        {
+            "dob": "1999-01-01",
+            "icebreaker_type": "TEXT",
+            "__relay_internal__pv__WebPixelRatiorelayprovider": 1,
+        },
+        endpoint=GRAPHQL,
+        auth=LSD,
+        server_timestamps=False,
+        headers={"sec-fetch-site": "same-origin"},
+    )
+)
+register(
+    Operation(
+        SEND_MESSAGE,
+        "7783822248314888",
+        {
+            "suggestedPromptIndex": None,
+            "flashVideoRecapInput": {"images": []},
+            "flashPreviewInput": None,
+            "promptPrefix": None,
+            "entrypoint": "ABRA__CHAT__TEXT",
+            "icebreaker_type": "TEXT",
+            "__relay_internal__pv__AbraDebugDevOnlyrelayprovider": False,
+            "__relay_internal__pv__WebPixelRatiorelayprovider": 1,
+        },
+        endpoint=GRAPH_API,
+        auth=SESSION,
+    )
+)
+register(
+    Operation(
+        SEARCH_SOURCES,
+        "6946734308765963",
+        endpoint=GRAPH_API,
+        auth=ACCESS_TOKEN,
+        headers={
+            "authority": "graph.meta.ai",
+            "accept-language": "en-US,en;q=0.9,fr-FR;q=0.8,fr;q=0.7",
+        },
+    )
+)
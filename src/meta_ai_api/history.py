@@ -0,0 +1,467 @@
+"""
+Conversation history, appended to disk as prompts are answered and read back a page at a time.
+
+Only indexes stay in memory: the turns themselves are loaded when a page is read. Sources are stored
+once however many turns cite them, and the sources read back are interned, so turns citing the same
+reference share one read-only mapping.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+USER = "user"
+ASSISTANT = "assistant"
+
+
+class Turn:
+    """
+    One message of a conversation, either the prompt of the user or the answer of Meta AI.
+    """
+
+    __slots__ = (
+        "conversation_id",
+        "index",
+        "role",
+        "text",
+        "sources",
+        "media",
+        "created_at",
+    )
+
+    def __init__(
+        self,
+        conversation_id: str,
+        index: int,
+        role: str,
+        text: str,
+        sources: Tuple[Mapping, ...] = (),
+        media: Tuple[Mapping, ...] = (),
+        created_at: float = None,
+    ):
+        """
+        Args:
+            conversation_id (str): The external conversation ID.
+            index (int): The position of the turn in the conversation, from 0.
+            role (str): "user" or "assistant".
+            text (str): The message.
+            sources (tuple): The references cited by the answer.
+            media (tuple): The images or videos of the answer.
+            created_at (float): The time the turn was recorded, in seconds since the epoch.
+        """
+        self.conversation_id = conversation_id
+        self.index = index
+        self.role = role
+        self.text = text
+        self.sources = sources
+        self.media = media
+        self.created_at = created_at if created_at is not None else time.time()
+
+    def __repr__(self) -> str:
+        return (
+            f"Turn({self.conversation_id!r}, {self.index}, {self.role!r}, "
+            f"{self.text[:40]!r})"
+        )
+
+    def to_dict(self) -> Dict:
+        """
+        Returns the turn as a JSON serializable dictionary, shaped like the responses of prompt.
+        """
+        return {
+            "role": self.role,
+            "message": self.text,
+            "sources": [dict(source) for source in self.sources],
+            "media": [dict(media) for media in self.media],
+            "created_at": self.created_at,
+        }
+
+
+class HistoryStore:
+    """
+    Base class of the conversation logs.
+
+    Turns are only ever appended. Pass a store as the `history` of a client to record every prompt it
+    answers, then read a conversation back with `page`.
+    """
+
+    def __init__(self, max_cached_sources: int = 4096):
+        """
+        Args:
+            max_cached_sources (int): The number of sources kept interned in memory. Defaults to 4096.
+        """
+        self.max_cached_sources = max_cached_sources
+        self._sources: "OrderedDict[int, Mapping]" = OrderedDict()
+        self._sources_lock = threading.Lock()
+
+    def record(self, conversation_id: str, message: str, response: Dict):
+        """
+        Appends a prompt and its answer.
+
+        Args:
+            conversation_id (str): The external conversation ID.
+            message (str): The message sent.
+            response (dict): The response returned by prompt, or the last item of its stream.
+        """
+        self.extend(
+            conversation_id,
+            [
+                (USER, message, (), ()),
+                (
+                    ASSISTANT,
+                    response.get("message", ""),
+                    response.get("sources") or (),
+                    response.get("media") or (),
+                ),
+            ],
+        )
+
+    def append(
+        self,
+        conversation_id: str,
+        role: str,
+        text: str,
+        sources: Sequence[Dict] = (),
+        media: Sequence[Dict] = (),
+    ):
+        """
+        Appends one turn.
+        """
+        self.extend(conversation_id, [(role, text, sources, media)])
+
+    def extend(
+        self,
+        conversation_id: str,
+        turns: Iterable[Tuple[str, str, Sequence[Dict], Sequence[Dict]]],
+    ):
+        """
+        Appends several turns at once, as (role, text, sources, media) tuples.
+        """
+        raise NotImplementedError
+
+    def page(
+        self, conversation_id: str, offset: int = 0, limit: int = 50
+    ) -> List[Turn]:
+        """
+        Reads the turns of a conversation, oldest first.
+
+        Args:
+            conversation_id (str): The external conversation ID.
+            offset (int): The number of turns to skip. Defaults to 0.
+            limit (int): The maximum number of turns to return. Defaults to 50.
+
+        Returns:
+            list: The turns, empty past the end of the conversation or for an unknown one.
+        """
+        raise NotImplementedError
+
+    def count(self, conversation_id: str) -> int:
+        """
+        Returns the number of turns of a conversation.
+        """
+        raise NotImplementedError
+
+    def _cached_source(self, source_id: int) -> Optional[Mapping]:
+        with self._sources_lock:
+            source = self._sources.get(source_id)
+            if source is not None:
+                self._sources.move_to_end(source_id)
+            return source
+
+    def _cache_source(self, source_id: int, source: Dict) -> Mapping:
+        source = MappingProxyType(source)
+        with self._sources_lock:
+            self._sources[source_id] = source
+            while len(self._sources) > self.max_cached_sources:
+                self._sources.popitem(last=False)
+        return source
+
+
+def source_digest(source: Dict) -> Tuple[str, bytes]:
+    """
+    Serializes a source canonically, and returns it with the digest identifying it.
+    """
+    data = json.dumps(source, sort_keys=True, separators=(",", ":"))
+    return data, hashlib.blake2b(data.encode(), digest_size=16).digest()
+
+
+class JSONLHistoryStore(HistoryStore):
+    """
+    Appends the turns to a JSON Lines file, one turn per line, every source written once on a line of
+    its own before the first turn citing it.
+
+    The file is indexed when the store is opened. The index holds about 250 bytes per conversation, 8
+    bytes per turn and 60 bytes per distinct source, so 100k conversations take about 25 MB. A single
+    process should write the file at a time, use SQLiteHistoryStore to share a history.
+    """
+
+    def __init__(self, path: str, max_cached_sources: int = 4096):
+        super().__init__(max_cached_sources=max_cached_sources)
+        self.path = path
+        self._turns: Dict[str, array] = {}
+        self._source_offsets = array("Q")
+        self._source_ids: Dict[bytes, int] = {}
+        self._lock = threading.Lock()
+        self._load()
+        self._file = open(path, "ab")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        offset = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                entry = json.loads(line)
+                if "source" in entry:
+                    source = entry["data"]
+                    self._source_ids[source_digest(source)[1]] = entry["source"]
+                    self._source_offsets.append(offset)
+                else:
+                    turns = self._turns.get(entry["c"])
+                    if turns is None:
+                        turns = self._turns[entry["c"]] = array("Q")
+                    turns.append(offset)
+                offset += len(line)
+        if offset < os.path.getsize(self.path):
+            # A write was cut short, drop it so that the next one starts on a line of its own.
+            os.truncate(self.path, offset)
+
+    def extend(
+        self,
+        conversation_id: str,
+        turns: Iterable[Tuple[str, str, Sequence[Dict], Sequence[Dict]]],
+    ):
+        now = time.time()
+        with self._lock:
+            offset = self._file.tell()
+            lines = []
+            turn_offsets = []
+            source_offsets = []
+            new_sources: Dict[bytes, int] = {}
+            for role, text, sources, media in turns:
+                source_ids = []
+                for source in sources:
+                    data, digest = source_digest(source)
+                    source_id = self._source_ids.get(digest, new_sources.get(digest))
+                    if source_id is None:
+                        source_id = len(self._source_offsets) + len(source_offsets)
+                        new_sources[digest] = source_id
+                        line = f'{{"source":{source_id},"data":{data}}}\n'.encode()
+                        lines.append(line)
+                        source_offsets.append(offset)
+                        offset += len(line)
+                    source_ids.append(source_id)
+                entry = {"c": conversation_id, "r": role, "t": text, "at": now}
+                if source_ids:
+                    entry["s"] = source_ids
+                if media:
+                    entry["m"] = list(media)
+                line = json.dumps(entry, separators=(",", ":")).encode() + b"\n"
+                lines.append(line)
+                turn_offsets.append(offset)
+                offset += len(line)
+            self._file.write(b"".join(lines))
+            self._file.flush()
+            # Index the new lines once they are written in full.
+            self._source_offsets.extend(source_offsets)
+            self._source_ids.update(new_sources)
+            conversation = self._turns.get(conversation_id)
+            if conversation is None:
+                conversation = self._turns[conversation_id] = array("Q")
+            conversation.extend(turn_offsets)
+
+    def page(
+        self, conversation_id: str, offset: int = 0, limit: int = 50
+    ) -> List[Turn]:
+        with self._lock:
+            offsets = self._turns.get(conversation_id)
+            if offsets is None:
+                return []
+            offsets = offsets[offset : offset + limit]
+        turns = []
+        with open(self.path, "rb") as f:
+            for index, turn_offset in enumerate(offsets, start=offset):
+                f.seek(turn_offset)
+                entry = json.loads(f.readline())
+                turns.append(
+                    Turn(
+                        conversation_id,
+                        index,
+                        entry["r"],
+                        entry["t"],
+                        tuple(self._source(f, source) for source in entry.get("s", ())),
+                        tuple(MappingProxyType(media) for media in entry.get("m", ())),
+                        entry["at"],
+                    )
+                )
+        return turns
+
+    def count(self, conversation_id: str) -> int:
+        with self._lock:
+            return len(self._turns.get(conversation_id, ()))
+
+    def _source(self, f, source_id: int) -> Mapping:
+        source = self._cached_source(source_id)
+        if source is None:
+            f.seek(self._source_offsets[source_id])
+            source = self._cache_source(source_id, json.loads(f.readline())["data"])
+        return source
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """
+    Stores the turns in a SQLite database, shared between processes and kept across restarts. Sources
+    are stored once in a table of their own.
+    """
+
+    def __init__(self, path: str, max_cached_sources: int = 4096):
+        super().__init__(max_cached_sources=max_cached_sources)
+        self.path = path
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS history_sources ("
+                    "id INTEGER PRIMARY KEY, digest BLOB NOT NULL UNIQUE, data TEXT NOT NULL)"
+                )
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS history_turns ("
+                    "conversation_id TEXT NOT NULL, position INTEGER NOT NULL, "
+                    "role TEXT NOT NULL, text TEXT NOT NULL, sources TEXT, media TEXT, "
+                    "created_at REAL NOT NULL, PRIMARY KEY (conversation_id, position))"
+                )
+        finally:
+            connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def extend(
+        self,
+        conversation_id: str,
+        turns: Iterable[Tuple[str, str, Sequence[Dict], Sequence[Dict]]],
+    ):
+        now = time.time()
+        connection = self._connect()
+        try:
+            with connection:
+                # Take the write lock first, so that concurrent writers agree on the positions.
+                connection.execute("BEGIN IMMEDIATE")
+                (position,) = connection.execute(
+                    "SELECT COALESCE(MAX(position) + 1, 0) FROM history_turns "
+                    "WHERE conversation_id = ?",
+                    (conversation_id,),
+                ).fetchone()
+                rows = []
+                for role, text, sources, media in turns:
+                    source_ids = [
+                        self._source_id(connection, source) for source in sources
+                    ]
+                    rows.append(
+                        (
+                            conversation_id,
+                            position,
+                            role,
+                            text,
+                            ",".join(map(str, source_ids)) if source_ids else None,
+                            json.dumps(list(media)) if media else None,
+                            now,
+                        )
+                    )
+                    position += 1
+                connection.executemany(
+                    "INSERT INTO history_turns VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+                )
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _source_id(connection: sqlite3.Connection, source: Dict) -> int:
+        data, digest = source_digest(source)
+        connection.execute(
+            "INSERT OR IGNORE INTO history_sources (digest, data) VALUES (?, ?)",
+            (digest, data),
+        )
+        (source_id,) = connection.execute(
+            "SELECT id FROM history_sources WHERE digest = ?", (digest,)
+        ).fetchone()
+        return source_id
+
+    def page(
+        self, conversation_id: str, offset: int = 0, limit: int = 50
+    ) -> List[Turn]:
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT position, role, text, sources, media, created_at FROM history_turns "
+                "WHERE conversation_id = ? ORDER BY position LIMIT ? OFFSET ?",
+                (conversation_id, limit, offset),
+            ).fetchall()
+            source_ids = {
+                int(source_id)
+                for row in rows
+                if row[3]
+                for source_id in row[3].split(",")
+            }
+            sources = {}
+            missing = []
+            for source_id in source_ids:
+                source = self._cached_source(source_id)
+                if source is None:
+                    missing.append(source_id)
+                else:
+                    sources[source_id] = source
+            if missing:
+                placeholders = ",".join("?" * len(missing))
+                for source_id, data in connection.execute(
+                    f"SELECT id, data FROM history_sources WHERE id IN ({placeholders})",
+                    missing,
+                ):
+                    sources[source_id] = self._cache_source(source_id, json.loads(data))
+        finally:
+            connection.close()
+        return [
+            Turn(
+                conversation_id,
+                position,
+                role,
+                text,
+                (
+                    tuple(
+                        sources[int(source_id)] for source_id in row_sources.split(",")
+                    )
+                    if row_sources
+                    else ()
+                ),
+                (
+                    tuple(MappingProxyType(item) for item in json.loads(media))
+                    if media
+                    else ()
+                ),
+                created_at,
+            )
+            for position, role, text, row_sources, media, created_at in rows
+        ]
+
+    def count(self, conversation_id: str) -> int:
+        connection = self._connect()
+        try:
+            (count,) = connection.execute(
+                "SELECT COUNT(*) FROM history_turns WHERE conversation_id = ?",
+                (conversation_id,),
+            ).fetchone()
+        finally:
+            connection.close()
+        return count
@@ -0,0 +1,294 @@
+"""
+Instrumentation hooks, called by the clients around every request they send.
+
+Requests are named after their `fb_api_req_friendly_name`, such as "useAbraSendMessageMutation", or
+"landing_page" for the meta.ai page scraped for cookies. Clients without hooks skip all of this.
+"""
+
+import time
+from typing import Any, AsyncIterator, Iterable, Iterator, List, Optional
+
+# The stages of a prompt timed by `Hooks.on_phase`.
+COOKIES = "cookies"
+ACCESS_TOKEN = "access_token"
+GRACE_SLEEP = "grace_sleep"
+
+
+class Hooks:
+    """
+    Receives the events of the clients. Every method does nothing, override the ones of interest.
+
+    Hooks are called from the threads, or event loop, sending the requests, so they should be quick
+    and thread safe.
+    """
+
+    def before_request(self, name: str) -> Any:
+        """
+        Called before a request is sent.
+
+        Args:
+            name (str): The name of the request.
+
+        Returns:
+            Any: A context passed to the other events of the request, such as a span.
+        """
+        return None
+
+    def on_first_byte(self, name: str, context: Any, seconds: float):
+        """
+        Called when the response headers are received, `seconds` after the request was sent.
+        """
+
+    def on_chunk(self, name: str, context: Any, size: int, seconds: float):
+        """
+        Called after each line, or chunk, of a streamed response is handled.
+
+        Args:
+            name (str): The name of the request.
+            context (Any): The context returned by before_request.
+            size (int): The size of the chunk in bytes.
+            seconds (float): The time spent handling the chunk, parsing included. When streaming, it also
+                includes the time the caller spent before asking for the next item.
+        """
+
+    def after_request(
+        self,
+        name: str,
+        context: Any,
+        seconds: float,
+        bytes_sent: int,
+        bytes_received: int,
+        status: Optional[int],
+        error: Optional[BaseException],
+    ):
+        """
+        Called once a response has been read in full, or the request failed.
+
+        Args:
+            name (str): The name of the request.
+            context (Any): The context returned by before_request.
+            seconds (float): The time from sending the request to the end of the response.
+            bytes_sent (int): The size of the request body.
+            bytes_received (int): The size of the response body read.
+            status (int): The HTTP status, None if no response was received.
+            error (BaseException): The error the request failed with, None on success.
+        """
+
+    def on_retry(self, error: BaseException, attempt: int):
+        """
+        Called before a prompt is sent again, with the error of the failed attempt.
+        """
+
+    def on_phase(self, name: str, seconds: float):
+        """
+        Called after a stage of the bootstrap: "cookies", "access_token" or "grace_sleep".
+        """
+
+
+class CompositeHooks(Hooks):
+    """
+    Forwards every event to several hooks, such as a metrics collector and a tracer.
+    """
+
+    def __init__(self, *hooks: Hooks):
+        self.hooks: List[Hooks] = list(hooks)
+
+    def before_request(self, name: str) -> List[Any]:
+        return [hooks.before_request(name) for hooks in self.hooks]
+
+    def on_first_byte(self, name: str, context: List[Any], seconds: float):
+        for hooks, hooks_context in zip(self.hooks, context):
+            hooks.on_first_byte(name, hooks_context, seconds)
+
+    def on_chunk(self, name: str, context: List[Any], size: int, seconds: float):
+        for hooks, hooks_context in zip(self.hooks, context):
+            hooks.on_chunk(name, hooks_context, size, seconds)
+
+    def after_request(
+        self,
+        name: str,
+        context: List[Any],
+        seconds: float,
+        bytes_sent: int,
+        bytes_received: int,
+        status: Optional[int],
+        error: Optional[BaseException],
+    ):
+        for hooks, hooks_context in zip(self.hooks, context):
+            hooks.after_request(
+                name, hooks_context, seconds, bytes_sent, bytes_received, status, error
+            )
+
+    def on_retry(self, error: BaseException, attempt: int):
+        for hooks in self.hooks:
+            hooks.on_retry(error, attempt)
+
+    def on_phase(self, name: str, seconds: float):
+        for hooks in self.hooks:
+            hooks.on_phase(name, seconds)
+
+
+class RequestTrace:
+    """
+    Times one request and reports it to the hooks.
+    """
+
+    __slots__ = (
+        "hooks",
+        "name",
+        "context",
+        "started_at",
+        "bytes_sent",
+        "bytes_received",
+        "status",
+        "finished",
+    )
+
+    def __init__(self, hooks: Hooks, name: str, bytes_sent: int = 0):
+        self.hooks = hooks
+        self.name = name
+        self.bytes_sent = bytes_sent
+        self.bytes_received = 0
+        self.status = None
+        self.finished = False
+        self.context = hooks.before_request(name)
+        self.started_at = time.perf_counter()
+
+    def first_byte(self, status: int, seconds: float = None):
+        """
+        Records the response headers. Defaults to the time elapsed since the request was sent.
+        """
+        self.status = status
+        if seconds is None:
+            seconds = time.perf_counter() - self.started_at
+        self.hooks.on_first_byte(self.name, self.context, seconds)
+
+    def iterate(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Yields the chunks of a streamed response, reporting each one, and finishes the request after
+        the last.
+        """
+        hooks, name, context = self.hooks, self.name, self.context
+        clock = time.perf_counter
+        error = None
+        try:
+            for chunk in chunks:
+                size = len(chunk)
+                self.bytes_received += size
+                start = clock()
+                yield chunk
+                hooks.on_chunk(name, context, size, clock() - start)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # Also reached when the caller stops reading early.
+            self.finish(error)
+
+    async def iterate_async(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """
+        Async counterpart of `iterate`.
+        """
+        hooks, name, context = self.hooks, self.name, self.context
+        clock = time.perf_counter
+        error = None
+        try:
+            async for chunk in chunks:
+                size = len(chunk)
+                self.bytes_received += size
+                start = clock()
+                yield chunk
+                hooks.on_chunk(name, context, size, clock() - start)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.finish(error)
+
+    def finish(self, error: BaseException = None, bytes_received: int = None):
+        """
+        Reports the end of the request, once.
+        """
+        if self.finished:
+            return
+        self.finished = True
+        if bytes_received is not None:
+            self.bytes_received = bytes_received
+        self.hooks.after_request(
+            self.name,
+            self.context,
+            time.perf_counter() - self.started_at,
+            self.bytes_sent,
+            self.bytes_received,
+            self.status,
+            error,
+        )
+
+
+class OpenTelemetryHooks(Hooks):
+    """
+    Records every request, and every bootstrap stage, as an OpenTelemetry span.
+
+    Requires the opentelemetry-api package, spans are exported by whichever SDK the application set up.
+    """
+
+    def __init__(self, tracer: Any = None):
+        """
+        Args:
+            tracer (opentelemetry.trace.Tracer): The tracer creating the spans, defaults to the tracer of
+                the global tracer provider.
+        """
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            raise ImportError(
+                "OpenTelemetryHooks requires OpenTelemetry. "
+                "Install it with `pip install opentelemetry-api`."
+            ) from None
+        self.tracer = tracer if tracer is not None else trace.get_tracer("meta_ai_api")
+        self._trace = trace
+
+    def before_request(self, name: str) -> Any:
+        return self.tracer.start_span(
+            f"meta_ai {name}",
+            kind=self._trace.SpanKind.CLIENT,
+            attributes={"meta_ai.request": name},
+        )
+
+    def on_first_byte(self, name: str, context: Any, seconds: float):
+        context.add_event("first_byte", {"meta_ai.seconds": seconds})
+
+    def after_request(
+        self,
+        name: str,
+        context: Any,
+        seconds: float,
+        bytes_sent: int,
+        bytes_received: int,
+        status: Optional[int],
+        error: Optional[BaseException],
+    ):
+        context.set_attribute("meta_ai.bytes_sent", bytes_sent)
+        context.set_attribute("meta_ai.bytes_received", bytes_received)
+        if status is not None:
+            context.set_attribute("http.response.status_code", status)
+        if error is not None:
+            context.record_exception(error)
+            context.set_status(
+                self._trace.Status(self._trace.StatusCode.ERROR, str(error))
+            )
+        context.end()
+
+    def on_retry(self, error: BaseException, attempt: int):
+        self._trace.get_current_span().add_event(
+            "retry",
+            {"meta_ai.attempt": attempt, "exception.type": type(error).__name__},
+        )
+
+    def on_phase(self, name: str, seconds: float):
+        # The stage is over, create its span after the fact.
+        end = time.time_ns()
+        span = self.tracer.start_span(
+            f"meta_ai {name}", start_time=end - int(seconds * 1e9)
+        )
+        span.end(end_time=end)
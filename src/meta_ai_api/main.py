@@ -1,24 +1,61 @@
-import json
 import logging
+import threading
 import time
-import urllib
 import uuid
-from typing import Dict, List, Generator, Iterator
-
-import requests
-from requests_html import HTMLSession
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Generator,
+    Iterable,
+    Iterator,
+    Optional,
+    Tuple,
+    TYPE_CHECKING,
+)
 
 from meta_ai_api.utils import (
     generate_offline_threading_id,
-    extract_value,
+    extract_tokens,
     format_response,
+    get_response_errors,
+    LastResponseReader,
+    MessageDeltas,
+    raise_for_errors,
+    StreamText,
+    ClosingStream,
+)
+
+from meta_ai_api.utils import create_session, get_fb_session
+
+from meta_ai_api import codec, graphql
+from meta_ai_api.control import Deadline, Timeout
+from meta_ai_api.conversation import Conversation
+from meta_ai_api.hooks import ACCESS_TOKEN, COOKIES, GRACE_SLEEP, RequestTrace
+from meta_ai_api.media import MediaDownloader, Progress
+from meta_ai_api.exceptions import (
+    AccessTokenRejected,
+    FacebookRegionBlocked,
+    MetaAIResponseError,
 )
+from meta_ai_api.ratelimit import LOGIN, SEND, SOURCES
+from meta_ai_api.retry import RetryPolicy
 
-from meta_ai_api.utils import get_fb_session, get_session
+READ_CHUNK_SIZE = 64 * 1024
+# Meta AI does not say how long a temp user access token lasts, assume an hour like the credential stores.
+ACCESS_TOKEN_TTL = 3600
 
-from meta_ai_api.exceptions import FacebookRegionBlocked
+if TYPE_CHECKING:
+    import requests
 
-MAX_RETRIES = 3
+    from meta_ai_api.cache import ResponseCache
+    from meta_ai_api.coalesce import SingleFlight
+    from meta_ai_api.credentials import CredentialStore
+    from meta_ai_api.history import HistoryStore
+    from meta_ai_api.hooks import Hooks
+    from meta_ai_api.ratelimit import RateLimiter
+    from meta_ai_api.session_pool import SessionBundle, SessionPool
 
 
 class MetaAI:
@@ -27,63 +64,269 @@ class MetaAI:
     and receiving messages from the Meta AI Chat API.
     """
 
+    meta_ai_url = "https://www.meta.ai/"
+    graphql_url = "https://www.meta.ai/api/graphql/"
+    graph_api_url = "https://graph.meta.ai/graphql?locale=user"
+
     def __init__(
-        self, fb_email: str = None, fb_password: str = None, proxy: dict = None
+        self,
+        fb_email: str = None,
+        fb_password: str = None,
+        proxy: dict = None,
+        cookies: dict = None,
+        access_token: str = None,
+        session_pool: "SessionPool" = None,
+        credential_store: "CredentialStore" = None,
+        response_cache: "ResponseCache" = None,
+        retry_policy: RetryPolicy = None,
+        pool_maxsize: int = 16,
+        rate_limiter: "RateLimiter" = None,
+        token_ttl: float = ACCESS_TOKEN_TTL,
+        refresh_margin: float = 300,
+        hooks: "Hooks" = None,
+        history: "HistoryStore" = None,
+        single_flight: "SingleFlight" = None,
     ):
-        self.session = get_session()
+        self.session = create_session(proxy=proxy, pool_maxsize=pool_maxsize)
         self.session.headers.update(
             {
                 "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 "
                 "(KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
             }
         )
-        self.access_token = None
+        self.access_token = access_token
+        # When the access token expires, None when unknown, as for tokens passed in.
+        self.access_token_expires_at = None
+        self.token_ttl = token_ttl
+        self.refresh_margin = refresh_margin
         self.fb_email = fb_email
         self.fb_password = fb_password
         self.proxy = proxy
+        self.session_pool = session_pool
+        self.session_bundle = None
+        self.credential_store = credential_store
+        self.response_cache = response_cache
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.rate_limiter = rate_limiter
+        self.hooks = hooks
+        self.history = history
+        self.single_flight = single_flight
+        self._media_downloader = None
+        # Serializes credential bootstraps and refreshes between threads.
+        self._auth_lock = threading.RLock()
+        self._refresh_thread = None
+        # Whether to keep the Facebook session when renewing the one Meta AI rejected, None when none was.
+        self._rejected_session: Optional[bool] = None
 
         self.is_authed = fb_password is not None and fb_email is not None
-        self.cookies = self.get_cookies()
-        self.external_conversation_id = None
-        self.offline_threading_id = None
+        self.account = fb_email if self.is_authed else "anonymous"
+        if session_pool is not None and not self.is_authed:
+            self.use_bundle(session_pool.acquire())
+        else:
+            self.cookies = cookies if cookies is not None else self.get_cookies()
+        # The conversation prompted when no other one is given.
+        self._conversation = Conversation(self)
+
+    @property
+    def external_conversation_id(self) -> str:
+        return self._conversation.external_conversation_id
+
+    @external_conversation_id.setter
+    def external_conversation_id(self, value: str):
+        self._conversation.external_conversation_id = value
+
+    @property
+    def offline_threading_id(self) -> str:
+        return self._conversation.offline_threading_id
+
+    @offline_threading_id.setter
+    def offline_threading_id(self, value: str):
+        self._conversation.offline_threading_id = value
+
+    def conversation(
+        self, external_conversation_id: str = None, offline_threading_id: str = None
+    ) -> Conversation:
+        """
+        Creates a handle on a conversation, sharing this instance's session, cookies and access token.
+        No network call is made.
+
+        Args:
+            external_conversation_id (str): The ID of an existing conversation to continue, None to start
+                a new one with the first prompt.
+            offline_threading_id (str): The offline threading ID of the last message of the conversation.
+
+        Returns:
+            Conversation: The conversation, to prompt from any thread.
+        """
+        return Conversation(self, external_conversation_id, offline_threading_id)
+
+    def use_bundle(self, bundle: "SessionBundle"):
+        """
+        Switches this instance to a pre-warmed anonymous session.
+
+        Args:
+            bundle (SessionBundle): The cookies and access token to use.
+        """
+        self.session_bundle = bundle
+        self.cookies = bundle.cookies
+        self.access_token = bundle.access_token
+        self.access_token_expires_at = bundle.created_at + self.token_ttl
+
+    def _throttle(self, kind: str):
+        """
+        Waits for the rate limiter, if any, to let a request of the given kind through.
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(kind)
+
+    def _post(
+        self,
+        name: str,
+        url: str,
+        headers: dict,
+        payload: str,
+        stream: bool = False,
+        deadline: Deadline = None,
+    ) -> Tuple["requests.Response", Optional[RequestTrace]]:
+        """
+        Posts a GraphQL request, reporting it to the hooks if any.
+
+        Args:
+            deadline (Deadline): The time limits of the request, if any.
+
+        Returns:
+            tuple: The response, and the trace to finish once its streamed body is read. The trace is
+            None without hooks, or when the body was read already.
+        """
+        timeout = deadline.request_timeout() if deadline is not None else None
+        if self.hooks is None:
+            return (
+                self.session.post(
+                    url, headers=headers, data=payload, stream=stream, timeout=timeout
+                ),
+                None,
+            )
+        trace = RequestTrace(self.hooks, name, len(payload))
+        try:
+            response = self.session.post(
+                url, headers=headers, data=payload, stream=stream, timeout=timeout
+            )
+        except Exception as e:
+            trace.finish(e)
+            raise
+        trace.first_byte(response.status_code, response.elapsed.total_seconds())
+        if stream:
+            return response, trace
+        trace.finish(bytes_received=len(response.content))
+        return response, None
+
+    def _phase(self, name: str, started_at: float):
+        if self.hooks is not None:
+            self.hooks.on_phase(name, time.perf_counter() - started_at)
+
+    def _ensure_access_token(self) -> str:
+        """
+        Returns a valid access token, bootstrapping it first if needed.
+
+        A token about to expire is still returned while a background thread refreshes it, an expired
+        one is refreshed first. Threads needing a token at the same time wait for a single refresh.
+        """
+        access_token, expires_at = self.access_token, self.access_token_expires_at
+        now = time.time()
+        if access_token and (
+            expires_at is None or now < expires_at - self.refresh_margin
+        ):
+            return access_token
+        if access_token and now < expires_at:
+            self._refresh_in_background(access_token)
+            return access_token
+        return self._replace_access_token(access_token)
+
+    def _refresh_in_background(self, stale: str):
+        # Not under the auth lock, which the refresh holds. Should two threads start at once, the second
+        # finds the token already replaced.
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+        self._refresh_thread = threading.Thread(
+            target=self._refresh_quietly,
+            args=(stale,),
+            name="meta-ai-token-refresh",
+            daemon=True,
+        )
+        self._refresh_thread.start()
+
+    def _refresh_quietly(self, stale: str):
+        try:
+            self._replace_access_token(stale)
+        except Exception as e:
+            # The token is still valid, the next prompt tries again.
+            logging.warning(f"Unable to refresh the Meta AI access token: {e}")
+
+    def refresh_access_token(self) -> str:
+        """
+        Replaces the access token with a new one. Threads refreshing it at the same time wait for a
+        single refresh.
+
+        Returns:
+            str: The new access token.
+        """
+        return self._replace_access_token(self.access_token)
+
+    def _replace_access_token(self, stale: Optional[str]) -> str:
+        """
+        Replaces a stale access token, or bootstraps the first one when it is None. If another thread
+        already replaced it, the new token is returned without another request.
+        """
+        with self._auth_lock:
+            if self.access_token and self.access_token != stale:
+                return self.access_token
+            if (
+                stale is not None
+                and self.credential_store is not None
+                and self.credential_store.get(self.account, "access_token") == stale
+            ):
+                self.credential_store.delete(self.account, "access_token")
+            self.access_token, self.access_token_expires_at = self._new_access_token()
+            return self.access_token
 
     def get_access_token(self) -> str:
         """
-        Retrieves an access token using Meta's authentication API.
+        Retrieves an access token using Meta's authentication API, and keeps it for the next prompts.
+        Refreshes the token first if it expired.
 
         Returns:
             str: A valid access token.
         """
+        return self._ensure_access_token()
 
-        if self.access_token:
-            return self.access_token
+    def _new_access_token(self) -> Tuple[str, float]:
+        """
+        Returns an access token from the credential store, or a new one from Meta's authentication API,
+        with the time it expires at.
+        """
+        if self.credential_store is not None:
+            access_token = self.credential_store.get(self.account, "access_token")
+            if access_token:
+                expires_at = self.credential_store.get_expiry(
+                    self.account, "access_token"
+                )
+                return access_token, expires_at or time.time() + self.token_ttl
 
-        url = "https://www.meta.ai/api/graphql/"
-        payload = {
-            "lsd": self.cookies["lsd"],
-            "fb_api_caller_class": "RelayModern",
-            "fb_api_req_friendly_name": "useAbraAcceptTOSForTempUserMutation",
-            "variables": {
-                "dob": "1999-01-01",
-                "icebreaker_type": "TEXT",
-                "__relay_internal__pv__WebPixelRatiorelayprovider": 1,
-            },
-            "doc_id": "7604648749596940",
-        }
-        payload = urllib.parse.urlencode(payload)  # noqa
+        started_at = time.perf_counter()
+        operation = graphql.OPERATIONS[graphql.ACCEPT_TOS]
+        payload = operation.encode(self.cookies["lsd"], self.is_authed)
         headers = {
-            "content-type": "application/x-www-form-urlencoded",
+            **operation.headers,
             "cookie": f'_js_datr={self.cookies["_js_datr"]}; '
             f'abra_csrf={self.cookies["abra_csrf"]}; datr={self.cookies["datr"]};',
-            "sec-fetch-site": "same-origin",
-            "x-fb-friendly-name": "useAbraAcceptTOSForTempUserMutation",
         }
 
-        response = self.session.post(url, headers=headers, data=payload)
+        self._throttle(LOGIN)
+        response, _ = self._post(operation.name, operation.url(self), headers, payload)
 
         try:
-            auth_json = response.json()
-        except json.JSONDecodeError:
+            auth_json = codec.loads(response.content)
+        except codec.DecodeError:
             raise FacebookRegionBlocked(
                 "Unable to receive a valid response from Meta AI. This is likely due to your region being blocked. "
                 "Try manually accessing https://www.meta.ai/ to confirm."
@@ -92,12 +335,20 @@ class MetaAI:
         access_token = auth_json["data"]["xab_abra_accept_terms_of_service"][
             "new_temp_user_auth"
         ]["access_token"]
+        expires_at = time.time() + self.token_ttl
 
         # Need to sleep for a bit, for some reason the API doesn't like it when we send request too quickly
         # (maybe Meta needs to register Cookies on their side?)
+        self._phase(ACCESS_TOKEN, started_at)
+        slept_at = time.perf_counter()
         time.sleep(1)
+        self._phase(GRACE_SLEEP, slept_at)
 
-        return access_token
+        if self.credential_store is not None:
+            self.credential_store.set(
+                self.account, "access_token", access_token, ttl=self.token_ttl
+            )
+        return access_token, expires_at
 
     def prompt(
         self,
@@ -105,6 +356,11 @@ class MetaAI:
         stream: bool = False,
         attempts: int = 0,
         new_conversation: bool = False,
+        delta: bool = False,
+        conversation: Conversation = None,
+        timeout: Timeout or float = None,
+        stop: Callable[[str], bool] = None,
+        cancel: threading.Event = None,
     ) -> Dict or Generator[Dict, None, None]:
         """
         Sends a message to the Meta AI and returns the response.
@@ -112,125 +368,459 @@ class MetaAI:
         Args:
             message (str): The message to send.
             stream (bool): Whether to stream the response or not. Defaults to False.
-            attempts (int): The number of attempts to retry if an error occurs. Defaults to 0.
+            attempts (int): The number of attempts already made. Defaults to 0.
             new_conversation (bool): Whether to start a new conversation or not. Defaults to False.
+            delta (bool): When streaming, whether to yield only the text added by each chunk instead of
+                the whole message so far. The last item holds the full message, sources and media.
+                Defaults to False.
+            conversation (Conversation): The conversation to send the message in, see `conversation`.
+                Defaults to the conversation of this instance.
+            timeout (Timeout or float): The time limits of the prompt, or its total time limit in
+                seconds. When streaming, the total limit also covers reading the stream. Defaults to none.
+            stop (Callable[[str], bool]): Called with the message received so far, stops reading the
+                response, and returns or yields the message as it is, once it returns True. See
+                `stop_after` and `stop_at`.
+            cancel (threading.Event): Cancels the prompt once set, from any thread.
 
         Returns:
             dict: A dictionary containing the response message and sources.
 
         Raises:
-            Exception: If unable to obtain a valid response after several attempts.
+            RetriesExhausted: If unable to obtain a valid response after several attempts.
+            CircuitOpen: If Meta AI failed too many times in a row recently.
+            DeadlineExceeded: If the total time limit passed.
+            PromptCancelled: If the prompt was cancelled.
         """
-        if not self.is_authed:
-            self.access_token = self.get_access_token()
-            auth_payload = {"access_token": self.access_token}
-            url = "https://graph.meta.ai/graphql?locale=user"
+        if conversation is None:
+            conversation = self._conversation
+        starts_conversation = (
+            new_conversation or not conversation.external_conversation_id
+        )
+        cache_key = None
+        if self.response_cache is not None and not stream and starts_conversation:
+            # Only prompts starting a conversation are cached, follow-ups depend on its history.
+            cache_key = self.response_cache.prompt_key(
+                message, new_conversation, self.account
+            )
+            cached_response = self.response_cache.get(cache_key)
+            if cached_response is not None:
+                return cached_response
 
+        deadline = None
+        if timeout is not None or cancel is not None:
+            deadline = Deadline(timeout, cancel)
+        if self.single_flight is not None and stop is None and starts_conversation:
+            # Identical prompts in flight share one request, run without the total limit and cancel
+            # event of any caller, each caller waiting within its own.
+            flight_timeout = None
+            if deadline is not None:
+                flight_timeout = Timeout(
+                    deadline.timeout.connect, deadline.timeout.first_token
+                )
+            flight, owner = self.single_flight.join(
+                self.single_flight.prompt_key(message, stream, delta, self),
+                lambda flight_cancel: self.retry_policy.call(
+                    self._send_prompt,
+                    message,
+                    stream=stream,
+                    new_conversation=new_conversation,
+                    delta=delta,
+                    conversation=conversation,
+                    deadline=Deadline(flight_timeout, flight_cancel),
+                    attempts=attempts,
+                    on_retry=self._on_retry,
+                ),
+            )
+            response = flight.stream(deadline) if stream else flight.result(deadline)
+            if not owner:
+                # The conversation of the caller is left as is, as on a cache hit.
+                return response
         else:
-            auth_payload = {"fb_dtsg": self.cookies["fb_dtsg"]}
-            url = "https://www.meta.ai/api/graphql/"
+            response = self.retry_policy.call(
+                self._send_prompt,
+                message,
+                stream=stream,
+                new_conversation=new_conversation,
+                delta=delta,
+                conversation=conversation,
+                deadline=deadline,
+                stop=stop,
+                attempts=attempts,
+                on_retry=self._on_retry,
+            )
+        if self.history is not None:
+            if stream:
+                return ClosingStream(
+                    self._record_stream(conversation, message, response),
+                    response.close,
+                )
+            self.history.record(
+                conversation.external_conversation_id, message, response
+            )
+        if cache_key is not None and not response.get("stopped"):
+            self.response_cache.set(cache_key, response)
+        return response
+
+    def _send_prompt(
+        self,
+        message: str,
+        stream: bool = False,
+        new_conversation: bool = False,
+        delta: bool = False,
+        conversation: Conversation = None,
+        deadline: Deadline = None,
+        stop: Callable[[str], bool] = None,
+    ) -> Dict or Generator[Dict, None, None]:
+        """
+        Sends a message to the Meta AI once, without retrying.
 
-        if not self.external_conversation_id or new_conversation:
+        Raises:
+            MetaAIResponseError: If Meta AI did not return a valid response.
+            DeadlineExceeded: If the total time limit passed, which also ends the retries.
+            PromptCancelled: If the prompt was cancelled.
+        """
+        if deadline is not None:
+            deadline.check()
+        if self._rejected_session is not None:
+            self._renew_rejected_session()
+        if conversation is None:
+            conversation = self._conversation
+        if not conversation.external_conversation_id or new_conversation:
             external_id = str(uuid.uuid4())
-            self.external_conversation_id = external_id
-        payload = {
-            **auth_payload,
-            "fb_api_caller_class": "RelayModern",
-            "fb_api_req_friendly_name": "useAbraSendMessageMutation",
-            "variables": json.dumps(
-                {
-                    "message": {"sensitive_string_value": message},
-                    "externalConversationId": self.external_conversation_id,
-                    "offlineThreadingId": generate_offline_threading_id(),
-                    "suggestedPromptIndex": None,
-                    "flashVideoRecapInput": {"images": []},
-                    "flashPreviewInput": None,
-                    "promptPrefix": None,
-                    "entrypoint": "ABRA__CHAT__TEXT",
-                    "icebreaker_type": "TEXT",
-                    "__relay_internal__pv__AbraDebugDevOnlyrelayprovider": False,
-                    "__relay_internal__pv__WebPixelRatiorelayprovider": 1,
-                }
-            ),
-            "server_timestamps": "true",
-            "doc_id": "7783822248314888",
-        }
-        payload = urllib.parse.urlencode(payload)  # noqa
-        headers = {
-            "content-type": "application/x-www-form-urlencoded",
-            "x-fb-friendly-name": "useAbraSendMessageMutation",
-        }
+            conversation.external_conversation_id = external_id
+        variables = graphql.OPERATIONS[graphql.SEND_MESSAGE].encode_variables(
+            message={"sensitive_string_value": message},
+            externalConversationId=conversation.external_conversation_id,
+            offlineThreadingId=generate_offline_threading_id(),
+        )
+        if self.is_authed:
+            return self._post_message(
+                self.cookies["fb_dtsg"],
+                variables,
+                stream,
+                delta,
+                conversation,
+                deadline,
+                stop,
+            )
+
+        access_token = self._ensure_access_token()
+        try:
+            return self._post_message(
+                access_token,
+                variables,
+                stream,
+                delta,
+                conversation,
+                deadline,
+                stop,
+            )
+        except AccessTokenRejected:
+            # The token expired early or was revoked: refresh it once and resend, instead of retrying it.
+            logging.info("Meta AI rejected the access token, refreshing it.")
+            access_token = self._replace_access_token(access_token)
+            return self._post_message(
+                access_token,
+                variables,
+                stream,
+                delta,
+                conversation,
+                deadline,
+                stop,
+            )
+
+    def _post_message(
+        self,
+        credential: str,
+        variables: str,
+        stream: bool,
+        delta: bool,
+        conversation: Conversation,
+        deadline: Optional[Deadline] = None,
+        stop: Optional[Callable[[str], bool]] = None,
+    ) -> Dict or Generator[Dict, None, None]:
+        """
+        Posts a message and reads the response.
+
+        Raises:
+            AccessTokenRejected: If Meta AI rejected the access token.
+            MetaAIResponseError: If Meta AI did not return a valid response.
+        """
+        operation = graphql.OPERATIONS[graphql.SEND_MESSAGE]
+        payload = operation.encode(credential, self.is_authed, variables)
+        headers = operation.headers
         if self.is_authed:
-            headers["cookie"] = f'abra_sess={self.cookies["abra_sess"]}'
-            # Recreate the session to avoid cookie leakage when user is authenticated
-            self.session = requests.Session()
-            self.session.proxies = self.proxy
+            # The session never stores cookies, so they cannot leak between identities.
+            headers = {**headers, "cookie": f'abra_sess={self.cookies["abra_sess"]}'}
+        url = operation.url(self)
 
-        response = self.session.post(url, headers=headers, data=payload, stream=stream)
-        if not stream:
-            raw_response = response.text
-            last_streamed_response = self.extract_last_response(raw_response)
-            if not last_streamed_response:
-                return self.retry(message, stream=stream, attempts=attempts)
+        self._throttle(SEND)
+        try:
+            response, trace = self._post(
+                operation.name,
+                url,
+                headers,
+                payload,
+                stream=True,
+                deadline=deadline,
+            )
+        except Exception:
+            if deadline is not None:
+                # Report a timeout due to the total limit as such, rather than as a transport error.
+                deadline.check()
+            raise
+        try:
+            if response.status_code == 401 and not self.is_authed:
+                raise AccessTokenRejected("Meta AI rejected the access token.")
+            if not stream and stop is None:
+                # Read the body as it arrives instead of holding every snapshot at once.
+                lines = response.iter_lines(chunk_size=READ_CHUNK_SIZE)
+                if trace is not None:
+                    lines = trace.iterate(lines)
+                if deadline is not None:
+                    lines = deadline.watch(lines)
+                last_streamed_response = self.extract_last_response(lines, conversation)
+                if not last_streamed_response:
+                    raise MetaAIResponseError(
+                        "Meta AI did not return a complete response."
+                    )
 
-            extracted_data = self.extract_data(last_streamed_response)
-            return extracted_data
+                extracted_data = self.extract_data(last_streamed_response)
+                return extracted_data
 
-        else:
-            lines = response.iter_lines()
-            is_error = json.loads(next(lines))
-            if len(is_error.get("errors", [])) > 0:
-                return self.retry(message, stream=stream, attempts=attempts)
-            return self.stream_response(lines)
+            else:
+                lines = response.iter_lines()
+                if trace is not None:
+                    lines = trace.iterate(lines)
+                if deadline is not None:
+                    lines = deadline.watch(lines)
+                try:
+                    is_error = codec.loads(next(lines))
+                except (StopIteration, *codec.DecodeError):
+                    raise MetaAIResponseError("Meta AI returned an invalid stream.")
+                raise_for_errors(get_response_errors(is_error), self.is_authed)
+                if stream and delta:
+                    items = self.stream_deltas(lines)
+                else:
+                    items = self.stream_response(lines)
+                # Closes the response even if the caller closes the stream before reading it.
+                items = ClosingStream(
+                    self._read_stream(response, items, stop), response.close
+                )
+                if stream:
+                    return items
+                # Stopping a prompt needs every message snapshot, read the response as a stream.
+                extracted_data = None
+                for extracted_data in items:
+                    pass
+                if extracted_data is None:
+                    raise MetaAIResponseError(
+                        "Meta AI did not return a complete response."
+                    )
+                return extracted_data
+        except Exception as e:
+            # Give the connection back to the pool rather than wait for the rest of the response.
+            response.close()
+            if trace is not None:
+                trace.finish(e)
+            if deadline is not None:
+                deadline.check()
+            raise
 
-    def retry(self, message: str, stream: bool = False, attempts: int = 0):
+    @staticmethod
+    def _read_stream(
+        response: "requests.Response",
+        items: Iterator[Dict],
+        stop: Optional[Callable[[str], bool]] = None,
+    ) -> Generator[Dict, None, None]:
         """
-        Retries the prompt function if an error occurs.
+        Yields the items of a streamed response, and closes the response as soon as the stream ends,
+        fails, is closed by the caller, or meets the stop condition.
+        """
+        text = StreamText() if stop is not None else None
+        try:
+            for item in items:
+                if text is not None and stop(text.feed(item)):
+                    item["stopped"] = True
+                    yield item
+                    return
+                yield item
+        finally:
+            items.close()
+            response.close()
+
+    def _record_stream(
+        self, conversation: Conversation, message: str, items: Generator
+    ) -> Generator[Dict, None, None]:
         """
-        if attempts <= MAX_RETRIES:
-            logging.warning(
-                f"Was unable to obtain a valid response from Meta AI. Retrying... Attempt {attempts + 1}/{MAX_RETRIES}."
+        Yields the items of a stream, and records the prompt in the history once the stream is over,
+        with as much of the answer as was read.
+        """
+        text = StreamText()
+        last_item = None
+        try:
+            for last_item in items:
+                text.feed(last_item)
+                yield last_item
+        finally:
+            items.close()
+            if last_item is not None:
+                self.history.record(
+                    conversation.external_conversation_id,
+                    message,
+                    {**last_item, "message": text.text},
+                )
+
+    def prompt_many(
+        self,
+        messages: Iterable[str],
+        concurrency: int = 4,
+        new_conversation: bool = True,
+        ordered: bool = True,
+    ) -> List[Dict or Exception] or Iterator[Tuple[int, Dict or Exception]]:
+        """
+        Sends many messages concurrently, each one in its own conversation handle.
+
+        A message that fails does not abort the batch, the exception it raised takes the place of its
+        response.
+
+        Args:
+            messages (Iterable[str]): The messages to send.
+            concurrency (int): The maximum number of prompts in flight. Defaults to 4.
+            new_conversation (bool): Whether each message starts a new conversation, rather than
+                following up on the current one. Defaults to True.
+            ordered (bool): Whether to return the responses in input order once all of them are done,
+                or to yield (index, response) tuples as they complete. Defaults to True.
+
+        Returns:
+            list: The responses, or exceptions, in the order of the messages.
+        """
+        # Bootstrap once here, rather than racing in every thread.
+        if not self.is_authed:
+            self._ensure_access_token()
+
+        def prompt_isolated(message: str) -> Dict or Exception:
+            conversation = self.conversation(
+                None if new_conversation else self.external_conversation_id,
+                None if new_conversation else self.offline_threading_id,
             )
-            time.sleep(3)
-            return self.prompt(message, stream=stream, attempts=attempts + 1)
-        else:
-            raise Exception(
-                "Unable to obtain a valid response from Meta AI. Try again later."
+            try:
+                return conversation.prompt(message, new_conversation=new_conversation)
+            except Exception as e:
+                logging.warning(f"Prompt failed in batch: {e}")
+                return e
+
+        if ordered:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                return list(executor.map(prompt_isolated, messages))
+        return self._as_completed(prompt_isolated, messages, concurrency)
+
+    @staticmethod
+    def _as_completed(function, messages: Iterable[str], concurrency: int):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {
+                executor.submit(function, message): index
+                for index, message in enumerate(messages)
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def _on_retry(self, error: Exception, attempt: int):
+        """
+        Marks the session for renewal by the next attempt, when Meta AI rejected the previous one.
+
+        The renewal runs in the attempt rather than here, so that its errors are classified and retried
+        like those of the prompt, and without holding up the retry loop.
+        """
+        if self.hooks is not None:
+            self.hooks.on_retry(error, attempt)
+        if not isinstance(error, MetaAIResponseError):
+            return
+        if self.session_bundle is None and self.credential_store is None:
+            return
+        with self._auth_lock:
+            # Another rejection since the last renewal may ask for a full one.
+            self._rejected_session = (
+                attempt == 0 and self._rejected_session is not False
             )
 
-    def extract_last_response(self, response: str) -> Dict:
+    def _renew_rejected_session(self):
+        """
+        Renews the session marked by `_on_retry`, once for every thread waiting for it.
+        """
+        with self._auth_lock:
+            keep_session = self._rejected_session
+            if keep_session is None:
+                return
+            if self.session_bundle is not None:
+                # The pooled session was rejected, swap it for a fresh one.
+                bundle = self.session_pool.acquire()
+                self.session_pool.retire(self.session_bundle)
+                self.use_bundle(bundle)
+            else:
+                self.invalidate_credentials(keep_session=keep_session)
+            self._rejected_session = None
+
+    def invalidate_credentials(self, keep_session: bool = False):
+        """
+        Drops the cached credentials after Meta AI rejected them, and bootstraps fresh ones.
+
+        Args:
+            keep_session (bool): Whether to keep the cached Facebook session (abra_sess), so that only the
+                landing page tokens and access token are refreshed. Defaults to False.
+        """
+        if keep_session:
+            for name in (
+                "_js_datr",
+                "datr",
+                "lsd",
+                "fb_dtsg",
+                "abra_csrf",
+                "access_token",
+            ):
+                self.credential_store.delete(self.account, name)
+        else:
+            self.credential_store.delete(self.account)
+        self.access_token = None
+        self.access_token_expires_at = None
+        self.cookies = self.get_cookies()
+
+    def extract_last_response(
+        self, response: str or Iterable[bytes], conversation: Conversation = None
+    ) -> Dict:
         """
         Extracts the last response from the Meta AI API.
 
+        Only the lines that can complete the message are decoded, so passing the lines of a streamed
+        response keeps a single snapshot of the message in memory.
+
         Args:
-            response (str): The response to extract the last response from.
+            response (str or Iterable[bytes]): The response body, or its lines.
+            conversation (Conversation): The conversation whose IDs to update, defaults to the
+                conversation of this instance.
 
         Returns:
             dict: A dictionary containing the last response.
-        """
-        last_streamed_response = None
-        for line in response.split("\n"):
-            try:
-                json_line = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-
-            bot_response_message = (
-                json_line.get("data", {})
-                .get("node", {})
-                .get("bot_response_message", {})
-            )
-            chat_id = bot_response_message.get("id")
-            if chat_id:
-                external_conversation_id, offline_threading_id, _ = chat_id.split("_")
-                self.external_conversation_id = external_conversation_id
-                self.offline_threading_id = offline_threading_id
 
-            streaming_state = bot_response_message.get("streaming_state")
-            if streaming_state == "OVERALL_DONE":
-                last_streamed_response = json_line
+        Raises:
+            MetaAIResponseError: If Meta AI returned errors instead of a message.
+        """
+        reader = LastResponseReader()
+        lines = response.split("\n") if isinstance(response, str) else response
+        for line in lines:
+            reader.feed(line)
+        if reader.last_response is None:
+            raise_for_errors(reader.errors, self.is_authed)
 
-        return last_streamed_response
+        conversation_ids = reader.conversation_ids()
+        if conversation_ids:
+            if conversation is None:
+                conversation = self._conversation
+            (
+                conversation.external_conversation_id,
+                conversation.offline_threading_id,
+            ) = conversation_ids
+        return reader.last_response
 
     def stream_response(self, lines: Iterator[str]):
         """
@@ -242,20 +832,50 @@ class MetaAI:
         Yields:
             dict: A dictionary containing the response message and sources.
         """
+        # Sources are fetched once, when the message is complete, to keep the stream flowing.
+        sources = {}
         for line in lines:
             if line:
-                json_line = json.loads(line)
-                extracted_data = self.extract_data(json_line)
+                json_line = codec.loads_message(line)
+                extracted_data = self.extract_data(json_line, sources=sources)
                 if not extracted_data.get("message"):
                     continue
                 yield extracted_data
 
-    def extract_data(self, json_line: dict):
+    def stream_deltas(self, lines: Iterator[str]):
+        """
+        Streams the response from the Meta AI API, yielding only the text added by each chunk.
+
+        Args:
+            lines (Iterator[str]): The lines to stream.
+
+        Yields:
+            dict: The new text ("delta") and whether it replaces all the text sent before ("reset").
+            The last item also holds the full message, sources and media.
+        """
+        deltas = MessageDeltas()
+        last_json_line = None
+        for line in lines:
+            if line:
+                last_json_line = codec.loads_message(line)
+                text, reset = deltas.feed(last_json_line)
+                if text or reset:
+                    yield {"delta": text, "reset": reset}
+        if last_json_line is not None:
+            yield {
+                "delta": deltas.finish(),
+                "reset": False,
+                **self.extract_data(last_json_line),
+            }
+
+    def extract_data(self, json_line: dict, sources: Dict[str, List[Dict]] = None):
         """
         Extract data and sources from a parsed JSON line.
 
         Args:
             json_line (dict): Parsed JSON line.
+            sources (dict): Sources already fetched for this message, by fetch ID. When given, sources are
+                only fetched once the message is complete, and at most once per fetch ID.
 
         Returns:
             Tuple (str, list): Response message and list of sources.
@@ -265,9 +885,17 @@ class MetaAI:
         )
         response = format_response(response=json_line)
         fetch_id = bot_response_message.get("fetch_id")
-        sources = self.fetch_sources(fetch_id) if fetch_id else []
+        if fetch_id and sources is not None:
+            if (
+                fetch_id not in sources
+                and bot_response_message.get("streaming_state") == "OVERALL_DONE"
+            ):
+                sources[fetch_id] = self.fetch_sources(fetch_id)
+            message_sources = sources.get(fetch_id, [])
+        else:
+            message_sources = self.fetch_sources(fetch_id) if fetch_id else []
         medias = self.extract_media(bot_response_message)
-        return {"message": response, "sources": sources, "media": medias}
+        return {"message": response, "sources": message_sources, "media": medias}
 
     @staticmethod
     def extract_media(json_line: dict) -> List[Dict]:
@@ -300,6 +928,25 @@ class MetaAI:
                 )
         return medias
 
+    def download_media(
+        self, media: Iterable[Dict or str], directory: str, progress: Progress = None
+    ) -> List[str or Exception]:
+        """
+        Downloads the media of responses concurrently, over the connection pool of this instance.
+
+        Args:
+            media (Iterable[dict or str]): The media, as returned in the "media" of a response, or URLs.
+            directory (str): The directory to download to, created if missing.
+            progress (Callable[[str, int, Optional[int]], None]): Called with the URL, the bytes
+                downloaded so far and the full size, None if unknown, after every chunk.
+
+        Returns:
+            list: The path of every media, or the exception its download failed with, in input order.
+        """
+        if self._media_downloader is None:
+            self._media_downloader = MediaDownloader(self.session)
+        return self._media_downloader.download(media, directory, progress)
+
     def get_cookies(self) -> dict:
         """
         Extracts necessary cookies from the Meta AI main page.
@@ -307,36 +954,50 @@ class MetaAI:
         Returns:
             dict: A dictionary containing essential cookies.
         """
-        session = HTMLSession()
+        required = ["_js_datr", "datr", "lsd", "fb_dtsg"]
+        required.append("abra_sess" if self.is_authed else "abra_csrf")
+        cached = (
+            self.credential_store.get_all(self.account)
+            if self.credential_store is not None
+            else {}
+        )
+        if all(cached.get(name) for name in required):
+            return {name: cached[name] for name in required}
+
+        started_at = time.perf_counter()
+        self._throttle(LOGIN)
         headers = {}
         if self.fb_email is not None and self.fb_password is not None:
-            fb_session = get_fb_session(self.fb_email, self.fb_password)
-            headers = {"cookie": f"abra_sess={fb_session['abra_sess']}"}
-        response = session.get(
-            "https://www.meta.ai/",
-            headers=headers,
+            abra_sess = cached.get("abra_sess")
+            if not abra_sess:
+                abra_sess = get_fb_session(self.fb_email, self.fb_password)["abra_sess"]
+            headers = {"cookie": f"abra_sess={abra_sess}"}
+        names = ["_js_datr", "datr", "lsd", "fb_dtsg"]
+        if not headers:
+            names.append("abra_csrf")
+        trace = (
+            RequestTrace(self.hooks, "landing_page") if self.hooks is not None else None
         )
-        cookies = {
-            "_js_datr": extract_value(
-                response.text, start_str='_js_datr":{"value":"', end_str='",'
-            ),
-            "datr": extract_value(
-                response.text, start_str='datr":{"value":"', end_str='",'
-            ),
-            "lsd": extract_value(
-                response.text, start_str='"LSD",[],{"token":"', end_str='"}'
-            ),
-            "fb_dtsg": extract_value(
-                response.text, start_str='DTSGInitData",[],{"token":"', end_str='"'
-            ),
-        }
+        # Stop downloading the page once every token is found.
+        with self.session.get(
+            self.meta_ai_url, headers=headers, stream=True
+        ) as response:
+            chunks = response.iter_content(chunk_size=READ_CHUNK_SIZE)
+            if trace is not None:
+                trace.first_byte(response.status_code, response.elapsed.total_seconds())
+                chunks = trace.iterate(chunks)
+            try:
+                cookies = extract_tokens(chunks, names)
+            finally:
+                if trace is not None:
+                    # Finish on the tokens found, rather than when the generator is collected.
+                    chunks.close()
 
         if len(headers) > 0:
-            cookies["abra_sess"] = fb_session["abra_sess"]
-        else:
-            cookies["abra_csrf"] = extract_value(
-                response.text, start_str='abra_csrf":{"value":"', end_str='",'
-            )
+            cookies["abra_sess"] = abra_sess
+        if self.credential_store is not None:
+            self.credential_store.update(self.account, cookies)
+        self._phase(COOKIES, started_at)
         return cookies
 
     def fetch_sources(self, fetch_id: str) -> List[Dict]:
@@ -349,39 +1010,35 @@ class MetaAI:
         Returns:
             list: A list of dictionaries containing the fetched sources.
         """
+        if self.response_cache is not None:
+            cache_key = self.response_cache.sources_key(fetch_id)
+            references = self.response_cache.get(cache_key)
+            if references is not None:
+                return references
 
-        url = "https://graph.meta.ai/graphql?locale=user"
-        payload = {
-            "access_token": self.access_token,
-            "fb_api_caller_class": "RelayModern",
-            "fb_api_req_friendly_name": "AbraSearchPluginDialogQuery",
-            "variables": json.dumps({"abraMessageFetchID": fetch_id}),
-            "server_timestamps": "true",
-            "doc_id": "6946734308765963",
-        }
-
-        payload = urllib.parse.urlencode(payload)  # noqa
-
+        operation = graphql.OPERATIONS[graphql.SEARCH_SOURCES]
+        payload = operation.encode(
+            self.access_token,
+            self.is_authed,
+            operation.encode_variables(abraMessageFetchID=fetch_id),
+        )
         headers = {
-            "authority": "graph.meta.ai",
-            "accept-language": "en-US,en;q=0.9,fr-FR;q=0.8,fr;q=0.7",
-            "content-type": "application/x-www-form-urlencoded",
+            **operation.headers,
             "cookie": f'dpr=2; abra_csrf={self.cookies.get("abra_csrf")}; datr={self.cookies.get("datr")}; ps_n=1; ps_l=1',
-            "x-fb-friendly-name": "AbraSearchPluginDialogQuery",
         }
 
-        response = self.session.post(url, headers=headers, data=payload)
-        response_json = response.json()
+        self._throttle(SOURCES)
+        response, _ = self._post(operation.name, operation.url(self), headers, payload)
+        response_json = codec.loads(response.content)
         message = response_json.get("data", {}).get("message", {})
         search_results = (
             (response_json.get("data", {}).get("message", {}).get("searchResults"))
             if message
             else None
         )
-        if search_results is None:
-            return []
-
-        references = search_results["references"]
+        references = search_results["references"] if search_results else []
+        if self.response_cache is not None:
+            self.response_cache.set(cache_key, references)
         return references
 
 
@@ -0,0 +1,269 @@
+"""
+Downloads of the images and videos generated by Meta AI.
+
+Files are streamed to disk, or to a file object, a chunk at a time. A download cut short resumes from
+the bytes already written, with a range request, both on retry and when downloading the same media again
+later, since partial files are kept next to their target until complete.
+"""
+
+import hashlib
+import os
+import threading
+import urllib.parse
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    TYPE_CHECKING,
+)
+
+from meta_ai_api.retry import RetryPolicy
+from meta_ai_api.utils import create_session
+
+if TYPE_CHECKING:
+    import requests
+
+READ_CHUNK_SIZE = 64 * 1024
+PARTIAL_SUFFIX = ".part"
+# File extensions of the media types reported by extract_media, for URLs without one.
+MEDIA_EXTENSIONS = {"IMAGE": ".jpeg", "VIDEO": ".mp4"}
+
+Progress = Callable[[str, int, Optional[int]], None]
+
+
+def media_path(url: str, directory: str, media_type: str = None) -> str:
+    """
+    Returns the path a media is downloaded to.
+
+    The name is derived from the URL without its query string, which holds a signature that changes
+    between responses, so that the same media always maps to the same file.
+
+    Args:
+        url (str): The URL of the media.
+        directory (str): The directory to download to.
+        media_type (str): The type of the media, "IMAGE" or "VIDEO", used when the URL has no extension.
+
+    Returns:
+        str: The path of the file.
+    """
+    parsed = urllib.parse.urlsplit(url)
+    extension = os.path.splitext(parsed.path)[1].lower()
+    if not extension or len(extension) > 6:
+        extension = MEDIA_EXTENSIONS.get(media_type, "")
+    name = hashlib.sha1(f"{parsed.netloc}{parsed.path}".encode()).hexdigest()[:20]
+    return os.path.join(directory, name + extension)
+
+
+def media_targets(
+    media: Iterable[Dict or str], directory: str
+) -> Tuple[List[str], Dict[str, str]]:
+    """
+    Lists the URL of every media, and the path of every distinct URL.
+    """
+    urls = []
+    paths = {}
+    for item in media:
+        if isinstance(item, str):
+            url, media_type = item, None
+        else:
+            url, media_type = item["url"], item.get("type")
+        urls.append(url)
+        if url not in paths:
+            paths[url] = media_path(url, directory, media_type)
+    return urls, paths
+
+
+def response_total(status: int, headers: Dict[str, str], offset: int) -> Optional[int]:
+    """
+    Returns the full size of a media from the headers of a response starting at the given offset.
+    """
+    if status == 206:
+        content_range = headers.get("content-range", "")
+        total = content_range.rpartition("/")[2]
+        if total.isdigit():
+            return int(total)
+    length = headers.get("content-length")
+    if length is None or not length.isdigit():
+        return None
+    return int(length) + (offset if status == 206 else 0)
+
+
+def check_complete(url: str, size: int, total: Optional[int]):
+    """
+    Raises ConnectionError, a transport error worth resuming, if a response ended early.
+    """
+    if total is not None and size < total:
+        raise ConnectionError(
+            f"The download of {url} stopped at {size} of {total} bytes."
+        )
+
+
+def restart(file: BinaryIO):
+    """
+    Empties a partially written file, for servers that ignore range requests.
+    """
+    file.seek(0)
+    file.truncate()
+
+
+class MediaDownloader:
+    """
+    Downloads media concurrently over a shared connection pool.
+
+    Identical URLs are downloaded once, even when requested by several threads at the same time, and
+    media already downloaded are not downloaded again.
+    """
+
+    def __init__(
+        self,
+        session: "requests.Session" = None,
+        concurrency: int = 8,
+        chunk_size: int = READ_CHUNK_SIZE,
+        retry_policy: RetryPolicy = None,
+        timeout: float = 60,
+    ):
+        """
+        Args:
+            session (requests.Session): The session to download with, such as the one of a MetaAI
+                instance. Defaults to a new session pooling `concurrency` connections.
+            concurrency (int): The maximum number of downloads in flight. Defaults to 8.
+            chunk_size (int): The bytes read and written at a time. Defaults to 64 KiB.
+            retry_policy (RetryPolicy): Decides whether a failed download is resumed. Defaults to a
+                policy of its own, without circuit breaker.
+            timeout (float): Seconds to wait to connect, or for the next chunk. Defaults to 60.
+        """
+        self.session = (
+            session if session is not None else create_session(pool_maxsize=concurrency)
+        )
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.retry_policy = (
+            retry_policy
+            if retry_policy is not None
+            else RetryPolicy(failure_threshold=0)
+        )
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="meta-ai-media"
+        )
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        """
+        Waits for the downloads in flight, and stops the download threads.
+        """
+        self._executor.shutdown()
+
+    def __enter__(self) -> "MediaDownloader":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def download(
+        self,
+        media: Iterable[Dict or str],
+        directory: str,
+        progress: Progress = None,
+    ) -> List[str or Exception]:
+        """
+        Downloads media to a directory, concurrently.
+
+        Args:
+            media (Iterable[dict or str]): The media, as returned in the "media" of a response, or URLs.
+            directory (str): The directory to download to, created if missing.
+            progress (Callable[[str, int, Optional[int]], None]): Called from the download threads with
+                the URL, the bytes downloaded so far and the full size, None if unknown, after every
+                chunk.
+
+        Returns:
+            list: The path of every media, or the exception its download failed with, in input order.
+        """
+        os.makedirs(directory, exist_ok=True)
+        urls, paths = media_targets(media, directory)
+        futures = {url: self.submit(url, path, progress) for url, path in paths.items()}
+        results = {}
+        for url, future in futures.items():
+            try:
+                results[url] = future.result()
+            except Exception as e:
+                results[url] = e
+        return [results[url] for url in urls]
+
+    def submit(self, url: str, path: str, progress: Progress = None) -> "Future[str]":
+        """
+        Starts downloading a media to a path, unless it is downloading already.
+
+        Returns:
+            Future: Resolves to the path once the media is downloaded.
+        """
+        with self._lock:
+            future = self._in_flight.get(path)
+            if future is not None:
+                return future
+            future = self._executor.submit(self.fetch_to_path, url, path, progress)
+            self._in_flight[path] = future
+        # Outside of the lock, the callback runs right away if the download is over already.
+        future.add_done_callback(lambda _: self._forget(path))
+        return future
+
+    def _forget(self, path: str):
+        with self._lock:
+            self._in_flight.pop(path, None)
+
+    def fetch_to_path(self, url: str, path: str, progress: Progress = None) -> str:
+        """
+        Downloads a media to a path, resuming a previous partial download if any.
+
+        Returns:
+            str: The path.
+        """
+        if os.path.exists(path):
+            return path
+        partial_path = path + PARTIAL_SUFFIX
+        with open(partial_path, "ab") as file:
+            self.fetch(url, file, progress)
+        os.replace(partial_path, path)
+        return path
+
+    def fetch(self, url: str, file: BinaryIO, progress: Progress = None) -> int:
+        """
+        Streams a media into a file object, such as an open file or a BytesIO buffer.
+
+        The download starts at the position of the file, taking the bytes before it as the start of the
+        media, so that a file holding part of the media resumes it. Resuming needs a seekable file,
+        should the server ignore the range request.
+
+        Returns:
+            int: The size of the media.
+        """
+        return self.retry_policy.call(self._fetch_once, url, file, progress)
+
+    def _fetch_once(self, url: str, file: BinaryIO, progress: Progress = None) -> int:
+        offset = file.tell()
+        headers = {"range": f"bytes={offset}-"} if offset else None
+        with self.session.get(
+            url, headers=headers, stream=True, timeout=self.timeout
+        ) as response:
+            if offset and response.status_code == 416:
+                # The previous attempt got every byte already.
+                return offset
+            response.raise_for_status()
+            if offset and response.status_code != 206:
+                restart(file)
+                offset = 0
+            total = response_total(response.status_code, response.headers, offset)
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                file.write(chunk)
+                offset += len(chunk)
+                if progress is not None:
+                    progress(url, offset, total)
+        file.flush()
+        check_complete(url, offset, total)
+        return offset
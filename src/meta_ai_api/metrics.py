@@ -0,0 +1,251 @@
+import threading
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from meta_ai_api.hooks import Hooks
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    Counts observations into buckets, like a Prometheus histogram.
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        # One count per bucket, plus the observations over the last bound.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: "Histogram"):
+        """
+        Adds the observations of a histogram with the same bounds.
+        """
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimates a quantile, as the upper bound of the bucket holding it. None without observations,
+        infinity if it is over the last bound.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class MetricsCollector(Hooks):
+    """
+    Hooks keeping latency histograms, counters and bytes in and out of every kind of request.
+
+    Pass it as the `hooks` of one or many clients, then read `snapshot()` or expose `to_prometheus()`
+    from your metrics endpoint.
+    """
+
+    # Name, type and help text of every metric, in export order.
+    METRICS = (
+        ("requests_total", "counter", "Requests sent to Meta AI, by outcome."),
+        ("request_seconds", "histogram", "Time from request to end of response."),
+        ("first_byte_seconds", "histogram", "Time from request to response headers."),
+        ("chunk_seconds", "histogram", "Time spent handling each streamed chunk."),
+        ("sent_bytes_total", "counter", "Request body bytes sent."),
+        ("received_bytes_total", "counter", "Response body bytes received."),
+        ("retries_total", "counter", "Prompts sent again after a failure."),
+        ("phase_seconds", "histogram", "Time spent in each bootstrap stage."),
+    )
+
+    def __init__(
+        self, buckets: Tuple[float, ...] = LATENCY_BUCKETS, prefix: str = "meta_ai"
+    ):
+        """
+        Args:
+            buckets (tuple): The upper bounds of the histogram buckets, in seconds.
+            prefix (str): The prefix of the exported metric names. Defaults to "meta_ai".
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric: str, labels: Labels, value: float = 1):
+        key = (metric, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def _observe(self, metric: str, labels: Labels, value: float):
+        key = (metric, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def before_request(self, name: str) -> Histogram:
+        # Chunks are counted per request without locking, and merged once the request is over.
+        return Histogram(self.buckets)
+
+    def on_first_byte(self, name: str, context: Histogram, seconds: float):
+        with self._lock:
+            self._observe("first_byte_seconds", (("request", name),), seconds)
+
+    def on_chunk(self, name: str, context: Histogram, size: int, seconds: float):
+        context.observe(seconds)
+
+    def after_request(
+        self,
+        name: str,
+        context: Histogram,
+        seconds: float,
+        bytes_sent: int,
+        bytes_received: int,
+        status: Optional[int],
+        error: Optional[BaseException],
+    ):
+        labels = (("request", name),)
+        outcome = type(error).__name__ if error is not None else "ok"
+        with self._lock:
+            self._add("requests_total", labels + (("outcome", outcome),))
+            self._observe("request_seconds", labels, seconds)
+            self._add("sent_bytes_total", labels, bytes_sent)
+            self._add("received_bytes_total", labels, bytes_received)
+            if context.count:
+                key = ("chunk_seconds", labels)
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(self.buckets)
+                histogram.merge(context)
+
+    def on_retry(self, error: BaseException, attempt: int):
+        with self._lock:
+            self._add("retries_total", (("error", type(error).__name__),))
+
+    def on_phase(self, name: str, seconds: float):
+        with self._lock:
+            self._observe("phase_seconds", (("phase", name),), seconds)
+
+    def reset(self):
+        """
+        Drops every value collected so far.
+        """
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> Dict[str, List[Dict]]:
+        """
+        Returns the current values.
+
+        Returns:
+            dict: Per metric name, one dictionary per set of labels holding the labels and either the
+            counter "value", or the histogram "count", "sum", "p50", "p90" and "p99" estimates.
+        """
+        snapshot: Dict[str, List[Dict]] = {}
+        with self._lock:
+            for (metric, labels), value in self._counters.items():
+                snapshot.setdefault(metric, []).append(
+                    {"labels": dict(labels), "value": value}
+                )
+            for (metric, labels), histogram in self._histograms.items():
+                snapshot.setdefault(metric, []).append(
+                    {
+                        "labels": dict(labels),
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "p50": histogram.quantile(0.5),
+                        "p90": histogram.quantile(0.9),
+                        "p99": histogram.quantile(0.99),
+                    }
+                )
+        return snapshot
+
+    def to_prometheus(self) -> str:
+        """
+        Renders the current values in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics, ready to serve with the text/plain; version=0.0.4 content type.
+        """
+        lines = []
+        with self._lock:
+            for metric, kind, help_text in self.METRICS:
+                name = f"{self.prefix}_{metric}"
+                if kind == "counter":
+                    series = [
+                        (labels, value)
+                        for (key, labels), value in self._counters.items()
+                        if key == metric
+                    ]
+                else:
+                    series = [
+                        (labels, histogram)
+                        for (key, labels), histogram in self._histograms.items()
+                        if key == metric
+                    ]
+                if not series:
+                    continue
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(series, key=lambda item: item[0]):
+                    if kind == "counter":
+                        lines.append(f"{name}{format_labels(labels)} {value!r}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(self.buckets, value.counts):
+                        cumulative += count
+                        bucket_labels = format_labels(labels + (("le", f"{bound:g}"),))
+                        lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                    bucket_labels = format_labels(labels + (("le", "+Inf"),))
+                    lines.append(f"{name}_bucket{bucket_labels} {value.count}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {value.sum!r}")
+                    lines.append(f"{name}_count{format_labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels: Labels) -> str:
+    """
+    Formats labels as a Prometheus label set, escaping their values.
+    """
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(
+            key,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for key, value in labels
+    )
+    return "{" + pairs + "}"
@@ -0,0 +1,222 @@
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from meta_ai_api.exceptions import RateLimited
+
+# The kinds of requests with their own budget.
+SEND = "send"
+SOURCES = "sources"
+LOGIN = "login"
+
+
+class RateLimiter:
+    """
+    Token buckets throttling the requests sent to Meta AI, with one budget per kind of request: message
+    sends, source fetches, and logins and session bootstraps.
+
+    Each bucket holds up to `burst` tokens and refills at `rate` tokens per second, every request takes
+    one. A request finding the bucket empty reserves the next token and waits for it, so waiting requests
+    are served in order. Requests that would wait longer than the timeout, or arrive while `max_waiters`
+    requests are already waiting, are rejected with RateLimited instead, shedding load predictably.
+
+    Share one limiter between all the clients, and threads, that should share the budgets.
+    """
+
+    def __init__(
+        self,
+        send: Optional[Tuple[float, float]] = None,
+        sources: Optional[Tuple[float, float]] = None,
+        login: Optional[Tuple[float, float]] = None,
+        timeout: Optional[float] = None,
+        max_waiters: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            send (tuple): The rate per second and burst of message sends, None for no limit.
+            sources (tuple): The rate per second and burst of source fetches, None for no limit.
+            login (tuple): The rate per second and burst of logins and bootstraps, None for no limit.
+            timeout (float): The longest a request may wait for a token, None to wait as long as needed.
+            max_waiters (int): The maximum number of requests waiting for a token, None for no limit.
+            clock (Callable[[], float]): The clock refilling the buckets. Defaults to time.monotonic.
+        """
+        self.limits: Dict[str, Tuple[float, float]] = {
+            kind: limit
+            for kind, limit in ((SEND, send), (SOURCES, sources), (LOGIN, login))
+            if limit is not None
+        }
+        self.timeout = timeout
+        self.max_waiters = max_waiters
+        self.clock = clock
+        self.waiting = 0
+        self.rejected = 0
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, kind: str, timeout: Optional[float] = None) -> float:
+        """
+        Takes a token, and returns how long to wait before sending the request.
+
+        Args:
+            kind (str): The kind of request, "send", "sources" or "login".
+            timeout (float): The longest the request may wait, defaults to the limiter timeout.
+
+        Returns:
+            float: Seconds to wait. Call `done_waiting` afterwards if it is not 0.
+
+        Raises:
+            RateLimited: If the request would wait too long, or too many requests are waiting.
+        """
+        limit = self.limits.get(kind)
+        if limit is None:
+            return 0.0
+        rate, burst = limit
+        timeout = timeout if timeout is not None else self.timeout
+        with self._lock:
+            if self.max_waiters is not None and self.waiting >= self.max_waiters:
+                self.rejected += 1
+                raise RateLimited(
+                    f"Too many requests waiting for the {kind} rate limit."
+                )
+            wait = self._take(kind, rate, burst, timeout)
+            if wait is None:
+                self.rejected += 1
+                raise RateLimited(
+                    f"The {kind} rate limit would delay the request over {timeout}s."
+                )
+            if wait > 0:
+                self.waiting += 1
+            return wait
+
+    def done_waiting(self):
+        with self._lock:
+            self.waiting -= 1
+
+    def acquire(self, kind: str, timeout: Optional[float] = None):
+        """
+        Blocks until the rate limit lets a request of the given kind through.
+
+        Raises:
+            RateLimited: If the request would wait too long, or too many requests are waiting.
+        """
+        wait = self.reserve(kind, timeout)
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            finally:
+                self.done_waiting()
+
+    async def acquire_async(self, kind: str, timeout: Optional[float] = None):
+        """
+        Waits, without blocking the event loop, until the rate limit lets a request through.
+
+        Raises:
+            RateLimited: If the request would wait too long, or too many requests are waiting.
+        """
+        import asyncio
+
+        wait = self.reserve(kind, timeout)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self.done_waiting()
+
+    def _take(
+        self, kind: str, rate: float, burst: float, timeout: Optional[float]
+    ) -> Optional[float]:
+        """
+        Takes a token from a bucket, returning the seconds until it is available, or None without taking
+        it if that is over the timeout. Called with the lock held.
+        """
+        now = self.clock()
+        tokens, updated_at = self._buckets.get(kind, (burst, now))
+        tokens, wait = take_token(tokens, updated_at, now, rate, burst)
+        if timeout is not None and wait > timeout:
+            return None
+        self._buckets[kind] = (tokens, now)
+        return wait
+
+
+def take_token(
+    tokens: float, updated_at: float, now: float, rate: float, burst: float
+) -> Tuple[float, float]:
+    """
+    Refills a bucket up to now and takes a token from it.
+
+    A negative number of tokens counts the tokens already reserved by waiting requests.
+
+    Returns:
+        tuple: The tokens left, and the seconds to wait for the token taken.
+    """
+    tokens = min(burst, tokens + (now - updated_at) * rate) - 1
+    wait = -tokens / rate if tokens < 0 else 0.0
+    return tokens, wait
+
+
+class SQLiteRateLimiter(RateLimiter):
+    """
+    Keeps the buckets in a SQLite database, to share the budgets between processes.
+
+    The number of waiting requests, bounded by `max_waiters`, is counted per process. The buckets refill
+    on the wall clock, time.time by default, as the processes share no monotonic clock.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        send: Optional[Tuple[float, float]] = None,
+        sources: Optional[Tuple[float, float]] = None,
+        login: Optional[Tuple[float, float]] = None,
+        timeout: Optional[float] = None,
+        max_waiters: Optional[int] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        super().__init__(
+            send=send,
+            sources=sources,
+            login=login,
+            timeout=timeout,
+            max_waiters=max_waiters,
+            clock=clock,
+        )
+        self.path = path
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS buckets ("
+                    "kind TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+                )
+        finally:
+            connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _take(
+        self, kind: str, rate: float, burst: float, timeout: Optional[float]
+    ) -> Optional[float]:
+        connection = self._connect()
+        try:
+            # Lock the database for writing before reading, so that processes take tokens one at a time.
+            connection.execute("BEGIN IMMEDIATE")
+            now = self.clock()
+            row = connection.execute(
+                "SELECT tokens, updated_at FROM buckets WHERE kind = ?", (kind,)
+            ).fetchone()
+            tokens, updated_at = row if row is not None else (burst, now)
+            tokens, wait = take_token(tokens, updated_at, now, rate, burst)
+            if timeout is not None and wait > timeout:
+                connection.execute("ROLLBACK")
+                return None
+            connection.execute(
+                "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)", (kind, tokens, now)
+            )
+            connection.execute("COMMIT")
+        finally:
+            # Closing a connection with a transaction still open rolls it back.
+            connection.close()
+        return wait
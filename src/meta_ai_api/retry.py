@@ -0,0 +1,331 @@
+import logging
+import random
+import threading
+import time
+from typing import Callable, Optional, Tuple
+
+import requests
+
+from meta_ai_api.control import Deadline
+from meta_ai_api.exceptions import (
+    CircuitOpen,
+    FacebookRegionBlocked,
+    MetaAIResponseError,
+    RetriesExhausted,
+)
+
+MAX_RETRIES = 3
+
+REGION_BLOCKED = "region_blocked"
+GRAPHQL = "graphql"
+TRANSPORT = "transport"
+FATAL = "fatal"
+
+
+class RetryPolicy:
+    """
+    Decides whether and when a failed request is sent again.
+
+    Retries wait an exponentially growing, jittered delay. Every retry spends a token from a budget that
+    successful requests refill, so that retries stay a fraction of the traffic during an outage. After
+    `failure_threshold` consecutive failures the circuit opens: requests fail fast with CircuitOpen for
+    `reset_timeout` seconds, after which a single trial request is let through: the others keep failing
+    fast until it succeeds, closing the circuit, or fails, opening it again.
+
+    A policy holds state, share one instance between the clients that should share a budget.
+    """
+
+    transport_errors: Tuple[type, ...] = (
+        requests.ConnectionError,
+        requests.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+        ConnectionError,
+        TimeoutError,
+    )
+
+    def __init__(
+        self,
+        max_retries: int = MAX_RETRIES,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+        jitter: bool = True,
+        budget_ratio: float = 0.2,
+        budget_max: float = 10.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        retry_on: Tuple[str, ...] = (GRAPHQL, TRANSPORT),
+        transport_errors: Tuple[type, ...] = None,
+        clock: Callable[[], float] = time.monotonic,
+        rng: random.Random = None,
+    ):
+        """
+        Args:
+            max_retries (int): The maximum number of retries after the first attempt. Defaults to 3.
+            base_delay (float): The delay before the first retry, in seconds. Defaults to 1.
+            max_delay (float): The maximum delay between two attempts, in seconds. Defaults to 30.
+            jitter (bool): Whether to randomize the delays, spreading retries of concurrent callers.
+                Defaults to True.
+            budget_ratio (float): The retry tokens earned by every successful request. Defaults to 0.2.
+            budget_max (float): The maximum number of retry tokens. Defaults to 10.
+            failure_threshold (int): Consecutive failures opening the circuit, 0 to disable the circuit
+                breaker. Defaults to 5.
+            reset_timeout (float): Seconds the circuit stays open. Defaults to 30.
+            retry_on (tuple): The error kinds to retry, among "region_blocked", "graphql" and "transport".
+                Defaults to GraphQL and transport errors.
+            transport_errors (tuple): Exception types considered transport errors, added to the defaults.
+            clock (Callable[[], float]): The monotonic clock timing the circuit. Defaults to
+                time.monotonic.
+            rng (random.Random): The random generator of the jitter. Defaults to the random module.
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.budget_ratio = budget_ratio
+        self.budget_max = budget_max
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.retry_on = retry_on
+        if transport_errors:
+            self.transport_errors = self.transport_errors + tuple(transport_errors)
+        self.budget = budget_max
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        # Whether the trial request of a half open circuit is in flight.
+        self.half_open_trial = False
+        self.clock = clock
+        self.rng = rng if rng is not None else random
+        self._lock = threading.Lock()
+
+    def classify(self, error: BaseException) -> str:
+        """
+        Classifies an error raised by a request.
+
+        Args:
+            error (BaseException): The error.
+
+        Returns:
+            str: One of "region_blocked", "graphql", "transport" or "fatal".
+        """
+        if isinstance(error, FacebookRegionBlocked):
+            return REGION_BLOCKED
+        if isinstance(error, MetaAIResponseError):
+            return GRAPHQL
+        if isinstance(error, self.transport_errors):
+            return TRANSPORT
+        return FATAL
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Returns the delay before the given retry.
+
+        Args:
+            attempt (int): The number of attempts already made, starting at 0.
+
+        Returns:
+            float: The delay in seconds.
+        """
+        delay = min(self.max_delay, self.base_delay * 2**attempt)
+        if self.jitter:
+            delay = self.rng.uniform(delay / 2, delay)
+        return delay
+
+    def before_attempt(self) -> bool:
+        """
+        Raises CircuitOpen if requests are currently short-circuited.
+
+        Returns:
+            bool: Whether the attempt is the trial request of a half open circuit, to pass to
+            `end_trial` if it ends without success or failure.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            if (
+                self.half_open_trial
+                or self.clock() - self.opened_at < self.reset_timeout
+            ):
+                raise CircuitOpen(
+                    "Too many consecutive failures from Meta AI, requests are paused. Try again later."
+                )
+            # Half open: let this request through alone, a single failure opens the circuit again.
+            self.half_open_trial = True
+            self.consecutive_failures = max(self.failure_threshold - 1, 0)
+            return True
+
+    def end_trial(self):
+        """
+        Lets another request through a half open circuit, after the trial ended without telling whether
+        Meta AI recovered, such as when it was cancelled.
+        """
+        with self._lock:
+            self.half_open_trial = False
+
+    def record_success(self):
+        """
+        Records a successful request, closing the circuit and refilling the retry budget.
+        """
+        with self._lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.half_open_trial = False
+            self.budget = min(self.budget_max, self.budget + self.budget_ratio)
+
+    def record_failure(self):
+        """
+        Records a failed request, opening the circuit once too many failed in a row.
+        """
+        with self._lock:
+            self.consecutive_failures += 1
+            if (
+                self.failure_threshold
+                and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.opened_at = self.clock()
+                self.half_open_trial = False
+
+    def should_retry(self, kind: str, attempt: int) -> bool:
+        """
+        Decides whether a failed attempt is retried, spending a budget token if it is.
+
+        Args:
+            kind (str): The kind of error, as returned by classify.
+            attempt (int): The number of attempts already made, starting at 0.
+
+        Returns:
+            bool: Whether to retry.
+        """
+        if kind not in self.retry_on or attempt >= self.max_retries:
+            return False
+        with self._lock:
+            if self.opened_at is not None or self.budget < 1:
+                return False
+            self.budget -= 1
+            return True
+
+    def _on_failure(
+        self, error: Exception, attempt: int, trial: bool = False
+    ) -> Optional[float]:
+        kind = self.classify(error)
+        if kind != FATAL:
+            self.record_failure()
+        elif trial:
+            self.end_trial()
+        if not self.should_retry(kind, attempt):
+            if kind in self.retry_on:
+                raise RetriesExhausted(
+                    "Unable to obtain a valid response from Meta AI. Try again later."
+                ) from error
+            raise error
+        logging.warning(
+            f"Was unable to obtain a valid response from Meta AI ({kind}). "
+            f"Retrying... Attempt {attempt + 1}/{self.max_retries}."
+        )
+        return self.backoff(attempt)
+
+    def call(
+        self,
+        function: Callable,
+        *args,
+        attempts: int = 0,
+        on_retry: Callable[[Exception, int], None] = None,
+        deadline: Deadline = None,
+        **kwargs,
+    ):
+        """
+        Calls a function, retrying it according to the policy.
+
+        Args:
+            function (Callable): The function sending the request.
+            attempts (int): The number of attempts already made. Defaults to 0.
+            on_retry (Callable): Called with the error and attempt number before each retry.
+            deadline (Deadline): The time limits and cancel event of the call, also passed on to the
+                function. Waits between attempts end early once cancelled, and never outlast it.
+
+        Returns:
+            The return value of the function.
+
+        Raises:
+            RetriesExhausted: If a retryable error persisted after every allowed retry.
+            CircuitOpen: If requests are currently short-circuited.
+            DeadlineExceeded: If the total time limit of the deadline passed.
+            PromptCancelled: If the deadline was cancelled.
+        """
+        if deadline is not None:
+            kwargs["deadline"] = deadline
+        attempt = attempts
+        while True:
+            trial = self.before_attempt()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as error:
+                delay = self._on_failure(error, attempt, trial)
+                if on_retry is not None:
+                    on_retry(error, attempt)
+                if deadline is not None:
+                    deadline.sleep(delay)
+                else:
+                    time.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                # Interrupted, or the task was cancelled.
+                if trial:
+                    self.end_trial()
+                raise
+            self.record_success()
+            return result
+
+    async def call_async(
+        self,
+        function: Callable,
+        *args,
+        attempts: int = 0,
+        on_retry: Callable[[Exception, int], None] = None,
+        deadline: Deadline = None,
+        **kwargs,
+    ):
+        """
+        Awaits a coroutine function, retrying it according to the policy without blocking the event loop.
+
+        Args:
+            function (Callable): The coroutine function sending the request.
+            attempts (int): The number of attempts already made. Defaults to 0.
+            on_retry (Callable): Called with the error and attempt number before each retry.
+            deadline (Deadline): The time limits and cancel event of the call, see `call`.
+
+        Returns:
+            The return value of the coroutine.
+
+        Raises:
+            RetriesExhausted: If a retryable error persisted after every allowed retry.
+            CircuitOpen: If requests are currently short-circuited.
+            DeadlineExceeded: If the total time limit of the deadline passed.
+            PromptCancelled: If the deadline was cancelled.
+        """
+        import asyncio
+
+        if deadline is not None:
+            kwargs["deadline"] = deadline
+        attempt = attempts
+        while True:
+            trial = self.before_attempt()
+            try:
+                result = await function(*args, **kwargs)
+            except Exception as error:
+                delay = self._on_failure(error, attempt, trial)
+                if on_retry is not None:
+                    on_retry(error, attempt)
+                if deadline is not None:
+                    await deadline.sleep_async(delay)
+                else:
+                    await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                # Interrupted, or the task was cancelled.
+                if trial:
+                    self.end_trial()
+                raise
+            self.record_success()
+            return result
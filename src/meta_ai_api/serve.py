@@ -0,0 +1,628 @@
+"""
+Serves Meta AI over a local HTTP API compatible with the OpenAI chat completions API.
+
+The server process accepts the requests and routes each conversation to one of several worker processes,
+which answer them with a warm client: its cookies and access token are fetched once, when the worker
+starts. Run it with:
+
+    python -m meta_ai_api.serve --workers 4 --port 8000
+
+then point any OpenAI client at http://127.0.0.1:8000/v1. The "conversation_id" of a response, also sent
+in the x-conversation-id header, continues the conversation when passed back in the request body or
+header. Requests without one start a new conversation.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple, Type
+
+from meta_ai_api.conversation import Conversation
+from meta_ai_api.exceptions import (
+    CircuitOpen,
+    DeadlineExceeded,
+    PromptCancelled,
+    RetriesExhausted,
+    WorkerOverloaded,
+)
+from meta_ai_api.main import MetaAI
+
+MODEL = "meta-ai"
+
+# Messages between the server and the workers.
+PROMPT = "prompt"
+CANCEL = "cancel"
+DELTA = "delta"
+DONE = "done"
+ERROR = "error"
+
+# Seconds between two checks that the workers are alive.
+WORKER_CHECK_INTERVAL = 1.0
+
+
+def build_prompt(messages: List[Dict], new_conversation: bool) -> str:
+    """
+    Turns the messages of a chat completion request into the message sent to Meta AI.
+
+    Meta AI keeps the history of a conversation, so a follow-up only sends the last user message. A new
+    conversation given several messages, such as a system prompt, sends them all as a transcript.
+
+    Raises:
+        ValueError: If there is no user message.
+    """
+    turns = []
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, list):
+            content = "".join(
+                part.get("text", "") for part in content if part.get("type") == "text"
+            )
+        turns.append((message.get("role", "user"), content))
+    if not any(role == "user" for role, _ in turns):
+        raise ValueError("The messages hold no user message.")
+    if not new_conversation or len(turns) == 1:
+        return next(content for role, content in reversed(turns) if role == "user")
+    return "\n\n".join(f"{role.capitalize()}: {content}" for role, content in turns)
+
+
+class Worker:
+    """
+    Answers the prompts routed to one worker process, with one client shared by all its conversations.
+    """
+
+    def __init__(
+        self,
+        jobs: multiprocessing.Queue,
+        results: multiprocessing.Queue,
+        client_class: Type[MetaAI] = MetaAI,
+        client_kwargs: Dict = None,
+        threads: int = 16,
+        max_conversations: int = 100_000,
+        prompt_timeout: Optional[float] = None,
+    ):
+        self.jobs = jobs
+        self.results = results
+        self.client_class = client_class
+        self.client_kwargs = client_kwargs or {}
+        self.threads = threads
+        self.max_conversations = max_conversations
+        self.prompt_timeout = prompt_timeout
+        self.client = None
+        self._conversations: "OrderedDict[str, Tuple[Conversation, threading.Lock]]" = (
+            OrderedDict()
+        )
+        self._cancels: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def run(self):
+        """
+        Warms the client up, then answers prompts until told to stop.
+        """
+        self.client = self.client_class(**self.client_kwargs)
+        if not self.client.is_authed:
+            self.client.get_access_token()
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            while True:
+                job = self.jobs.get()
+                if job is None:
+                    break
+                kind, request_id = job[0], job[1]
+                if kind == CANCEL:
+                    with self._lock:
+                        cancel = self._cancels.get(request_id)
+                    if cancel is not None:
+                        cancel.set()
+                    continue
+                with self._lock:
+                    self._cancels[request_id] = threading.Event()
+                executor.submit(self.answer, *job[1:])
+
+    def conversation(self, conversation_id: str) -> Tuple[Conversation, threading.Lock]:
+        """
+        Returns the handle of a conversation and the lock serializing its prompts, forgetting the least
+        recently used conversations past `max_conversations`.
+        """
+        with self._lock:
+            entry = self._conversations.get(conversation_id)
+            if entry is None:
+                entry = (self.client.conversation(conversation_id), threading.Lock())
+                self._conversations[conversation_id] = entry
+                while len(self._conversations) > self.max_conversations:
+                    self._conversations.popitem(last=False)
+            else:
+                self._conversations.move_to_end(conversation_id)
+            return entry
+
+    def answer(self, request_id: str, conversation_id: str, message: str, stream: bool):
+        """
+        Prompts a conversation and sends the outcome back to the server, always ending with a DONE or
+        ERROR message.
+        """
+        cancel = self._cancels[request_id]
+        try:
+            conversation, lock = self.conversation(conversation_id)
+            with lock:
+                if stream:
+                    response = {}
+                    for item in conversation.prompt(
+                        message,
+                        stream=True,
+                        delta=True,
+                        timeout=self.prompt_timeout,
+                        cancel=cancel,
+                    ):
+                        if item["delta"]:
+                            self.results.put((request_id, DELTA, item["delta"]))
+                        response = item
+                    response = {key: response.get(key) for key in ("sources", "media")}
+                else:
+                    response = conversation.prompt(
+                        message, timeout=self.prompt_timeout, cancel=cancel
+                    )
+            self.results.put((request_id, DONE, response))
+        except Exception as e:
+            self.results.put((request_id, ERROR, error_status(e)))
+        finally:
+            with self._lock:
+                self._cancels.pop(request_id, None)
+
+
+def error_status(error: Exception) -> Tuple[int, str, str]:
+    """
+    Maps an error to the HTTP status, OpenAI error type and message returned to the caller.
+    """
+    if isinstance(error, PromptCancelled):
+        return 499, "cancelled", str(error)
+    if isinstance(error, DeadlineExceeded):
+        return 504, "timeout", str(error)
+    if isinstance(error, (CircuitOpen, RetriesExhausted)):
+        return 503, "upstream_unavailable", str(error)
+    logging.exception("Prompt failed in worker.", exc_info=error)
+    return 502, "upstream_error", f"{type(error).__name__}: {error}"
+
+
+def worker_main(
+    jobs,
+    results,
+    client_class,
+    client_kwargs,
+    threads,
+    max_conversations,
+    prompt_timeout,
+):
+    """
+    The entry point of the worker processes.
+    """
+    Worker(
+        jobs,
+        results,
+        client_class=client_class,
+        client_kwargs=client_kwargs,
+        threads=threads,
+        max_conversations=max_conversations,
+        prompt_timeout=prompt_timeout,
+    ).run()
+
+
+class Dispatcher:
+    """
+    Starts the worker processes and routes the prompts to them, every conversation to the same worker.
+
+    Each worker accepts at most `max_pending` prompts, queued or running, at a time. Past that,
+    submitting raises WorkerOverloaded, which the server answers with a 429, rather than letting latency
+    grow without bound. A worker that dies is started again, with an empty queue, failing the prompts it held.
+    """
+
+    def __init__(
+        self,
+        workers: int = None,
+        threads: int = 16,
+        max_pending: int = 64,
+        client_class: Type[MetaAI] = MetaAI,
+        client_kwargs: Dict = None,
+        max_conversations: int = 100_000,
+        prompt_timeout: Optional[float] = None,
+    ):
+        """
+        Args:
+            workers (int): The number of worker processes. Defaults to the number of CPUs.
+            threads (int): The prompts answered at the same time by each worker. Defaults to 16.
+            max_pending (int): The prompts each worker holds at most, queued or running. Defaults to 64.
+            client_class (Type[MetaAI]): The client class of the workers, importable by them.
+            client_kwargs (dict): The arguments of the clients, such as a shared credential_store.
+            max_conversations (int): The conversations each worker keeps track of. Defaults to 100k.
+            prompt_timeout (float): The total time limit of every prompt, in seconds. Defaults to none.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self._worker_args = (
+            client_class,
+            client_kwargs or {},
+            threads,
+            max_conversations,
+            prompt_timeout,
+        )
+        # Spawned, rather than forked, processes do not inherit the threads of the server.
+        self._context = multiprocessing.get_context("spawn")
+        self._results = self._context.Queue()
+        self._jobs: List[multiprocessing.Queue] = []
+        self._processes: List[multiprocessing.Process] = []
+        # Per request: its worker and the queue of its messages.
+        self._requests: Dict[str, Tuple[int, queue.Queue]] = {}
+        self._pending = [0] * self.workers
+        self._lock = threading.Lock()
+        self._reader = None
+        self._stopped = False
+
+    def start(self):
+        for index in range(self.workers):
+            self._jobs.append(self._context.Queue())
+            self._processes.append(self._start_worker(index))
+        self._reader = threading.Thread(target=self._read_results, daemon=True)
+        self._reader.start()
+
+    def _start_worker(self, index: int) -> multiprocessing.Process:
+        process = self._context.Process(
+            target=worker_main,
+            args=(self._jobs[index], self._results, *self._worker_args),
+            name=f"meta-ai-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def stop(self, timeout: float = 10):
+        """
+        Stops the workers, letting them finish the prompts they hold for up to `timeout` seconds.
+        """
+        self._stopped = True
+        for jobs in self._jobs:
+            jobs.put(None)
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                process.terminate()
+
+    def route(self, conversation_id: str) -> int:
+        """
+        Returns the index of the worker owning a conversation.
+        """
+        return zlib.crc32(conversation_id.encode()) % self.workers
+
+    def submit(
+        self, conversation_id: str, message: str, stream: bool
+    ) -> Tuple[str, queue.Queue]:
+        """
+        Sends a prompt to the worker owning its conversation.
+
+        Returns:
+            tuple: The request ID, and the queue receiving the (kind, payload) messages of the answer:
+            DELTA messages when streaming, then a DONE or ERROR message.
+
+        Raises:
+            WorkerOverloaded: If the worker holds `max_pending` prompts already.
+        """
+        index = self.route(conversation_id)
+        request_id = uuid.uuid4().hex
+        messages = queue.Queue()
+        with self._lock:
+            if self._pending[index] >= self.max_pending:
+                raise WorkerOverloaded(
+                    f"Worker {index} holds {self._pending[index]} prompts already."
+                )
+            self._pending[index] += 1
+            self._requests[request_id] = (index, messages)
+            # Under the lock, so the prompt never lands in the queue of a worker being replaced.
+            self._jobs[index].put(
+                (PROMPT, request_id, conversation_id, message, stream)
+            )
+        return request_id, messages
+
+    def cancel(self, request_id: str):
+        """
+        Cancels a prompt, whose worker closes the response from Meta AI right away.
+        """
+        with self._lock:
+            entry = self._requests.get(request_id)
+            if entry is not None:
+                self._jobs[entry[0]].put((CANCEL, request_id))
+
+    def pending(self) -> List[int]:
+        """
+        Returns the number of prompts held by each worker.
+        """
+        with self._lock:
+            return list(self._pending)
+
+    def _read_results(self):
+        checked_at = time.monotonic()
+        while not self._stopped:
+            # On a timer rather than when idle, the other workers may never let the results queue empty.
+            if time.monotonic() - checked_at >= WORKER_CHECK_INTERVAL:
+                self._restart_dead_workers()
+                checked_at = time.monotonic()
+            try:
+                request_id, kind, payload = self._results.get(
+                    timeout=WORKER_CHECK_INTERVAL
+                )
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                entry = self._requests.get(request_id)
+                if entry is not None and kind in (DONE, ERROR):
+                    del self._requests[request_id]
+                    self._pending[entry[0]] -= 1
+            if entry is not None:
+                entry[1].put((kind, payload))
+
+    def _restart_dead_workers(self):
+        for index, process in enumerate(self._processes):
+            if process.is_alive() or self._stopped:
+                continue
+            logging.warning(
+                f"Meta AI worker {index} exited with code {process.exitcode}, restarting it."
+            )
+            with self._lock:
+                lost = [
+                    (request_id, messages)
+                    for request_id, (owner, messages) in self._requests.items()
+                    if owner == index
+                ]
+                for request_id, _ in lost:
+                    del self._requests[request_id]
+                self._pending[index] = 0
+                # The jobs still queued belong to the failed prompts, the new worker starts from an empty queue.
+                stale, self._jobs[index] = self._jobs[index], self._context.Queue()
+            stale.close()
+            stale.cancel_join_thread()
+            for _, messages in lost:
+                messages.put((ERROR, (502, "worker_error", "The worker exited.")))
+            self._processes[index] = self._start_worker(index)
+
+
+class Server(ThreadingHTTPServer):
+    """
+    The HTTP server, handing every request to a thread of its own.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        dispatcher: Dispatcher,
+        request_timeout: float = 300,
+    ):
+        super().__init__(address, Handler)
+        self.dispatcher = dispatcher
+        self.request_timeout = request_timeout
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Handles the OpenAI compatible endpoints: POST /v1/chat/completions and GET /v1/models.
+    """
+
+    protocol_version = "HTTP/1.1"
+    server: Server
+
+    def log_message(self, format: str, *args):
+        logging.debug(format, *args)
+
+    def _send_json(self, status: int, body: Dict, headers: Dict[str, str] = None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: int, kind: str, message: str, headers=None):
+        self._send_json(
+            status,
+            {"error": {"message": message, "type": kind, "code": status}},
+            headers,
+        )
+
+    def do_GET(self):
+        if self.path == "/v1/models":
+            model = {"id": MODEL, "object": "model", "created": 0, "owned_by": "meta"}
+            self._send_json(200, {"object": "list", "data": [model]})
+        elif self.path == "/health":
+            self._send_json(200, {"pending": self.server.dispatcher.pending()})
+        else:
+            self._send_error(404, "not_found", f"Unknown path {self.path}.")
+
+    def do_POST(self):
+        if self.path != "/v1/chat/completions":
+            self._send_error(404, "not_found", f"Unknown path {self.path}.")
+            return
+        try:
+            length = int(self.headers.get("content-length", 0))
+            body = json.loads(self.rfile.read(length))
+            conversation_id = body.get("conversation_id") or self.headers.get(
+                "x-conversation-id"
+            )
+            message = build_prompt(body["messages"], conversation_id is None)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self._send_error(400, "invalid_request_error", f"Invalid request: {e}")
+            return
+        if conversation_id is None:
+            # Named here, so that the conversation is routed before Meta AI ever sees it.
+            conversation_id = str(uuid.uuid4())
+        stream = bool(body.get("stream"))
+        dispatcher = self.server.dispatcher
+        try:
+            request_id, messages = dispatcher.submit(conversation_id, message, stream)
+        except WorkerOverloaded as e:
+            self._send_error(429, "overloaded", str(e), {"retry-after": "1"})
+            return
+        try:
+            if stream:
+                self._stream(request_id, conversation_id, messages)
+            else:
+                self._complete(request_id, conversation_id, messages)
+        except (BrokenPipeError, ConnectionResetError):
+            # The caller left, do not keep Meta AI generating for nobody.
+            dispatcher.cancel(request_id)
+        except queue.Empty:
+            dispatcher.cancel(request_id)
+            if not stream:
+                self._send_error(504, "timeout", "The worker did not answer in time.")
+
+    def _completion(self, request_id: str, conversation_id: str, kind: str) -> Dict:
+        return {
+            "id": f"chatcmpl-{request_id}",
+            "object": kind,
+            "created": int(time.time()),
+            "model": MODEL,
+            "conversation_id": conversation_id,
+        }
+
+    def _complete(self, request_id: str, conversation_id: str, messages: queue.Queue):
+        kind, payload = messages.get(timeout=self.server.request_timeout)
+        if kind == ERROR:
+            self._send_error(*payload)
+            return
+        body = self._completion(request_id, conversation_id, "chat.completion")
+        body["choices"] = [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": payload["message"]},
+                "finish_reason": "stop",
+            }
+        ]
+        body["sources"] = payload.get("sources") or []
+        body["media"] = payload.get("media") or []
+        self._send_json(200, body, {"x-conversation-id": conversation_id})
+
+    def _stream(self, request_id: str, conversation_id: str, messages: queue.Queue):
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.send_header("cache-control", "no-cache")
+        self.send_header("connection", "close")
+        self.send_header("x-conversation-id", conversation_id)
+        self.end_headers()
+        self.close_connection = True
+        chunk = self._completion(request_id, conversation_id, "chat.completion.chunk")
+        role = {"role": "assistant"}
+        while True:
+            kind, payload = messages.get(timeout=self.server.request_timeout)
+            if kind == DELTA:
+                choice = {"index": 0, "delta": {**role, "content": payload}}
+                role = {}
+                choice["finish_reason"] = None
+                self._send_event({**chunk, "choices": [choice]})
+                continue
+            if kind == ERROR:
+                status, error_type, message = payload
+                error = {"message": message, "type": error_type, "code": status}
+                self._send_event({"error": error})
+            else:
+                choice = {"index": 0, "delta": {}, "finish_reason": "stop"}
+                self._send_event({**chunk, "choices": [choice], **payload})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            return
+
+    def _send_event(self, data: Dict):
+        self.wfile.write(b"data: " + json.dumps(data).encode() + b"\n\n")
+        self.wfile.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve Meta AI over an OpenAI compatible HTTP API."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Worker processes, one per CPU by default.",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=16, help="Prompts answered at once per worker."
+    )
+    parser.add_argument(
+        "--max-pending",
+        type=int,
+        default=64,
+        help="Prompts held per worker, queued or running, before answering 429.",
+    )
+    parser.add_argument(
+        "--request-timeout",
+        type=float,
+        default=300,
+        help="Seconds to wait for a worker to answer.",
+    )
+    parser.add_argument(
+        "--prompt-timeout",
+        type=float,
+        default=None,
+        help="Total time limit of a prompt sent to Meta AI, in seconds.",
+    )
+    parser.add_argument(
+        "--proxy", default=None, help="Proxy URL to reach Meta AI through."
+    )
+    parser.add_argument(
+        "--credential-store",
+        default=None,
+        help="SQLite file caching the cookies and access tokens, shared by the workers.",
+    )
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+
+    client_kwargs = {}
+    if args.proxy:
+        client_kwargs["proxy"] = {"http": args.proxy, "https": args.proxy}
+    if args.credential_store:
+        from meta_ai_api.credentials import SQLiteCredentialStore
+
+        client_kwargs["credential_store"] = SQLiteCredentialStore(args.credential_store)
+    # Credentials come from the environment, rather than the command line, to keep them out of `ps`.
+    if os.environ.get("META_AI_FB_EMAIL") and os.environ.get("META_AI_FB_PASSWORD"):
+        client_kwargs["fb_email"] = os.environ["META_AI_FB_EMAIL"]
+        client_kwargs["fb_password"] = os.environ["META_AI_FB_PASSWORD"]
+
+    dispatcher = Dispatcher(
+        workers=args.workers,
+        threads=args.threads,
+        max_pending=args.max_pending,
+        client_kwargs=client_kwargs,
+        prompt_timeout=args.prompt_timeout,
+    )
+    dispatcher.start()
+    server = Server((args.host, args.port), dispatcher, args.request_timeout)
+    logging.info(
+        f"Serving Meta AI on http://{args.host}:{args.port}/v1 "
+        f"with {dispatcher.workers} workers."
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        dispatcher.stop()
+
+
+if __name__ == "__main__":
+    main()
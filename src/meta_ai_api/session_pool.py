@@ -0,0 +1,241 @@
+import logging
+import queue
+import threading
+import time
+from typing import List, Optional, Type, TYPE_CHECKING
+
+from meta_ai_api.main import MetaAI
+
+# Seconds acquire waits for a warm session before bootstrapping one on the calling thread.
+ACQUIRE_TIMEOUT = 10
+# Seconds between two checks, while waiting for a warm session, that the background bootstraps still work.
+ACQUIRE_POLL_INTERVAL = 0.5
+
+if TYPE_CHECKING:
+    from meta_ai_api.hooks import Hooks
+    from meta_ai_api.ratelimit import RateLimiter
+
+
+class SessionBundle:
+    """
+    The cookies and temp user access token of one anonymous Meta AI session.
+    """
+
+    def __init__(self, cookies: dict, access_token: str, created_at: float = None):
+        self.cookies = cookies
+        self.access_token = access_token
+        self.created_at = created_at if created_at is not None else time.time()
+
+    def is_expired(self, max_age: Optional[float]) -> bool:
+        """
+        Checks whether the bundle is older than the given age.
+
+        Args:
+            max_age (float): The maximum age in seconds, None for no limit.
+
+        Returns:
+            bool: True if the bundle should not be handed out anymore.
+        """
+        return max_age is not None and time.time() - self.created_at > max_age
+
+
+class SessionPool:
+    """
+    Keeps a number of anonymous sessions warm in the background, so that creating a MetaAI instance
+    or sending its first prompt does not pay for the cookie scraping and access token bootstrap.
+
+    Each bundle is handed out once. Background workers refill the pool as soon as a bundle is taken, and
+    expired bundles are dropped when they are reached.
+    """
+
+    def __init__(
+        self,
+        size: int = 4,
+        max_age: Optional[float] = 3600,
+        proxy: dict = None,
+        workers: int = 1,
+        retry_delay: float = 5,
+        start: bool = True,
+        client_class: Type[MetaAI] = MetaAI,
+        rate_limiter: "RateLimiter" = None,
+        hooks: "Hooks" = None,
+    ):
+        """
+        Args:
+            size (int): The number of bundles to keep ready. Defaults to 4.
+            max_age (float): Seconds after which a bundle is considered expired. Defaults to 3600.
+            proxy (dict): The proxy used for bootstrapping and by the clients handed out.
+            workers (int): The number of background threads bootstrapping bundles. Defaults to 1.
+            retry_delay (float): Seconds to wait after a failed bootstrap. Defaults to 5.
+            start (bool): Whether to start the background workers right away. Defaults to True.
+            client_class (type): The MetaAI class used to bootstrap and to create clients.
+            rate_limiter (RateLimiter): Throttles the bootstraps and the clients handed out.
+            hooks (Hooks): Instrument the bootstraps and the clients handed out.
+        """
+        self.size = size
+        self.max_age = max_age
+        self.proxy = proxy
+        self.workers = workers
+        self.retry_delay = retry_delay
+        self.client_class = client_class
+        self.rate_limiter = rate_limiter
+        self.hooks = hooks
+        self._ready = queue.Queue(maxsize=size)
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        # The number of bundles dropped as expired, or reported as rejected by the clients.
+        self.retired = 0
+        # The error of the last background bootstrap, None if it succeeded.
+        self.last_error: Optional[Exception] = None
+        if start:
+            self.start()
+
+    def __enter__(self) -> "SessionPool":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        """
+        Starts the background workers filling the pool.
+        """
+        with self._lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._fill, name=f"meta-ai-session-pool-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def close(self):
+        """
+        Stops the background workers. Bundles already in the pool are discarded.
+        """
+        self._stop.set()
+        with self._lock:
+            threads, self._threads = self._threads, []
+        # Unblock workers waiting for free space.
+        self._drain()
+        for thread in threads:
+            thread.join()
+        self._drain()
+
+    def _drain(self):
+        while True:
+            try:
+                self._ready.get_nowait()
+            except queue.Empty:
+                return
+
+    def bootstrap(self) -> SessionBundle:
+        """
+        Creates a new anonymous session by scraping cookies and requesting an access token.
+
+        Returns:
+            SessionBundle: The new session.
+        """
+        meta_ai = self.client_class(
+            proxy=self.proxy, rate_limiter=self.rate_limiter, hooks=self.hooks
+        )
+        try:
+            access_token = meta_ai.get_access_token()
+            return SessionBundle(cookies=meta_ai.cookies, access_token=access_token)
+        finally:
+            # Only the cookies and token are kept, the client's connection pool is not reused.
+            meta_ai.session.close()
+
+    def _fill(self):
+        while not self._stop.is_set():
+            try:
+                bundle = self.bootstrap()
+            except Exception as e:
+                logging.warning(f"Unable to warm up a Meta AI session: {e}")
+                self.last_error = e
+                self._stop.wait(self.retry_delay)
+                continue
+            self.last_error = None
+            while not self._stop.is_set():
+                try:
+                    self._ready.put(bundle, timeout=1)
+                    break
+                except queue.Full:
+                    continue
+
+    def acquire(self, timeout: Optional[float] = ACQUIRE_TIMEOUT) -> SessionBundle:
+        """
+        Takes a ready session out of the pool.
+
+        If no session becomes available within the timeout, or the background bootstraps are failing,
+        one is bootstrapped on the calling thread, so that callers never wait on a pool that cannot
+        fill, and get the error of the bootstrap if it fails.
+
+        Args:
+            timeout (float): Seconds to wait for a warm session, None to wait as long as the background
+                bootstraps succeed. Defaults to 10.
+
+        Returns:
+            SessionBundle: A session that has not been handed out before.
+
+        Raises:
+            Exception: The error of the bootstrap on the calling thread, such as FacebookRegionBlocked.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            if self._ready.empty() and (
+                self._stop.is_set() or self.last_error is not None
+            ):
+                return self.bootstrap()
+            wait = ACQUIRE_POLL_INTERVAL
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return self.bootstrap()
+                wait = min(wait, remaining)
+            try:
+                bundle = self._ready.get(timeout=wait)
+            except queue.Empty:
+                continue
+            if not bundle.is_expired(self.max_age):
+                return bundle
+            self._count_retired()
+
+    def retire(self, bundle: SessionBundle):
+        """
+        Reports a session rejected by Meta AI. Bundles are handed out once, so this only counts it in
+        `retired`.
+
+        Args:
+            bundle (SessionBundle): The rejected session.
+        """
+        self._count_retired()
+        logging.info("Retired a rejected Meta AI session.")
+
+    def _count_retired(self):
+        with self._lock:
+            self.retired += 1
+
+    def get_client(self) -> MetaAI:
+        """
+        Creates a MetaAI instance using a pre-warmed session.
+
+        Returns:
+            MetaAI: A client ready to prompt without any bootstrap request.
+        """
+        return self.client_class(
+            proxy=self.proxy,
+            session_pool=self,
+            rate_limiter=self.rate_limiter,
+            hooks=self.hooks,
+        )
+
+    @property
+    def ready(self) -> int:
+        """
+        The number of sessions currently ready to be handed out.
+        """
+        return self._ready.qsize()
@@ -1,13 +1,43 @@
+import inspect
 import logging
 import random
 import time
-from typing import Dict, Optional
+from http.cookiejar import DefaultCookiePolicy
+from typing import (
+    Any,
+    AsyncGenerator,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
 
-from requests_html import HTMLSession
 import requests
-from bs4 import BeautifulSoup
-
-from meta_ai_api.exceptions import FacebookInvalidCredentialsException
+from requests.adapters import HTTPAdapter
+
+from meta_ai_api import codec
+from meta_ai_api.exceptions import (
+    AccessTokenRejected,
+    FacebookInvalidCredentialsException,
+    MetaAIResponseError,
+    MissingTokenError,
+)
+
+# The markers preceding each token of the meta.ai landing page, by cookie or form field name.
+LANDING_PAGE_TOKENS = {
+    "_js_datr": b'"_js_datr":{"value":"',
+    "datr": b'"datr":{"value":"',
+    "abra_csrf": b'"abra_csrf":{"value":"',
+    "lsd": b'"LSD",[],{"token":"',
+    "fb_dtsg": b'"DTSGInitData",[],{"token":"',
+}
+MAX_TOKEN_LENGTH = 1024
+
+# Graph API error codes reporting an invalid or expired access token.
+AUTH_ERROR_CODES = (102, 190)
 
 
 def generate_offline_threading_id() -> str:
@@ -53,10 +83,107 @@ def extract_value(text: str, start_str: str, end_str: str) -> str:
 
     Returns:
         str: The extracted value.
+
+    Raises:
+        MissingTokenError: If the value is not in the text.
+    """
+    start = text.find(start_str)
+    end = text.find(end_str, start + len(start_str)) if start != -1 else -1
+    if end == -1:
+        raise MissingTokenError(
+            f"Unable to find {start_str!r} in the response. "
+            "The page layout may have changed, or the request may have been blocked."
+        )
+    return text[start + len(start_str) : end]
+
+
+class TokenExtractor:
+    """
+    Finds the tokens of the meta.ai landing page in a single pass, as the page is downloaded.
+
+    Each chunk is searched for the markers of the tokens still missing while it is hot in the CPU cache,
+    and its end is kept to find tokens split across chunks. Once every wanted token is found the rest of
+    the page can be skipped.
+    """
+
+    overlap = max(map(len, LANDING_PAGE_TOKENS.values())) + MAX_TOKEN_LENGTH
+
+    def __init__(self, names: Iterable[str]):
+        """
+        Args:
+            names (Iterable[str]): The tokens to find, among the keys of LANDING_PAGE_TOKENS.
+        """
+        self.tokens: Dict[str, str] = {}
+        self.missing = set(names)
+        self._tail = b""
+
+    @property
+    def done(self) -> bool:
+        """
+        Whether every wanted token was found.
+        """
+        return not self.missing
+
+    def feed(self, chunk: bytes) -> bool:
+        """
+        Scans the next chunk of the page.
+
+        Args:
+            chunk (bytes): The chunk.
+
+        Returns:
+            bool: Whether every wanted token was found.
+        """
+        buffer = self._tail + chunk
+        for name in list(self.missing):
+            marker = LANDING_PAGE_TOKENS[name]
+            start = buffer.find(marker)
+            if start == -1:
+                continue
+            start += len(marker)
+            end = buffer.find(b'"', start, start + MAX_TOKEN_LENGTH + 1)
+            if end == -1:
+                # The value continues in the next chunk, the marker is kept in the tail.
+                continue
+            self.tokens[name] = buffer[start:end].decode()
+            self.missing.discard(name)
+        self._tail = buffer[-self.overlap :]
+        return not self.missing
+
+    def result(self) -> Dict[str, str]:
+        """
+        Returns the tokens found.
+
+        Raises:
+            MissingTokenError: If a wanted token is not in the page.
+        """
+        if self.missing:
+            raise MissingTokenError(
+                f"Unable to find {', '.join(sorted(self.missing))} in the Meta AI page. "
+                "The page layout may have changed, or the request may have been blocked."
+            )
+        return self.tokens
+
+
+def extract_tokens(chunks: Iterable[bytes], names: Iterable[str]) -> Dict[str, str]:
+    """
+    Extracts tokens from the meta.ai landing page, reading no further than the last one.
+
+    Args:
+        chunks (Iterable[bytes]): The page, in chunks.
+        names (Iterable[str]): The tokens to find, among the keys of LANDING_PAGE_TOKENS.
+
+    Returns:
+        dict: The tokens, by name.
+
+    Raises:
+        MissingTokenError: If a token is not in the page.
     """
-    start = text.find(start_str) + len(start_str)
-    end = text.find(end_str, start)
-    return text[start:end]
+    extractor = TokenExtractor(names)
+    for chunk in chunks:
+        if extractor.feed(chunk):
+            break
+    return extractor.result()
 
 
 def format_response(response: dict) -> str:
@@ -81,8 +208,296 @@ def format_response(response: dict) -> str:
     return text
 
 
+class MessageDeltas:
+    """
+    Tracks the content blocks of a streamed message, to compute the text each new snapshot adds.
+
+    Concatenating every delta gives the same text as `format_response` on the last snapshot.
+    """
+
+    def __init__(self):
+        self.blocks: List[str] = []
+
+    @property
+    def message(self) -> str:
+        """
+        The message assembled from every snapshot fed so far.
+        """
+        return "".join(block + "\n" for block in self.blocks)
+
+    def feed(self, response: dict) -> Tuple[str, bool]:
+        """
+        Updates the state with a new snapshot of the message.
+
+        Args:
+            response (dict): The parsed JSON line containing the snapshot.
+
+        Returns:
+            tuple: The new text, and whether previously sent text was rewritten. When it was, the text
+            is the full message and replaces everything sent before.
+        """
+        contents = (
+            response.get("data", {})
+            .get("node", {})
+            .get("bot_response_message", {})
+            .get("composed_text", {})
+            .get("content", [])
+        )
+        blocks = self.blocks
+        if len(contents) < len(blocks):
+            return self._reset(contents)
+        delta = []
+        for i, content in enumerate(contents):
+            text = content["text"]
+            if i == len(blocks):
+                if blocks:
+                    # The previous block is complete, close it the way format_response does.
+                    delta.append("\n")
+                blocks.append(text)
+                delta.append(text)
+                continue
+            previous = blocks[i]
+            if len(text) == len(previous) and text == previous:
+                continue
+            if i != len(blocks) - 1 or not text.startswith(previous):
+                return self._reset(contents)
+            blocks[i] = text
+            delta.append(text[len(previous) :])
+        return "".join(delta), False
+
+    def finish(self) -> str:
+        """
+        Returns the text that completes the message once the stream is over.
+        """
+        return "\n" if self.blocks else ""
+
+    def _reset(self, contents: List[dict]) -> Tuple[str, bool]:
+        self.blocks = [content["text"] for content in contents]
+        message = self.message
+        # The trailing newline of the last block is sent by finish().
+        return message[:-1], True
+
+
+class StreamText:
+    """
+    Follows the text of a streamed message, whether the items hold the whole message so far or deltas.
+    """
+
+    __slots__ = ("text",)
+
+    def __init__(self):
+        self.text = ""
+
+    def feed(self, item: dict) -> str:
+        """
+        Reads the next item of the stream.
+
+        Returns:
+            str: The text of the message so far.
+        """
+        if "message" in item:
+            self.text = item["message"]
+        elif item["reset"]:
+            self.text = item["delta"]
+        else:
+            self.text += item["delta"]
+        return self.text
+
+
+class ClosingStream:
+    """
+    Wraps the generator of a stream, and runs a cleanup when it is closed before it started.
+
+    The finally clauses of a generator only run once it started, so a stream closed before its first
+    item, such as a prompt aborted by the UI right away, would otherwise hold its response until it is
+    garbage collected.
+    """
+
+    __slots__ = ("_items", "_on_close", "_started")
+
+    def __init__(self, items: Generator, on_close: Callable[[], None]):
+        """
+        Args:
+            items (Generator): The stream, releasing its resources in its finally clauses.
+            on_close (Callable[[], None]): Releases the same resources, if closed before it started.
+        """
+        self._items = items
+        self._on_close = on_close
+        self._started = False
+
+    def __iter__(self) -> "ClosingStream":
+        return self
+
+    def __next__(self):
+        self._started = True
+        return next(self._items)
+
+    def close(self):
+        self._items.close()
+        if not self._started:
+            self._started = True
+            self._on_close()
+
+
+class AsyncClosingStream:
+    """
+    Async counterpart of ClosingStream, whose cleanup may be a coroutine function.
+    """
+
+    __slots__ = ("_items", "_on_close", "_started")
+
+    def __init__(self, items: AsyncGenerator, on_close: Callable[[], Any]):
+        self._items = items
+        self._on_close = on_close
+        self._started = False
+
+    def __aiter__(self) -> "AsyncClosingStream":
+        return self
+
+    async def __anext__(self):
+        self._started = True
+        return await self._items.__anext__()
+
+    async def aclose(self):
+        await self._items.aclose()
+        if not self._started:
+            self._started = True
+            result = self._on_close()
+            if inspect.isawaitable(result):
+                await result
+
+
+class LastResponseReader:
+    """
+    Finds the last complete snapshot of a streamed message, reading the response one line at a time.
+
+    Every line holds a snapshot of the whole message so far, so only lines that can complete the
+    message are decoded, and only the last of them is kept.
+    """
+
+    def __init__(self):
+        self.last_response: Optional[dict] = None
+        self.errors: List[dict] = []
+        self._last_response_line = None
+        self._last_line = None
+
+    def feed(self, line: str or bytes):
+        """
+        Reads the next line of the response.
+
+        Args:
+            line (str or bytes): The line, without its line break.
+        """
+        if not line:
+            return
+        if self._last_line is None:
+            # Errors are reported by the first, and usually only, line of the response.
+            error_marker = b'"error' if isinstance(line, bytes) else '"error'
+            if error_marker in line:
+                try:
+                    self.errors = get_response_errors(codec.loads(line))
+                except codec.DecodeError:
+                    pass
+        self._last_line = line
+        marker = b'"OVERALL_DONE"' if isinstance(line, bytes) else '"OVERALL_DONE"'
+        if marker not in line:
+            return
+        try:
+            json_line = codec.loads_message(line)
+        except codec.DecodeError:
+            return
+        if get_bot_response_message(json_line).get("streaming_state") == "OVERALL_DONE":
+            self.last_response = json_line
+            self._last_response_line = line
+
+    def conversation_ids(self) -> Optional[Tuple[str, str]]:
+        """
+        Returns the external conversation ID and offline threading ID of the last message read, if any.
+        """
+        chat_id = None
+        if (
+            self._last_line is not None
+            and self._last_line is not self._last_response_line
+        ):
+            try:
+                chat_id = get_bot_response_message(
+                    codec.loads_message(self._last_line)
+                ).get("id")
+            except codec.DecodeError:
+                pass
+        if not chat_id and self.last_response is not None:
+            chat_id = get_bot_response_message(self.last_response).get("id")
+        if not chat_id:
+            return None
+        external_conversation_id, offline_threading_id, _ = chat_id.split("_")
+        return external_conversation_id, offline_threading_id
+
+
+def get_bot_response_message(json_line: dict) -> dict:
+    """
+    Returns the bot_response_message node of a parsed line, or an empty dict.
+    """
+    data = json_line.get("data") if isinstance(json_line, dict) else None
+    return ((data or {}).get("node") or {}).get("bot_response_message") or {}
+
+
+def get_response_errors(json_line: dict) -> List[dict]:
+    """
+    Returns the errors reported by a parsed line, from a GraphQL "errors" list or a Graph API "error".
+    """
+    if not isinstance(json_line, dict):
+        return []
+    errors = list(json_line.get("errors") or [])
+    if isinstance(json_line.get("error"), dict):
+        errors.append(json_line["error"])
+    return errors
+
+
+def is_auth_error(errors: List[dict]) -> bool:
+    """
+    Checks whether errors returned by Meta AI mean the access token was rejected.
+    """
+    return any(
+        isinstance(error, dict)
+        and (
+            error.get("code") in AUTH_ERROR_CODES
+            or error.get("type") == "OAuthException"
+        )
+        for error in errors
+    )
+
+
+def raise_for_errors(errors: List[dict], is_authed: bool = False):
+    """
+    Raises the exception matching errors returned by Meta AI, if any.
+
+    Args:
+        errors (list): The errors, as returned by get_response_errors.
+        is_authed (bool): Whether the request was authenticated by a Facebook session rather than a temp
+            user access token.
+
+    Raises:
+        AccessTokenRejected: If the errors mean the access token was rejected.
+        MetaAIResponseError: For any other error.
+    """
+    if not errors:
+        return
+    if not is_authed and is_auth_error(errors):
+        raise AccessTokenRejected(f"Meta AI rejected the access token: {errors}")
+    raise MetaAIResponseError(f"Meta AI returned errors: {errors}")
+
+
 # Function to perform the login
 def get_fb_session(email, password, proxies=None):
+    # BeautifulSoup is only needed to log in, keep it off the import path.
+    try:
+        from bs4 import BeautifulSoup
+    except ImportError:
+        raise ImportError(
+            "Logging in with Facebook requires BeautifulSoup. "
+            "Install it with `pip install meta_ai_api[login]`."
+        ) from None
+
     login_url = "https://www.facebook.com/login/?next"
     headers = {
         "authority": "mbasic.facebook.com",
@@ -249,22 +664,11 @@ def get_cookies() -> dict:
     Returns:
         dict: A dictionary containing essential cookies.
     """
-    session = HTMLSession()
-    response = session.get("https://www.meta.ai/")
-    return {
-        "_js_datr": extract_value(
-            response.text, start_str='_js_datr":{"value":"', end_str='",'
-        ),
-        "abra_csrf": extract_value(
-            response.text, start_str='abra_csrf":{"value":"', end_str='",'
-        ),
-        "datr": extract_value(
-            response.text, start_str='datr":{"value":"', end_str='",'
-        ),
-        "lsd": extract_value(
-            response.text, start_str='"LSD",[],{"token":"', end_str='"}'
-        ),
-    }
+    with requests.get("https://www.meta.ai/", stream=True) as response:
+        return extract_tokens(
+            response.iter_content(chunk_size=16 * 1024),
+            ["_js_datr", "abra_csrf", "datr", "lsd"],
+        )
 
 
 def get_session(
@@ -289,3 +693,29 @@ def get_session(
         return session
     else:
         raise Exception("Proxy is not working.")
+
+
+def create_session(
+    proxy: Optional[Dict] = None, pool_maxsize: int = 16
+) -> requests.Session:
+    """
+    Creates a long-lived session that never stores cookies.
+
+    Every request to Meta AI sends its cookies explicitly, so ignoring the cookies set by responses keeps
+    identities isolated while the keep-alive connections are reused across prompts.
+
+    Args:
+        proxy (Dict): The proxy to use.
+        pool_maxsize (int): The number of connections kept alive per host. Defaults to 16.
+
+    Returns:
+        requests.Session: The session.
+    """
+    session = requests.Session()
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if proxy:
+        session.proxies = proxy
+    return session
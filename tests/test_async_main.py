@@ -0,0 +1,74 @@
+import asyncio
+import random
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from meta_ai_api.async_main import AsyncMetaAI  # noqa: E402
+
+
+class CountingMetaAI(AsyncMetaAI):
+    """
+    Answers prompts after a random delay without any request, counting the prompts in flight.
+    """
+
+    def __init__(self):
+        super().__init__(cookies={}, access_token="token")
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.started = 0
+
+    async def prompt(self, message, **kwargs):
+        self.started += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(random.uniform(0, 0.01))
+            if message == "fail":
+                raise ValueError("failed")
+            return {"message": f"answer to {message}"}
+        finally:
+            self.in_flight -= 1
+
+
+def test_prompt_many_keeps_input_order_within_concurrency():
+    async def main():
+        async with CountingMetaAI() as ai:
+            messages = [str(i) for i in range(50)] + ["fail"]
+            responses = await ai.prompt_many(iter(messages), concurrency=4)
+            return ai, messages, responses
+
+    ai, messages, responses = asyncio.run(main())
+    assert [r["message"] for r in responses[:-1]] == [
+        f"answer to {m}" for m in messages[:-1]
+    ]
+    assert isinstance(responses[-1], ValueError)
+    assert ai.max_in_flight == 4
+
+
+def test_prompt_many_unordered_pulls_messages_lazily():
+    def endless():
+        i = 0
+        while True:
+            yield str(i)
+            i += 1
+
+    async def main():
+        async with CountingMetaAI() as ai:
+            results = []
+            async for index, response in await ai.prompt_many(
+                endless(), concurrency=3, ordered=False
+            ):
+                assert response["message"] == f"answer to {index}"
+                results.append(index)
+                if len(results) == 20:
+                    break
+            await asyncio.sleep(0.05)
+            return ai, results
+
+    ai, results = asyncio.run(main())
+    assert len(set(results)) == 20
+    assert ai.max_in_flight == 3
+    # Only the messages pulled by the workers were prompted.
+    assert ai.started <= 20 + 3
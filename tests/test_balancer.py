@@ -0,0 +1,139 @@
+import threading
+import time
+import uuid
+
+import pytest
+
+from meta_ai_api import Identity, MetaAIPool
+from meta_ai_api.exceptions import (
+    FacebookRegionBlocked,
+    MetaAIResponseError,
+    NoIdentityAvailable,
+    PromptCancelled,
+    UnknownConversation,
+)
+
+
+class FakeSession:
+    def close(self):
+        pass
+
+
+class FakeConversation:
+    def __init__(self, client, external_conversation_id, offline_threading_id):
+        self.client = client
+        self.external_conversation_id = external_conversation_id
+        self.offline_threading_id = offline_threading_id
+
+    def prompt(self, message, new_conversation=False, cancel=None, **kwargs):
+        self.client.prompts.append((message, self.external_conversation_id))
+        if cancel is not None and cancel.is_set():
+            raise PromptCancelled("The prompt was cancelled.")
+        if self.client.error is not None:
+            raise self.client.error
+        if new_conversation:
+            self.external_conversation_id = str(uuid.uuid4())
+            self.offline_threading_id = "1"
+        return {"message": f"{self.client.proxy} answered {message}\n"}
+
+
+class FakeClient:
+    """
+    Stands in for MetaAI in the pool, answering every prompt without any request.
+    """
+
+    def __init__(self, fb_email=None, fb_password=None, proxy=None, **kwargs):
+        self.is_authed = fb_email is not None
+        self.proxy = proxy
+        self.session = FakeSession()
+        self.prompts = []
+        self.error = None
+
+    def _ensure_access_token(self):
+        pass
+
+    def conversation(self, external_conversation_id=None, offline_threading_id=None):
+        return FakeConversation(self, external_conversation_id, offline_threading_id)
+
+
+def make_pool(count=2, **kwargs) -> MetaAIPool:
+    identities = [Identity(proxy=f"proxy-{i}") for i in range(count)]
+    return MetaAIPool(identities, client_class=FakeClient, **kwargs)
+
+
+def test_cancelled_prompts_are_not_failures_of_the_identity():
+    pool = make_pool(count=1, max_failures=2)
+    cancel = threading.Event()
+    cancel.set()
+    for _ in range(3):
+        with pytest.raises(PromptCancelled):
+            pool.prompt("hi", cancel=cancel)
+    stats = pool.stats()[0]
+    assert stats["failures"] == 0
+    assert stats["ejected_for"] == 0
+    assert stats["in_flight"] == 0
+    assert pool.prompt("hi")["message"] == "proxy-0 answered hi\n"
+
+
+def test_follow_ups_stay_on_the_identity_of_their_conversation():
+    pool = make_pool(count=3)
+    first = pool.prompt("one")
+    second = pool.prompt("two")
+    # New conversations go to the least recently used identity.
+    assert first["message"] != second["message"]
+    for _ in range(3):
+        follow_up = pool.prompt("more", conversation_id=first["conversation_id"])
+        assert follow_up["message"] == first["message"].replace("one", "more")
+        assert follow_up["conversation_id"] == first["conversation_id"]
+
+
+def test_forgotten_conversations_are_unknown():
+    pool = make_pool(max_conversations=2)
+    first = pool.prompt("one")
+    pool.prompt("two")
+    pool.prompt("three")
+    with pytest.raises(UnknownConversation, match=first["conversation_id"]):
+        pool.prompt("more", conversation_id=first["conversation_id"])
+    fourth = pool.prompt("four")
+    pool.forget(fourth["conversation_id"])
+    with pytest.raises(KeyError):
+        pool.prompt("more", conversation_id=fourth["conversation_id"])
+
+
+def test_failing_identity_is_ejected():
+    pool = make_pool(count=2, max_failures=2, eject_time=60)
+    failing = pool.identities[0]
+    pool._get_client(failing).error = MetaAIResponseError("rejected")
+    with pytest.raises(MetaAIResponseError):
+        pool.prompt("one")
+    pool.prompt("two")
+    with pytest.raises(MetaAIResponseError):
+        pool.prompt("three")
+    assert pool.stats()[0]["ejected_for"] > 0
+    # Every new conversation now goes to the healthy identity.
+    for i in range(4):
+        assert pool.prompt(f"{i}")["message"].startswith("proxy-1")
+
+
+def test_region_blocked_identity_is_ejected_at_once():
+    pool = make_pool(count=2, max_failures=5)
+    pool._get_client(pool.identities[0]).error = FacebookRegionBlocked("blocked")
+    with pytest.raises(FacebookRegionBlocked):
+        pool.prompt("one")
+    assert pool.stats()[0]["ejected_for"] > 0
+    assert pool.stats()[1]["ejected_for"] == 0
+
+
+def test_follow_ups_wait_while_their_identity_is_ejected():
+    pool = make_pool(count=2, eject_time=0.3)
+    response = pool.prompt("one")
+    conversation_id = response["conversation_id"]
+    owner = pool._conversations[conversation_id][0]
+    owner.ejected_until = time.monotonic() + 0.3
+    with pytest.raises(NoIdentityAvailable):
+        pool.prompt("more", conversation_id=conversation_id, timeout=0.05)
+    assert owner.client.prompts[-1] == ("one", None)
+    started_at = time.monotonic()
+    follow_up = pool.prompt("more", conversation_id=conversation_id)
+    assert time.monotonic() - started_at >= 0.2
+    assert follow_up["message"] == response["message"].replace("one", "more")
@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from meta_ai_api import MemoryResponseCache, SQLiteResponseCache
+from meta_ai_api.cache import ResponseCache
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache(request, tmp_path) -> ResponseCache:
+    if request.param == "memory":
+        return MemoryResponseCache(maxsize=2)
+    return SQLiteResponseCache(str(tmp_path / "responses.db"), maxsize=2)
+
+
+def test_round_trip(cache):
+    response = {"message": "Hello\n", "sources": [{"link": "https://example.com"}]}
+    cache.set("key", response)
+    assert cache.get("key") == response
+    assert cache.get("missing") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_entries_are_copies(cache):
+    response = {"message": "Hello\n", "sources": []}
+    cache.set("key", response)
+    response["sources"].append("changed")
+    cached = cache.get("key")
+    cached["message"] = "changed"
+    assert cache.get("key") == {"message": "Hello\n", "sources": []}
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_entries_expire(cache):
+    cache.ttl = 0
+    cache.set("key", "value")
+    assert cache.get("key") is None
+
+
+def test_clear(cache):
+    cache.set("key", "value")
+    cache.clear()
+    assert cache.get("key") is None
+
+
+def test_prompt_key_separates_accounts():
+    key = ResponseCache.prompt_key
+    assert key("Hello  World", True, "anonymous") == key(
+        "hello world", True, "anonymous"
+    )
+    assert key("Hello", True, "a@example.com") != key("Hello", True, "b@example.com")
+    assert key("Hello", True, "anonymous") != key("Hello", False, "anonymous")
+
+
+def test_counters_are_exact_across_threads():
+    cache = MemoryResponseCache()
+    cache.set("hit", "value")
+
+    def read():
+        for i in range(1000):
+            cache.get("hit" if i % 2 else "miss")
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (cache.hits, cache.misses) == (4000, 4000)
@@ -0,0 +1,34 @@
+from types import SimpleNamespace
+
+from meta_ai_api import SingleFlight
+
+
+def client(fb_email=None, proxy=None):
+    return SimpleNamespace(
+        fb_email=fb_email, is_authed=fb_email is not None, proxy=proxy
+    )
+
+
+def test_prompt_key_normalizes_the_prompt():
+    key = SingleFlight.prompt_key
+    assert key("Hello  World", False, False, client()) == key(
+        "hello world", False, False, client()
+    )
+    assert key("Hello", False, False, client()) != key("Hello", True, False, client())
+    assert key("Hello", True, False, client()) != key("Hello", True, True, client())
+
+
+def test_prompt_key_separates_accounts_and_proxies():
+    key = SingleFlight.prompt_key
+    proxy = {"https": "http://proxy-1:8080"}
+    keys = {
+        key("Hello", False, False, client()),
+        key("Hello", False, False, client("a@example.com")),
+        key("Hello", False, False, client("b@example.com")),
+        key("Hello", False, False, client(proxy=proxy)),
+        key("Hello", False, False, client(proxy={"https": "http://proxy-2:8080"})),
+    }
+    assert len(keys) == 5
+    assert key("Hello", False, False, client(proxy=dict(proxy))) == key(
+        "Hello", False, False, client(proxy=proxy)
+    )
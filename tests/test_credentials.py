@@ -0,0 +1,148 @@
+import threading
+import time
+
+import pytest
+from fake_server import FakeMetaAI
+
+from meta_ai_api import FileCredentialStore, MetaAI, RetryPolicy, SQLiteCredentialStore
+from meta_ai_api.exceptions import MetaAIResponseError
+
+
+class FakeClock:
+    def __init__(self):
+        # Starts in step with the clock the clients compare the token expiry to.
+        self.now = time.time()
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def open_store(kind: str, tmp_path, clock: FakeClock, **kwargs):
+    if kind == "file":
+        return FileCredentialStore(
+            str(tmp_path / "credentials.json"), clock=clock, **kwargs
+        )
+    return SQLiteCredentialStore(
+        str(tmp_path / "credentials.db"), clock=clock, **kwargs
+    )
+
+
+@pytest.fixture(params=["file", "sqlite"])
+def kind(request) -> str:
+    return request.param
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+def test_credentials_expire(kind, tmp_path, clock):
+    store = open_store(kind, tmp_path, clock, ttls={"lsd": 60})
+    store.update("anonymous", {"lsd": "a", "datr": "b"})
+    store.set("anonymous", "access_token", "token", ttl=10)
+    assert store.get_all("anonymous") == {
+        "lsd": "a",
+        "datr": "b",
+        "access_token": "token",
+    }
+    assert store.get_expiry("anonymous", "access_token") == clock.now + 10
+    clock.now += 10
+    assert store.get("anonymous", "access_token") is None
+    assert store.get_expiry("anonymous", "access_token") is None
+    assert store.get("anonymous", "lsd") == "a"
+    clock.now += 50
+    assert store.get_all("anonymous") == {"datr": "b"}
+
+
+def test_credentials_are_kept_per_account(kind, tmp_path, clock):
+    store = open_store(kind, tmp_path, clock)
+    store.set("anonymous", "lsd", "a")
+    store.set("someone@example.com", "lsd", "b")
+    store.set("someone@example.com", "abra_sess", "c")
+    store.delete("someone@example.com", "lsd")
+    assert store.get_all("someone@example.com") == {"abra_sess": "c"}
+    store.delete("someone@example.com")
+    assert store.get_all("someone@example.com") == {}
+    assert store.get_all("anonymous") == {"lsd": "a"}
+
+
+def test_stores_survive_reopening(kind, tmp_path, clock):
+    open_store(kind, tmp_path, clock).set("anonymous", "lsd", "a")
+    assert open_store(kind, tmp_path, clock).get("anonymous", "lsd") == "a"
+
+
+def test_concurrent_writers_keep_every_write(kind, tmp_path, clock):
+    # Two stores on the same path, as in two processes, do not share their thread lock.
+    stores = [open_store(kind, tmp_path, clock) for _ in range(2)]
+    writes = 25
+
+    def write(index: int):
+        store = stores[index % len(stores)]
+        for i in range(writes):
+            store.set("anonymous", f"name-{index}-{i}", str(i))
+
+    threads = [threading.Thread(target=write, args=(index,)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(stores[0].get_all("anonymous")) == 4 * writes
+
+
+class RejectedOnceMetaAI(MetaAI):
+    """
+    Fails the first attempt as if Meta AI rejected the session.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.attempts = 0
+        super().__init__(*args, **kwargs)
+
+    def _send_prompt(self, *args, **kwargs):
+        self.attempts += 1
+        if self.attempts == 1:
+            raise MetaAIResponseError("Unable to parse the response.")
+        return super()._send_prompt(*args, **kwargs)
+
+
+def test_rejected_session_is_renewed_from_the_server(tmp_path, clock):
+    store = open_store("file", tmp_path, clock)
+    with FakeMetaAI(answer_words=5, landing_page_size=1024) as server:
+        client_class = server.client_class(RejectedOnceMetaAI)
+        retry_policy = RetryPolicy(base_delay=0, jitter=False)
+        ai = client_class(credential_store=store, retry_policy=retry_policy)
+        stale_cookies = dict(ai.cookies)
+        stale_token = ai.get_access_token()
+        assert store.get("anonymous", "access_token") == stale_token
+
+        response = ai.prompt("Hello")
+
+        assert response["message"]
+        assert ai.attempts == 2
+        # The cached cookies and token were dropped and fetched again before the retry.
+        assert server.requests["landing_page"] == 2
+        assert server.requests["useAbraAcceptTOSForTempUserMutation"] == 2
+        assert ai.access_token != stale_token
+        assert store.get("anonymous", "access_token") == ai.access_token
+        assert store.get("anonymous", "lsd") == ai.cookies["lsd"]
+        assert ai.cookies.keys() == stale_cookies.keys()
+
+
+def test_cached_credentials_skip_the_bootstrap(tmp_path, clock):
+    store = open_store("sqlite", tmp_path, clock)
+    with FakeMetaAI(landing_page_size=1024) as server:
+        client_class = server.client_class()
+        first = client_class(credential_store=store)
+        access_token = first.get_access_token()
+        second = client_class(credential_store=store)
+        assert second.get_access_token() == access_token
+        assert second.cookies == first.cookies
+        assert server.requests["landing_page"] == 1
+        assert server.requests["useAbraAcceptTOSForTempUserMutation"] == 1
+
+        # Past their lifetime, the cached credentials are fetched again.
+        clock.now += 30 * 24 * 3600
+        third = client_class(credential_store=store)
+        assert third.get_access_token() != access_token
+        assert server.requests["landing_page"] == 2
@@ -0,0 +1,105 @@
+import json
+import sqlite3
+
+import pytest
+
+from meta_ai_api import JSONLHistoryStore, SQLiteHistoryStore
+from meta_ai_api.history import ASSISTANT, USER
+
+SOURCE = {"link": "https://example.com", "title": "Example"}
+MEDIA = {"url": "https://example.com/image.jpeg", "type": "IMAGE"}
+
+
+def response(text: str, sources=(SOURCE,), media=()) -> dict:
+    return {"message": text, "sources": list(sources), "media": list(media)}
+
+
+def open_store(kind: str, tmp_path):
+    if kind == "jsonl":
+        return JSONLHistoryStore(str(tmp_path / "history.jsonl"))
+    return SQLiteHistoryStore(str(tmp_path / "history.db"))
+
+
+@pytest.fixture(params=["jsonl", "sqlite"])
+def kind(request) -> str:
+    return request.param
+
+
+def test_round_trip(kind, tmp_path):
+    store = open_store(kind, tmp_path)
+    store.record("a", "Hello", response("Hi there\n", media=[MEDIA]))
+    store.record("b", "Other", response("Answer\n", sources=()))
+    store.record("a", "And?", response("More\n"))
+    turns = store.page("a")
+    assert [(t.index, t.role, t.text) for t in turns] == [
+        (0, USER, "Hello"),
+        (1, ASSISTANT, "Hi there\n"),
+        (2, USER, "And?"),
+        (3, ASSISTANT, "More\n"),
+    ]
+    assert turns[1].to_dict()["sources"] == [SOURCE]
+    assert turns[1].to_dict()["media"] == [MEDIA]
+    assert turns[0].sources == ()
+    assert store.count("a") == 4
+    assert store.count("b") == 2
+    assert store.count("unknown") == 0
+    assert store.page("unknown") == []
+
+
+def test_pages(kind, tmp_path):
+    store = open_store(kind, tmp_path)
+    for i in range(5):
+        store.record("a", f"prompt {i}", response(f"answer {i}\n"))
+    page = store.page("a", offset=3, limit=4)
+    assert [t.index for t in page] == [3, 4, 5, 6]
+    assert page[0].text == "answer 1\n"
+    assert store.page("a", offset=10) == []
+
+
+def test_turns_survive_reopening(kind, tmp_path):
+    store = open_store(kind, tmp_path)
+    store.record("a", "Hello", response("Hi\n"))
+    if kind == "jsonl":
+        store.close()
+    store = open_store(kind, tmp_path)
+    store.record("a", "Again", response("Hi again\n"))
+    assert [t.text for t in store.page("a")] == ["Hello", "Hi\n", "Again", "Hi again\n"]
+    assert store.page("a")[3].sources[0] == SOURCE
+
+
+def test_sources_are_stored_once_and_shared(kind, tmp_path):
+    store = open_store(kind, tmp_path)
+    for i in range(3):
+        store.record(f"c{i}", "Hello", response("Hi\n", sources=[dict(SOURCE)]))
+    if kind == "jsonl":
+        with open(tmp_path / "history.jsonl") as f:
+            entries = [json.loads(line) for line in f]
+        assert sum("source" in entry for entry in entries) == 1
+    else:
+        connection = sqlite3.connect(str(tmp_path / "history.db"))
+        try:
+            assert connection.execute(
+                "SELECT COUNT(*) FROM history_sources"
+            ).fetchone() == (1,)
+        finally:
+            connection.close()
+    sources = [store.page(f"c{i}")[1].sources[0] for i in range(3)]
+    assert all(source is sources[0] for source in sources)
+    with pytest.raises(TypeError):
+        sources[0]["title"] = "changed"
+
+
+def test_jsonl_drops_a_write_cut_short(tmp_path):
+    path = tmp_path / "history.jsonl"
+    store = JSONLHistoryStore(str(path))
+    store.record("a", "Hello", response("Hi\n"))
+    store.close()
+    with open(path, "ab") as f:
+        f.write(b'{"c":"a","r":"user","t":"cut')
+    store = JSONLHistoryStore(str(path))
+    assert store.count("a") == 2
+    store.record("a", "Again", response("Hi again\n"))
+    store.close()
+    store = JSONLHistoryStore(str(path))
+    assert [t.text for t in store.page("a")] == ["Hello", "Hi\n", "Again", "Hi again\n"]
+    store.close()
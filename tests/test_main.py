@@ -0,0 +1,57 @@
+import threading
+import time
+
+import pytest
+from fake_server import FakeMetaAI
+
+THREADS = 8
+
+
+@pytest.fixture
+def server():
+    # The latency keeps the refresh in flight while every thread asks for a token.
+    with FakeMetaAI(latency=0.2, landing_page_size=1024) as server:
+        yield server
+
+
+def tokens_from_threads(ai) -> list:
+    barrier = threading.Barrier(THREADS)
+    tokens = [None] * THREADS
+
+    def get_token(index: int):
+        barrier.wait()
+        tokens[index] = ai.get_access_token()
+
+    threads = [threading.Thread(target=get_token, args=(i,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return tokens
+
+
+def test_expired_token_is_refreshed_once(server):
+    ai = server.client_class()()
+    stale = ai.get_access_token()
+    ai.access_token_expires_at = time.time() - 1
+
+    tokens = tokens_from_threads(ai)
+
+    assert server.requests["useAbraAcceptTOSForTempUserMutation"] == 2
+    assert set(tokens) == {ai.access_token}
+    assert ai.access_token != stale
+    assert ai.access_token_expires_at > time.time()
+
+
+def test_token_about_to_expire_is_refreshed_once_in_the_background(server):
+    ai = server.client_class()(refresh_margin=300)
+    stale = ai.get_access_token()
+    ai.access_token_expires_at = time.time() + 60
+
+    tokens = tokens_from_threads(ai)
+
+    # The stale token is still valid, so nobody waits for the refresh.
+    assert set(tokens) == {stale}
+    ai._refresh_thread.join()
+    assert server.requests["useAbraAcceptTOSForTempUserMutation"] == 2
+    assert ai.access_token != stale
@@ -0,0 +1,123 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from meta_ai_api import RateLimiter, SQLiteRateLimiter
+from meta_ai_api.exceptions import RateLimited
+from meta_ai_api.ratelimit import LOGIN, SEND, SOURCES, take_token
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_limiter(request, tmp_path, clock):
+    def make(**kwargs) -> RateLimiter:
+        if request.param == "memory":
+            return RateLimiter(clock=clock, **kwargs)
+        return SQLiteRateLimiter(str(tmp_path / "limits.db"), clock=clock, **kwargs)
+
+    return make
+
+
+def test_take_token_refills_up_to_the_burst():
+    assert take_token(2, 0, 0, rate=1, burst=2) == (1, 0)
+    assert take_token(0, 0, 10, rate=1, burst=2) == (1, 0)
+    tokens, wait = take_token(0, 0, 0, rate=2, burst=2)
+    assert (tokens, wait) == (-1, 0.5)
+
+
+def test_burst_then_paced_waits(make_limiter, clock):
+    limiter = make_limiter(send=(2, 3))
+    assert [limiter.reserve(SEND) for _ in range(3)] == [0, 0, 0]
+    # Each request past the burst reserves the next token, so waits grow in order.
+    assert [limiter.reserve(SEND) for _ in range(3)] == [0.5, 1.0, 1.5]
+    assert limiter.waiting == 3
+    for _ in range(3):
+        limiter.done_waiting()
+    clock.now += 10
+    assert [limiter.reserve(SEND) for _ in range(3)] == [0, 0, 0]
+    assert limiter.reserve(SEND) == 0.5
+
+
+def test_kinds_have_their_own_budget(make_limiter):
+    limiter = make_limiter(send=(1, 1), login=(1, 1))
+    assert limiter.reserve(SEND) == 0
+    assert limiter.reserve(LOGIN) == 0
+    # Kinds without a limit are never throttled.
+    assert [limiter.reserve(SOURCES) for _ in range(10)] == [0] * 10
+
+
+def test_requests_over_the_timeout_are_rejected_without_a_token(make_limiter, clock):
+    limiter = make_limiter(send=(1, 1), timeout=1.5)
+    assert limiter.reserve(SEND) == 0
+    assert limiter.reserve(SEND) == 1
+    with pytest.raises(RateLimited):
+        limiter.reserve(SEND)
+    assert limiter.rejected == 1
+    # The rejected request took no token.
+    clock.now += 1
+    assert limiter.reserve(SEND) == 1
+    # A longer timeout per request overrides the one of the limiter.
+    assert limiter.reserve(SEND, timeout=5) == 2
+
+
+def test_waiters_are_bounded(make_limiter):
+    limiter = make_limiter(send=(1, 1), max_waiters=2)
+    assert limiter.reserve(SEND) == 0
+    limiter.reserve(SEND)
+    limiter.reserve(SEND)
+    with pytest.raises(RateLimited):
+        limiter.reserve(SEND)
+    limiter.done_waiting()
+    assert limiter.reserve(SEND) == 3
+
+
+def test_acquire_sleeps_and_stops_waiting(make_limiter, monkeypatch):
+    slept = []
+    # Replaces the time module of ratelimit only, the clock is the fake one.
+    monkeypatch.setattr(
+        "meta_ai_api.ratelimit.time", SimpleNamespace(sleep=slept.append)
+    )
+    limiter = make_limiter(send=(4, 1))
+    limiter.acquire(SEND)
+    limiter.acquire(SEND)
+    assert slept == [0.25]
+    assert limiter.waiting == 0
+
+
+def test_acquire_async_stops_waiting_when_cancelled(make_limiter):
+    limiter = make_limiter(send=(1, 1))
+
+    async def main():
+        await limiter.acquire_async(SEND)
+        task = asyncio.ensure_future(limiter.acquire_async(SEND))
+        await asyncio.sleep(0)
+        assert limiter.waiting == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert limiter.waiting == 0
+
+
+def test_processes_share_the_sqlite_buckets(tmp_path, clock):
+    path = str(tmp_path / "limits.db")
+    first = SQLiteRateLimiter(path, send=(1, 2), clock=clock)
+    second = SQLiteRateLimiter(path, send=(1, 2), clock=clock)
+    assert first.reserve(SEND) == 0
+    assert second.reserve(SEND) == 0
+    assert first.reserve(SEND) == 1
+    assert second.reserve(SEND) == 2
@@ -0,0 +1,187 @@
+import random
+
+import pytest
+import requests
+
+from meta_ai_api import RetryPolicy
+from meta_ai_api.exceptions import (
+    CircuitOpen,
+    MetaAIResponseError,
+    PromptCancelled,
+    RetriesExhausted,
+)
+from meta_ai_api.retry import FATAL, GRAPHQL, TRANSPORT
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_policy(**kwargs) -> RetryPolicy:
+    kwargs.setdefault("base_delay", 0)
+    kwargs.setdefault("jitter", False)
+    return RetryPolicy(**kwargs)
+
+
+def test_classify():
+    policy = RetryPolicy()
+    assert policy.classify(MetaAIResponseError()) == GRAPHQL
+    assert policy.classify(requests.ConnectionError()) == TRANSPORT
+    assert policy.classify(ValueError()) == FATAL
+
+
+def test_backoff_grows_exponentially_up_to_the_maximum():
+    policy = RetryPolicy(base_delay=1, max_delay=5, jitter=False)
+    assert [policy.backoff(attempt) for attempt in range(5)] == [1, 2, 4, 5, 5]
+
+
+def test_backoff_jitter():
+    policy = RetryPolicy(base_delay=1, max_delay=30, rng=random.Random(1))
+    delays = [policy.backoff(3) for _ in range(20)]
+    assert all(4 <= delay <= 8 for delay in delays)
+    assert len(set(delays)) > 1
+    same_seed = RetryPolicy(base_delay=1, max_delay=30, rng=random.Random(1))
+    assert [same_seed.backoff(3) for _ in range(20)] == delays
+
+
+def test_call_retries_until_success():
+    policy = make_policy()
+    errors = [requests.ConnectionError(), MetaAIResponseError()]
+    retries = []
+
+    def send():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    assert (
+        policy.call(send, on_retry=lambda e, attempt: retries.append(attempt)) == "ok"
+    )
+    assert retries == [0, 1]
+
+
+def test_call_gives_up_after_max_retries():
+    policy = make_policy(max_retries=2, failure_threshold=0)
+    calls = []
+
+    def send():
+        calls.append(1)
+        raise requests.ConnectionError()
+
+    with pytest.raises(RetriesExhausted):
+        policy.call(send)
+    assert len(calls) == 3
+
+
+def test_fatal_errors_are_not_retried():
+    policy = make_policy()
+    calls = []
+
+    def send():
+        calls.append(1)
+        raise ValueError("bug")
+
+    with pytest.raises(ValueError):
+        policy.call(send)
+    assert len(calls) == 1
+    assert policy.consecutive_failures == 0
+
+
+def test_retry_budget_is_spent_and_refilled():
+    policy = make_policy(budget_max=2, budget_ratio=0.5, failure_threshold=0)
+    assert policy.should_retry(TRANSPORT, 0)
+    assert policy.should_retry(TRANSPORT, 0)
+    assert not policy.should_retry(TRANSPORT, 0)
+    policy.record_success()
+    assert not policy.should_retry(TRANSPORT, 0)
+    policy.record_success()
+    assert policy.should_retry(TRANSPORT, 0)
+    for _ in range(10):
+        policy.record_success()
+    assert policy.budget == 2
+
+
+def test_should_retry_only_retryable_kinds():
+    policy = make_policy(max_retries=1)
+    assert not policy.should_retry(FATAL, 0)
+    assert not policy.should_retry(TRANSPORT, 1)
+
+
+def open_circuit(policy: RetryPolicy):
+    for _ in range(policy.failure_threshold):
+        policy.before_attempt()
+        policy.record_failure()
+
+
+def test_circuit_opens_after_consecutive_failures():
+    clock = FakeClock()
+    policy = make_policy(failure_threshold=3, reset_timeout=30, clock=clock)
+    open_circuit(policy)
+    with pytest.raises(CircuitOpen):
+        policy.before_attempt()
+    assert not policy.should_retry(TRANSPORT, 0)
+    clock.now += 29
+    with pytest.raises(CircuitOpen):
+        policy.before_attempt()
+
+
+def test_half_open_circuit_lets_a_single_trial_through():
+    clock = FakeClock()
+    policy = make_policy(failure_threshold=3, reset_timeout=30, clock=clock)
+    open_circuit(policy)
+    clock.now += 30
+    assert policy.before_attempt()
+    for _ in range(3):
+        with pytest.raises(CircuitOpen):
+            policy.before_attempt()
+    policy.record_success()
+    assert not policy.before_attempt()
+    assert not policy.before_attempt()
+
+
+def test_failed_trial_opens_the_circuit_again():
+    clock = FakeClock()
+    policy = make_policy(failure_threshold=3, reset_timeout=30, clock=clock)
+    open_circuit(policy)
+    clock.now += 30
+    assert policy.before_attempt()
+    policy.record_failure()
+    with pytest.raises(CircuitOpen):
+        policy.before_attempt()
+    clock.now += 30
+    assert policy.before_attempt()
+
+
+def test_trial_ended_without_outcome_lets_another_one_through():
+    clock = FakeClock()
+    policy = make_policy(failure_threshold=3, reset_timeout=30, clock=clock)
+    open_circuit(policy)
+    clock.now += 30
+
+    def cancelled():
+        raise PromptCancelled()
+
+    with pytest.raises(PromptCancelled):
+        policy.call(cancelled)
+    calls = []
+    assert policy.call(lambda: calls.append(1) or "ok") == "ok"
+    assert calls == [1]
+    assert policy.opened_at is None
+
+
+def test_trial_interrupted_lets_another_one_through():
+    clock = FakeClock()
+    policy = make_policy(failure_threshold=3, reset_timeout=30, clock=clock)
+    open_circuit(policy)
+    clock.now += 30
+
+    def interrupted():
+        raise KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt):
+        policy.call(interrupted)
+    assert policy.before_attempt()
@@ -0,0 +1,81 @@
+import queue
+
+import pytest
+from fake_server import FakeMetaAI
+
+from meta_ai_api import MetaAI, serve
+from meta_ai_api.serve import DONE, ERROR, Dispatcher
+
+# Seconds to wait for a worker process to answer.
+ANSWER_TIMEOUT = 60
+
+
+class LocalMetaAI(MetaAI):
+    """
+    A client of the stand-in server, importable by the spawned workers.
+    """
+
+    def __init__(self, base_url: str, **kwargs):
+        self.meta_ai_url = f"{base_url}/"
+        self.graphql_url = f"{base_url}/api/graphql/"
+        self.graph_api_url = f"{base_url}/graphql?locale=user"
+        super().__init__(**kwargs)
+
+
+def answer(messages: queue.Queue):
+    return messages.get(timeout=ANSWER_TIMEOUT)
+
+
+@pytest.fixture
+def server():
+    with FakeMetaAI(answer_words=5, landing_page_size=1024) as server:
+        yield server
+
+
+@pytest.fixture
+def dispatcher(server, monkeypatch):
+    # The test restarts the workers itself.
+    monkeypatch.setattr(serve, "WORKER_CHECK_INTERVAL", 3600)
+    dispatcher = Dispatcher(
+        workers=1,
+        threads=2,
+        client_class=LocalMetaAI,
+        client_kwargs={"base_url": server.url},
+    )
+    dispatcher.start()
+    yield dispatcher
+    dispatcher.stop(timeout=5)
+
+
+def test_worker_answers(dispatcher):
+    _, messages = dispatcher.submit("conversation", "Hello", stream=False)
+    kind, response = answer(messages)
+    assert kind == DONE
+    assert response["message"]
+    assert dispatcher.pending() == [0]
+
+
+def test_restarted_worker_drops_the_jobs_of_the_dead_one(dispatcher, server):
+    _, messages = dispatcher.submit("conversation", "Hello", stream=False)
+    assert answer(messages)[0] == DONE
+    # The worker releases the lock of the results queue only after the answer is read, killing it
+    # earlier would leave the lock held by no one.
+    with dispatcher._results._wlock:
+        pass
+    process = dispatcher._processes[0]
+    process.kill()
+    process.join(ANSWER_TIMEOUT)
+
+    # Queued for the dead worker, failed by the restart.
+    _, lost = dispatcher.submit("conversation", "Lost", stream=False)
+    assert dispatcher.pending() == [1]
+    dispatcher._restart_dead_workers()
+    kind, (status, error_type, _) = answer(lost)
+    assert (kind, status, error_type) == (ERROR, 502, "worker_error")
+    assert dispatcher.pending() == [0]
+
+    _, messages = dispatcher.submit("conversation", "Again", stream=False)
+    assert answer(messages)[0] == DONE
+    assert dispatcher.pending() == [0]
+    # The new worker only answered the prompt sent after the restart.
+    assert server.requests["useAbraSendMessageMutation"] == 2
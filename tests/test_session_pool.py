@@ -0,0 +1,46 @@
+import pytest
+from fake_server import FakeMetaAI
+
+from meta_ai_api import MetaAI, SessionPool
+
+
+def closing_client_class(server: FakeMetaAI, closed: list):
+    class ClosingMetaAI(MetaAI):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            close = self.session.close
+
+            def record_close():
+                closed.append(self)
+                close()
+
+            self.session.close = record_close
+
+    return server.client_class(ClosingMetaAI)
+
+
+def test_bootstrap_closes_the_client_session():
+    closed = []
+    with FakeMetaAI(landing_page_size=1024) as server:
+        pool = SessionPool(
+            start=False, client_class=closing_client_class(server, closed)
+        )
+        bundle = pool.bootstrap()
+    assert bundle.access_token
+    assert bundle.cookies
+    assert len(closed) == 1
+
+
+def test_bootstrap_closes_the_client_session_on_failure():
+    closed = []
+    with FakeMetaAI(landing_page_size=1024) as server:
+        client_class = closing_client_class(server, closed)
+
+        class FailingMetaAI(client_class):
+            def get_access_token(self):
+                raise ConnectionError("refused")
+
+        pool = SessionPool(start=False, client_class=FailingMetaAI)
+        with pytest.raises(ConnectionError):
+            pool.bootstrap()
+    assert len(closed) == 1
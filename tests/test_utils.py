@@ -0,0 +1,188 @@
+import json
+
+import pytest
+
+from fake_server import build_landing_page, build_message_stream
+from meta_ai_api.exceptions import MissingTokenError
+from meta_ai_api.utils import (
+    LANDING_PAGE_TOKENS,
+    LastResponseReader,
+    MessageDeltas,
+    TokenExtractor,
+    extract_tokens,
+    extract_value,
+    format_response,
+    get_bot_response_message,
+)
+
+LANDING_PAGE_VALUES = {
+    "_js_datr": "fake_js_datr",
+    "datr": "fake_datr",
+    "abra_csrf": "fake_abra_csrf",
+    "lsd": "fake_lsd",
+    "fb_dtsg": "fake_fb_dtsg",
+}
+
+
+def snapshot(*blocks: str) -> dict:
+    content = [{"text": text} for text in blocks]
+    return {
+        "data": {
+            "node": {"bot_response_message": {"composed_text": {"content": content}}}
+        }
+    }
+
+
+def test_message_deltas_add_up_to_the_message():
+    lines = [
+        json.loads(line) for line in build_message_stream("conversation", words=50)
+    ]
+    deltas = MessageDeltas()
+    text = ""
+    for line in lines:
+        delta, reset = deltas.feed(line)
+        assert not reset
+        text += delta
+    text += deltas.finish()
+    assert text == format_response(lines[-1])
+    assert deltas.message == text
+
+
+def test_message_deltas_close_the_previous_block():
+    deltas = MessageDeltas()
+    assert deltas.feed(snapshot("Hello")) == ("Hello", False)
+    assert deltas.feed(snapshot("Hello world")) == (" world", False)
+    assert deltas.feed(snapshot("Hello world", "Bye")) == ("\nBye", False)
+    assert deltas.feed(snapshot("Hello world", "Bye")) == ("", False)
+    assert deltas.finish() == "\n"
+    assert deltas.message == "Hello world\nBye\n"
+
+
+def test_message_deltas_reset_on_rewrite():
+    deltas = MessageDeltas()
+    deltas.feed(snapshot("Hello world", "Bye"))
+    # A block before the last one changed.
+    assert deltas.feed(snapshot("Hi world", "Bye now")) == ("Hi world\nBye now", True)
+    # The last block no longer starts with the text sent.
+    assert deltas.feed(snapshot("Hi world", "See you")) == ("Hi world\nSee you", True)
+    # Blocks were removed.
+    assert deltas.feed(snapshot("Hi")) == ("Hi", True)
+    assert deltas.finish() == "\n"
+
+
+def test_message_deltas_without_content():
+    deltas = MessageDeltas()
+    assert deltas.feed({}) == ("", False)
+    assert deltas.finish() == ""
+    assert deltas.message == ""
+
+
+def read_lines(lines) -> LastResponseReader:
+    reader = LastResponseReader()
+    for line in lines:
+        reader.feed(line.rstrip(b"\n"))
+    return reader
+
+
+def test_last_response_reader_keeps_the_last_snapshot():
+    lines = build_message_stream("conversation", words=20)
+    reader = read_lines(lines)
+    message = get_bot_response_message(reader.last_response)
+    assert message["streaming_state"] == "OVERALL_DONE"
+    assert message["fetch_id"] == "fake_fetch_id"
+    assert format_response(reader.last_response) == format_response(
+        json.loads(lines[-1])
+    )
+    assert reader.errors == []
+
+
+def test_last_response_reader_reads_str_lines():
+    lines = build_message_stream("conversation", words=5)
+    reader = LastResponseReader()
+    for line in lines:
+        reader.feed(line.decode().rstrip("\n"))
+    expected = json.loads(lines[-1])
+    assert format_response(reader.last_response) == format_response(expected)
+
+
+def test_last_response_reader_conversation_ids():
+    lines = build_message_stream("conversation", words=5)
+    offline_threading_id = json.loads(lines[0])["data"]["node"]["bot_response_message"][
+        "id"
+    ].split("_")[1]
+    reader = read_lines(lines)
+    assert reader.conversation_ids() == ("conversation", offline_threading_id)
+
+
+def test_last_response_reader_stream_cut_short():
+    lines = build_message_stream("conversation", words=5)
+    reader = read_lines(lines[:-1] + [b""])
+    assert reader.last_response is None
+    # The IDs are still read from the last line.
+    assert reader.conversation_ids()[0] == "conversation"
+
+
+def test_last_response_reader_errors():
+    reader = read_lines([b'{"errors":[{"message":"Invalid token","code":190}]}'])
+    assert reader.errors == [{"message": "Invalid token", "code": 190}]
+    assert reader.last_response is None
+    assert reader.conversation_ids() is None
+
+
+def chunked(data: bytes, size: int):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1000, 64 * 1024])
+def test_token_extractor_finds_tokens_split_across_chunks(chunk_size):
+    page = build_landing_page(4096)
+    assert extract_tokens(chunked(page, chunk_size), LANDING_PAGE_TOKENS) == (
+        LANDING_PAGE_VALUES
+    )
+
+
+def test_token_extractor_is_done_once_every_token_is_found():
+    page = build_landing_page(8192)
+    extractor = TokenExtractor(["lsd", "datr"])
+    assert not extractor.done
+    for chunk in chunked(page, 512):
+        if extractor.feed(chunk):
+            break
+    assert extractor.done
+    assert extractor.result() == {"lsd": "fake_lsd", "datr": "fake_datr"}
+
+
+def test_token_extractor_stops_reading_after_the_last_token():
+    page = build_landing_page(4096) + b"x" * 4096
+    chunks = chunked(page, 256)
+    read = []
+
+    def reading():
+        for chunk in chunks:
+            read.append(chunk)
+            yield chunk
+
+    assert extract_tokens(reading(), ["lsd"]) == {"lsd": "fake_lsd"}
+    assert len(read) < len(chunks)
+
+
+def test_token_extractor_reports_missing_tokens():
+    page = build_landing_page(4096).replace(b'"LSD"', b'"XSD"')
+    extractor = TokenExtractor(LANDING_PAGE_TOKENS)
+    for chunk in chunked(page, 100):
+        extractor.feed(chunk)
+    assert not extractor.done
+    with pytest.raises(MissingTokenError, match="lsd"):
+        extractor.result()
+
+
+def test_extract_value():
+    text = '{"state":"abc","other":"x"}'
+    assert extract_value(text, start_str='"state":"', end_str='"') == "abc"
+    assert extract_value('"state":""', start_str='"state":"', end_str='"') == ""
+
+
+@pytest.mark.parametrize("text", ["", '{"other":"x"}', '{"state":"abc'])
+def test_extract_value_reports_missing_values(text):
+    with pytest.raises(MissingTokenError, match="state"):
+        extract_value(text, start_str='"state":"', end_str='"')